@@ -1,24 +1,100 @@
 import os
+import asyncio
+import threading
+import weakref
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 
 # Load environment variables from .env file, where we should define the key
 load_dotenv()
 
-client = OpenAI()
+# Connection pool and timeout settings shared by every API call in the process
+POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "60"))
 
-def get_agent_client():
-    """
-    Initializes and returns the OpenAI client configured for the gpt-4.0-mini API.
-    """
+_client_lock = threading.Lock()
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+def _get_api_key():
     api_key = os.getenv("OPENAI_API_KEY")
 
     if not api_key:
         raise ValueError("Missing OPENAI_API_KEY in environment variables.")
+    return api_key
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
 
-    client = OpenAI(api_key=api_key)
+def _timeout():
+    return httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+def get_agent_client():
+    """
+    Returns the process-wide OpenAI client, creating it on first use.
+    All loaders and threads share its pool of keep-alive connections.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=_get_api_key(),
+                    timeout=_timeout(),
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=_pool_limits(), timeout=_timeout())
+                )
+    return _client
+
+def get_async_agent_client():
+    """
+    Returns the AsyncOpenAI client for the running event loop, creating it on first use.
+    Async connections are bound to their loop, so each loop gets its own pooled client.
+    """
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=_get_api_key(),
+                timeout=_timeout(),
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=_pool_limits(), timeout=_timeout())
+            )
+            _async_clients[loop] = client
     return client
 
 # Model and temperature settings
 MODEL_NAME = "gpt-5"
 TEMPERATURE = 1
+
+# Backend used by every loader: 'openai', 'async' or 'mock' (offline, deterministic)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+MOCK_LATENCY_SECONDS = float(os.getenv("MOCK_LATENCY_SECONDS", "0"))
+
+# Response format sent with each request: 'json_schema' (the game's strict output schema) or
+# 'json_object' (any JSON object, for models without structured outputs)
+RESPONSE_FORMAT_MODE = os.getenv("PREDICTION_RESPONSE_FORMAT", "json_schema")
+
+# Maximum number of prediction calls in flight at once
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "8"))
+
+# Rate limits per model (0 disables a limit) and retries; the clients above do not retry on
+# their own so that predictions/rate_limiter.py schedules every attempt
+REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TPM_LIMIT", "500000"))
+# MAX_RETRIES is the number of attempts per call; at least one is always made
+MAX_RETRIES = max(1, int(os.getenv("OPENAI_MAX_RETRIES", "6")))
+
+# Response cache: 'readwrite' (default), 'replay' (cached responses only, no API calls) or 'off'
+CACHE_MODE = os.getenv("PREDICTION_CACHE_MODE", "readwrite")
+CACHE_FILE = os.getenv("PREDICTION_CACHE_FILE", "prediction_cache.sqlite")
+CACHE_MAX_AGE_DAYS = float(os.getenv("PREDICTION_CACHE_MAX_AGE_DAYS", "180"))
+CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "500000"))
@@ -0,0 +1,181 @@
+# Precomputed accuracy cube over game, model, run, session bucket and level
+#
+# Usage:
+#     python accuracy_cube.py build
+#     python accuracy_cube.py query [--game meg] [--model gpt-5] [--level group] [--runs 1-50]
+#                                   [--sessions 1-24] [--by model,run_number]
+#
+# build reads the results of every game once and stores the correct and total prediction counts
+# of each (game, model, run_number, session_bucket, level) cell in accuracy_cube.csv. A session
+# bucket is a range of SESSION_BUCKET_SIZE sessions of a run, ordered by session_id ('1-24' are
+# the first 24). The levels follow the analysis scripts: MEG 'individual' and 'group', PD
+# 'individual' and 'team', TG 'session'. query sums the cells of any slice, so per-model,
+# per-run or first-sessions accuracies never touch the row-level results again.
+#
+# Rows are sliced by the model column the prediction scripts write. Runs saved before it existed
+# are assigned the model of their run range in LEGACY_RUN_MODELS (see AnalysisComponent.md).
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import analyze_minimum_effort
+import analyze_trust_game
+from analyze_minimum_effort import add_actual_team_choice, group_correctness, group_ids, first_rows, session_positions
+from data_cache import load_reports
+from games import parse_run_range
+from results_store import read_results
+
+ACCURACY_CUBE_FILE = os.getenv("ACCURACY_CUBE_FILE", "accuracy_cube.csv")
+SESSION_BUCKET_SIZE = 24
+CUBE_DIMENSIONS = ['game', 'model', 'run_number', 'session_bucket', 'level']
+CUBE_COLUMNS = CUBE_DIMENSIONS + ['correct', 'total']
+
+# Models of the runs saved before predictions were tagged, by game: (first run, last run, model)
+LEGACY_RUN_MODELS = {
+    'meg': [(1, 50, 'gpt-4o'), (51, 100, 'gpt-4o-mini'), (101, 150, 'gpt-5')],
+    'pd': [(1, 50, 'gpt-4o-mini'), (51, 100, 'gpt-4o'), (101, 150, 'gpt-5')],
+    'tg': [(1, 50, 'gpt-4o'), (51, 100, 'gpt-4o-mini'), (101, 150, 'gpt-5')],
+}
+UNKNOWN_MODEL = 'unknown'
+
+def row_models(game, df):
+    """The model of each row: its model tag, or the model of its run range for untagged rows."""
+    run_numbers = df['run_number'].to_numpy()
+    legacy = np.select(
+        [(run_numbers >= first) & (run_numbers <= last) for first, last, _ in LEGACY_RUN_MODELS[game]],
+        [model for _, _, model in LEGACY_RUN_MODELS[game]],
+        UNKNOWN_MODEL
+    ).astype(object)
+    if 'model' not in df.columns:
+        return legacy
+    tagged = df['model'].to_numpy(dtype=object)
+    return np.where(df['model'].notna().to_numpy(), tagged, legacy)
+
+def session_buckets(df):
+    """The session bucket label of each row, from the position of its session among its run's sessions."""
+    ids, _ = group_ids([df['run_number'], df['session_id']])
+    first = first_rows(ids)
+    # The first rows appear in id order, so the position of id i is position[i]
+    position, _, _ = session_positions(df['run_number'][first], df['session_id'][first])
+    starts, bucket = np.unique(position[ids] // SESSION_BUCKET_SIZE * SESSION_BUCKET_SIZE, return_inverse=True)
+    labels = np.array([f"{start + 1}-{start + SESSION_BUCKET_SIZE}" for start in starts], dtype=object)
+    return labels[bucket]
+
+def cell_counts(game, level, df, correct, counted):
+    """Sums the correct and counted predictions of the rows of one level per cube cell."""
+    rows = pd.DataFrame({
+        'model': row_models(game, df),
+        'run_number': df['run_number'].to_numpy(),
+        'session_bucket': session_buckets(df),
+        'correct': correct & counted,
+        'total': counted
+    })
+    cells = rows.groupby(['model', 'run_number', 'session_bucket'])[['correct', 'total']].sum().reset_index()
+    cells.insert(0, 'game', game)
+    cells['level'] = level
+    return cells[CUBE_COLUMNS]
+
+# --- Levels of each game, as (level, rows, correct, counted) ---
+
+def meg_levels(df):
+    team_ids = add_actual_team_choice(df)
+    # Rows without a prediction or an actual choice ('N/A', read as missing) are not counted
+    counted = df['prediction_correctness'].isin(['Correct', 'Incorrect', 'Type Mismatch']).to_numpy()
+    yield 'individual', df, (df['prediction_correctness'] == 'Correct').to_numpy(), counted
+    group_df = df[first_rows(team_ids)]
+    valid, correct = group_correctness(group_df)
+    yield 'group', group_df, correct, valid
+
+def pd_levels(df):
+    yield 'individual', df, (df['individual_prediction_correct'] == 1).to_numpy(), np.ones(len(df), dtype=bool)
+    team_df = df.drop_duplicates(subset=['run_number', 'session_id'])
+    yield 'team', team_df, (team_df['team_prediction_correct'] == 1).to_numpy(), np.ones(len(team_df), dtype=bool)
+
+def tg_levels(df):
+    yield 'session', df, (df['prediction_correctness'] == 'Correct').to_numpy(), np.ones(len(df), dtype=bool)
+
+# --- Loading ---
+
+CUBE_GAMES = {
+    'meg': (lambda: read_results(analyze_minimum_effort.RESULTS_DATASET, analyze_minimum_effort.CONSOLIDATED_OUTPUT_FILE), meg_levels),
+    'pd': (lambda: load_reports()[0], pd_levels),
+    'tg': (lambda: read_results(analyze_trust_game.RESULTS_DATASET, analyze_trust_game.CONSOLIDATED_FILE), tg_levels),
+}
+
+def build_cube(games=CUBE_GAMES):
+    """Reads the results of each game once and returns the cube of their correct and total counts."""
+    cells = []
+    for game, (load, levels) in games.items():
+        df = load()
+        if df is None or df.empty:
+            print(f"No results for '{game}'")
+            continue
+        for level, rows, correct, counted in levels(df):
+            cells.append(cell_counts(game, level, rows, correct, counted))
+        print(f"Added {len(df)} rows of '{game}' results")
+    if not cells:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+    return pd.concat(cells, ignore_index=True)
+
+def save_cube(cube, cube_file=ACCURACY_CUBE_FILE):
+    tmp_file = f"{cube_file}.{os.getpid()}.tmp"
+    cube.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, cube_file)
+    print(f"Saved {len(cube)} cells to '{cube_file}'")
+
+def load_cube(cube_file=ACCURACY_CUBE_FILE):
+    """Reads the stored cube. Returns None if it has not been built."""
+    if not os.path.exists(cube_file):
+        return None
+    return pd.read_csv(cube_file, dtype={'game': str, 'model': str, 'session_bucket': str, 'level': str})
+
+def _selected(values, selection):
+    if selection is None:
+        return np.ones(len(values), dtype=bool)
+    if isinstance(selection, (list, tuple, set)):
+        return values.isin(list(selection)).to_numpy()
+    return (values == selection).to_numpy()
+
+def slice_cube(cube, by=(), **filters):
+    """
+    Sums the cells matching filters (dimension=value or dimension=[values]) per combination of
+    the dimensions in by. Returns correct, total and accuracy in percent.
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    for dimension, selection in filters.items():
+        mask &= _selected(cube[dimension], selection)
+    cells = cube[mask]
+    if by:
+        counts = cells.groupby(list(by))[['correct', 'total']].sum().reset_index()
+    else:
+        counts = pd.DataFrame({'correct': [cells['correct'].sum()], 'total': [cells['total'].sum()]})
+    correct, total = counts['correct'].to_numpy(), counts['total'].to_numpy()
+    counts['accuracy'] = np.divide(correct, total, out=np.zeros(len(counts)), where=total > 0) * 100
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or query the accuracy cube.")
+    parser.add_argument('command', choices=['build', 'query'])
+    parser.add_argument('--game', choices=sorted(CUBE_GAMES))
+    parser.add_argument('--model')
+    parser.add_argument('--level')
+    parser.add_argument('--runs', help="Run numbers, e.g. '1-50' or '1-50,101-150'")
+    parser.add_argument('--sessions', help="Session buckets, e.g. '1-24' or '1-24,25-48'")
+    parser.add_argument('--by', default='game,model,level', help="Dimensions to report (default: game,model,level)")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        save_cube(build_cube())
+    else:
+        cube = load_cube()
+        if cube is None:
+            print(f"No cube at '{ACCURACY_CUBE_FILE}'. Run 'python accuracy_cube.py build' first.")
+        else:
+            filters = {'game': args.game, 'model': args.model, 'level': args.level,
+                       'run_number': parse_run_range(args.runs) if args.runs else None,
+                       'session_bucket': args.sessions.split(',') if args.sessions else None}
+            by = [dimension for dimension in args.by.split(',') if dimension]
+            print(slice_cube(cube, by, **filters).to_string(index=False, float_format='%.2f'))
@@ -0,0 +1,133 @@
+# Incremental per-run aggregates for the analysis scripts
+#
+# The analyses only need a few counters per run (correct and total predictions at each level),
+# so they no longer recompute them from every row on each call. update_aggregates() keeps each
+# dataset's per-run counters in aggregates/<dataset>.json, along with the distinct session ids and
+# the size and modification time of each source file the runs came from: a results store partition,
+# a PD report, or an old consolidated CSV. A call loads only the new source files (on a thread
+# pool, or through the caller's loader, e.g. the PD report cache) and folds their counters in
+# with one aggregation over all of them, so analysis during a sweep costs O(new runs) and a cold
+# start one pass over the data. The aggregates are rebuilt from all sources when a folded source
+# changed or disappeared (e.g. a repaired run), or when the version passed by the caller changed
+# (e.g. new ground truth).
+#
+# Source data is never rewritten. Columns an analysis derives per source, like the MEG
+# actual_team_choice, are written as sidecars in aggregates/<dataset>/<column>/<source>.csv.
+# Cohort counters (e.g. runs 1-50) are sums over the per-run rows; see cohort_counts().
+
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from data_cache import file_state
+from results_store import list_runs, partition_path
+
+AGGREGATES_DIR = os.getenv("PREDICTION_AGGREGATES_DIR", "aggregates")
+# Bumped when the stored counters change meaning, so older aggregates are rebuilt
+AGGREGATES_FORMAT = 1
+SOURCE_LOAD_WORKERS = int(os.getenv("AGGREGATE_LOAD_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+def _state_path(dataset):
+    return os.path.join(AGGREGATES_DIR, f"{dataset}.json")
+
+def sidecar_path(dataset, column, source):
+    return os.path.join(AGGREGATES_DIR, dataset, column, f"{source}.csv")
+
+def _read_state(dataset):
+    try:
+        with open(_state_path(dataset), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_state(dataset, state):
+    os.makedirs(AGGREGATES_DIR, exist_ok=True)
+    tmp_file = f"{_state_path(dataset)}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, _state_path(dataset))
+
+def _write_sidecars(dataset, sidecars, run_sources):
+    """Writes the rows of each sidecar to the file of the source their run came from."""
+    for column, sidecar_df in sidecars.items():
+        for source, rows in sidecar_df.groupby(sidecar_df['run_number'].map(run_sources), sort=False):
+            path = sidecar_path(dataset, column, source)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_file = f"{path}.{os.getpid()}.tmp"
+            rows.to_csv(tmp_file, index=False)
+            os.replace(tmp_file, path)
+
+def results_sources(dataset, legacy_file):
+    """{source: file} of a dataset: its results store partitions, or its old consolidated CSV if the store has no runs."""
+    runs = list_runs(dataset)
+    if runs:
+        return {f"run_{run_number}": partition_path(dataset, run_number) for run_number in runs}
+    if os.path.exists(legacy_file):
+        return {'consolidated': legacy_file}
+    return {}
+
+def read_sources(files):
+    """The rows of each file, read on a thread pool."""
+    with ThreadPoolExecutor(max_workers=SOURCE_LOAD_WORKERS) as executor:
+        return list(executor.map(pd.read_csv, files))
+
+def update_aggregates(dataset, sources, aggregate, version=None, load=read_sources):
+    """
+    Folds the new files of sources ({source: file}) into the dataset's aggregates and returns
+    (runs, sessions): the counters of every run, ordered by run_number, and the set of distinct
+    session ids. load(files) returns the rows of each new file, with a run_number column, and
+    aggregate(rows) of all of them returns (counts, session_ids, sidecars): a DataFrame of
+    counters with a run_number column, the session ids and {column: rows with a run_number}.
+    """
+    states = {source: [path] + file_state(path) for source, path in sources.items()}
+    state = _read_state(dataset)
+    expected_version = [AGGREGATES_FORMAT, version]
+    if (state is None or state.get('version') != expected_version
+            or any(states.get(source) != file_state for source, file_state in state['sources'].items())):
+        if state is not None:
+            print(f"Sources of the '{dataset}' aggregates changed, rebuilding them.")
+        shutil.rmtree(os.path.join(AGGREGATES_DIR, dataset), ignore_errors=True)
+        state = {'version': expected_version, 'sources': {}, 'runs': [], 'sessions': []}
+
+    new_sources = [source for source in sources if source not in state['sources']]
+    if new_sources:
+        print(f"Aggregating {len(new_sources)} new of {len(sources)} source files of '{dataset}'...")
+        frames = load([sources[source] for source in new_sources])
+        run_sources = {
+            run_number: source for source, frame in zip(new_sources, frames)
+            for run_number in pd.to_numeric(frame['run_number'], errors='coerce').dropna().unique().tolist()
+        }
+        counts, session_ids, sidecars = aggregate(pd.concat(frames, ignore_index=True))
+        state['runs'].extend({**row, 'source': run_sources.get(row['run_number'])} for row in counts.to_dict('records'))
+        state['sessions'] = list(set(state['sessions']).union(pd.Series(session_ids).dropna().unique().tolist()))
+        _write_sidecars(dataset, sidecars, run_sources)
+        state['sources'].update((source, states[source]) for source in new_sources)
+        _write_state(dataset, state)
+
+    runs = pd.DataFrame(state['runs'])
+    if not runs.empty:
+        runs = runs.sort_values('run_number', kind='stable', ignore_index=True)
+    return runs, set(state['sessions'])
+
+def read_sidecar(dataset, column):
+    """The sidecar rows of a derived column over all sources, or None if there are none."""
+    directory = os.path.join(AGGREGATES_DIR, dataset, column)
+    if not os.path.isdir(directory):
+        return None
+    frames = [pd.read_csv(os.path.join(directory, name)) for name in sorted(os.listdir(directory)) if name.endswith('.csv')]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+def cohort_counts(runs, cohorts, columns):
+    """
+    Sums columns over the runs of each cohort, a (label, first run, last run or None) range,
+    and counts the runs. Returns a DataFrame indexed by label.
+    """
+    runs = runs.reindex(columns=['run_number'] + list(columns), fill_value=0)
+    rows = []
+    for label, start, end in cohorts:
+        selected = runs[(runs['run_number'] >= start) & ((runs['run_number'] <= end) if end is not None else True)]
+        rows.append({'cohort': label, 'runs': len(selected), **selected[columns].sum().to_dict()})
+    return pd.DataFrame(rows).set_index('cohort')
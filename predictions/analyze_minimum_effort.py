@@ -1,58 +1,186 @@
+# Accuracy analysis of the minimum effort game predictions
+#
+# The text columns are made categorical once and the team of each row gets an integer id, so
+# normalizing outcome labels, deciding correctness and counting per run are array operations
+# over codes: each distinct label is normalized once and every per-run and per-range accuracy
+# comes from the same counts.
+#
+# Each run's counters are computed once, when its results first appear, and kept by
+# aggregate_store.py; the actual_team_choice column is written to a sidecar there instead of
+# back into the results.
+
 import pandas as pd
 import os
 import numpy as np
 
+from aggregate_store import results_sources, sidecar_path, update_aggregates
+from truth_store import current_hash, load_truth
+
+RESULTS_DATASET = 'minimum_effort'
 CONSOLIDATED_OUTPUT_FILE = 'minimum_effort_consolidated.csv'
+TRUTH_DATASET = 'minimum_effort'
+
+FIRST_SESSIONS = 24
+TEAM_OUTCOMES = ['N/A', 'Coordinate', 'Fail to Coordinate']
+# Text columns that are compared and grouped; made categorical once so every later pass works on codes
+CATEGORICAL_COLUMNS = ['session_id', 'group_outcome_prediction']
+RUN_RANGES = [('1-50', 1, 50), ('51-100', 51, 100), ('101 onwards', 101, None)]
+FIRST_SESSIONS_RUN_RANGES = [('1-50', 1, 50), ('51-100', 51, 100), ('101-150', 101, 150)]
+
+def group_ids(keys):
+    """
+    Returns (ids, has_key): an integer id per row for the combination of its key values, numbered
+    in order of first appearance (a missing value counts as a value), and whether no key is missing.
+    """
+    ids, has_key = np.zeros(len(keys[0]), dtype=np.int64), np.ones(len(keys[0]), dtype=bool)
+    for key in keys:
+        codes, uniques = pd.factorize(key)
+        has_key &= codes >= 0
+        ids = ids * (len(uniques) + 1) + codes + 1
+    return pd.factorize(ids)[0], has_key
+
+def first_rows(ids):
+    """Whether each row is the first of its id, for ids numbered in order of first appearance."""
+    seen = np.maximum.accumulate(ids)
+    return np.concatenate([[True], seen[1:] > seen[:-1]])[:len(ids)]
+
+def team_outcomes(choices, ids, has_key):
+    """
+    Per row, the actual outcome of the row's team (its rows with equal ids) as a code into
+    TEAM_OUTCOMES: 'Coordinate' if all 3 players chose 7, 'N/A' unless exactly 3 choices are
+    known or if a key is missing.
+    """
+    size = np.bincount(ids)[ids]
+    nulls = np.bincount(ids, weights=choices.isnull().to_numpy())[ids]
+    sevens = np.bincount(ids, weights=choices.eq(7).to_numpy())[ids]
+    return np.select([~has_key | (nulls > 0) | (size != 3), sevens == size], [0, 1], 2)
+
+def truth_team_outcomes(truth_df, session_ids):
+    """Per row of the categorical session_ids, the code of its team outcome in the ground truth ('N/A' if it has none)."""
+    truth_ids, truth_has_key = group_ids([truth_df['session_id']])
+    first = first_rows(truth_ids)
+    outcomes = pd.Series(team_outcomes(truth_df['true_choice'], truth_ids, truth_has_key)[first], index=truth_df['session_id'][first])
+    # One lookup per distinct session, then a take by category code (code -1, a missing id, takes the 'N/A' appended last)
+    by_category = outcomes.reindex(session_ids.cat.categories).fillna(0).astype(np.int64).to_numpy()
+    return np.append(by_category, 0)[session_ids.cat.codes.to_numpy()]
+
+def outcome_codes(*columns):
+    """
+    Codes the outcome labels of the columns in one vocabulary of normalized labels (lower case,
+    no spaces or hyphens), normalizing each distinct value once. Also returns, per column,
+    whether each row holds exactly 'N/A'.
+    """
+    vocabulary = {}
+    results = []
+    for column in columns:
+        codes, uniques = pd.factorize(column)
+        # The missing value is appended last, where code -1 points
+        labels = list(uniques) + [np.nan]
+        label_codes = np.array([vocabulary.setdefault(str(label).strip().lower().replace(' ', '').replace('-', ''), len(vocabulary)) for label in labels])
+        is_na = np.array([isinstance(label, str) and label == 'N/A' for label in labels])
+        results.append((label_codes[codes], is_na[codes]))
+    return results
+
+def session_positions(run_numbers, session_ids):
+    """
+    Position of each row's session among the sessions of its run, ordered by session_id (missing
+    ids last), for rows with unique (run, session) pairs. Also returns the run codes (-1 for
+    a missing run number) and the sorted distinct run numbers.
+    """
+    run_codes, runs = pd.factorize(run_numbers, sort=True)
+    session_codes, sessions = pd.factorize(session_ids, sort=True)
+    session_codes = np.where(session_codes < 0, len(sessions), session_codes)
+    # (run, session) pairs are unique, so the order of equal keys does not matter
+    order = np.argsort(run_codes * (len(sessions) + 1) + session_codes)
+    sorted_runs = run_codes[order]
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order)) - np.searchsorted(sorted_runs, sorted_runs)
+    return position, run_codes, runs
+
+def group_correctness(group_df):
+    """Per group row: whether its actual outcome is known (not 'N/A') and whether the group prediction matches it."""
+    (predicted, _), (actual, actual_na) = outcome_codes(group_df['group_outcome_prediction'], group_df['actual_team_choice'])
+    valid = ~actual_na
+    return valid, valid & (predicted == actual)
+
+def run_accuracies(group_df, first_sessions=FIRST_SESSIONS):
+    """
+    Correct and total group predictions per run, over all sessions and over the first sessions
+    (by session_id) of each run, with the accuracies in percent, indexed by run_number.
+    Sessions whose actual outcome is 'N/A' and rows without a run number are not counted.
+    """
+    position, run_codes, runs = session_positions(group_df['run_number'], group_df['session_id'])
+    first = position < first_sessions
+    valid, correct = group_correctness(group_df)
+    counted = run_codes >= 0
+    counts = pd.DataFrame({
+        column: np.bincount(run_codes[counted], weights=values[counted], minlength=len(runs)).astype(np.int64)
+        for column, values in [('correct', correct), ('total', valid), ('correct_first', correct & first), ('total_first', valid & first)]
+    }, index=pd.Index(runs, name='run_number'))
+    return add_accuracies(counts)
+
+def add_accuracies(counts):
+    """Adds accuracy and accuracy_first in percent to per-run correct and total counts."""
+    for suffix in ('', '_first'):
+        correct_count, total_count = counts['correct' + suffix].to_numpy(), counts['total' + suffix].to_numpy()
+        counts['accuracy' + suffix] = np.divide(correct_count, total_count, out=np.zeros(len(counts)), where=total_count > 0) * 100
+    return counts
+
+def add_actual_team_choice(df, truth_df=None):
+    """
+    Makes the text columns categorical and adds the actual_team_choice column, from truth_df or
+    else the stored ground truth when there is one. Returns the team id of each row.
+    """
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype('category')
+    team_ids, has_key = group_ids([df['run_number'], df['session_id']])
+    truth_df = load_truth(TRUTH_DATASET) if truth_df is None else truth_df
+    if truth_df is not None:
+        actual_codes = truth_team_outcomes(truth_df, df['session_id'])
+    else:
+        actual_codes = team_outcomes(df['actual_choice'], team_ids, has_key)
+    df['actual_team_choice'] = pd.Categorical.from_codes(actual_codes, TEAM_OUTCOMES)
+    return team_ids
+
+def aggregate_results(df, truth_df=None):
+    """
+    The counters of the runs in the results rows (see run_accuracies(), plus the number of player
+    predictions), their session ids and the actual_team_choice sidecar, one row per group.
+    """
+    team_ids = add_actual_team_choice(df, truth_df)
+    group_df = df[first_rows(team_ids)]
+    counts = run_accuracies(group_df)[['correct', 'total', 'correct_first', 'total_first']]
+    counts['predictions'] = df['run_number'].value_counts().reindex(counts.index, fill_value=0)
+    sidecar = group_df[['run_number', 'session_id', 'actual_team_choice']]
+    return counts.reset_index(), df['session_id'], {'actual_team_choice': sidecar}
+
+def in_range(run_numbers, start, end):
+    return (run_numbers >= start) & (run_numbers <= end) if end is not None else run_numbers >= start
 
 def analyze_consolidated_results():
-    if not os.path.exists(CONSOLIDATED_OUTPUT_FILE):
-        print(f"Error: Consolidated output file not found at '{CONSOLIDATED_OUTPUT_FILE}'")
+    sources = results_sources(RESULTS_DATASET, CONSOLIDATED_OUTPUT_FILE)
+    if not sources:
+        print(f"Error: No results in the '{RESULTS_DATASET}' store or at '{CONSOLIDATED_OUTPUT_FILE}'")
         return
     
-    df = pd.read_csv(CONSOLIDATED_OUTPUT_FILE)
-    if df.empty:
+    # The team outcomes come from the ground truth, so new ground truth recomputes every run
+    runs, _ = update_aggregates(RESULTS_DATASET, sources, aggregate_results, current_hash(TRUTH_DATASET))
+    if runs.empty or runs['predictions'].sum() == 0:
         print("No data found in the consolidated file.")
         return
     
-    print(f"Loaded {len(df)} player predictions from {df['run_number'].nunique()} runs.")
-    
-    # Compute actual_team_choice per session
-    session_team_outcomes = {}
-    for (run_number, session_id), group in df.groupby(['run_number', 'session_id']):
-        if group['actual_choice'].isnull().any() or len(group) != 3:
-            session_team_outcomes[(run_number, session_id)] = 'N/A'
-        elif (group['actual_choice'] == 7).all():
-            session_team_outcomes[(run_number, session_id)] = 'Coordinate'
-        else:
-            session_team_outcomes[(run_number, session_id)] = 'Fail to Coordinate'
-    
-    df['actual_team_choice'] = df.apply(lambda row: session_team_outcomes.get((row['run_number'], row['session_id']), 'N/A'), axis=1)
-    df.to_csv(CONSOLIDATED_OUTPUT_FILE, index=False)
-    print("Added/updated 'actual_team_choice' column to the CSV file (computed per session, exactly 3 players per team).")
+    print(f"Loaded {runs['predictions'].sum()} player predictions from {len(runs)} runs.")
+    print(f"'actual_team_choice' (computed per session, exactly 3 players per team) is in the sidecars at '{os.path.dirname(sidecar_path(RESULTS_DATASET, 'actual_team_choice', ''))}'.")
     
-    # Get one row per group
-    group_df = df.drop_duplicates(subset=['run_number', 'session_id']).copy()
+    counts = add_accuracies(runs.set_index('run_number'))
+    run_numbers = counts.index.to_numpy()
     
     # --- Group-level accuracy ---
     print("\n--- Group-level accuracy ---")
-    group_accs = []
-    for run_number, run_group in group_df.groupby('run_number'):
-        correct = 0
-        total = 0
-        for _, row in run_group.iterrows():
-            predicted = row['group_outcome_prediction']
-            actual = row['actual_team_choice']
-            if actual == 'N/A':
-                continue
-            norm_pred = str(predicted).strip().lower().replace(' ', '').replace('-', '')
-            norm_actual = str(actual).strip().lower().replace(' ', '').replace('-', '')
-            if norm_pred == norm_actual:
-                correct += 1
-            total += 1
-        acc = (correct / total * 100) if total > 0 else 0
-        group_accs.append(acc)
-        print(f"  Run {run_number}: {acc:.2f}% ({correct}/{total})")
+    for run_number, row in zip(run_numbers, counts.itertuples()):
+        print(f"  Run {run_number}: {row.accuracy:.2f}% ({row.correct}/{row.total})")
     
+    group_accs = counts['accuracy'].tolist()
     if group_accs:
         avg_group_acc = sum(group_accs) / len(group_accs)
         std_group_acc = np.std(group_accs, ddof=1) if len(group_accs) > 1 else 0
@@ -62,157 +190,39 @@ def analyze_consolidated_results():
         print("\nNo valid group-level accuracy to compute average.")
     
     # --- Export group-level accuracy ---
-    group_acc_rows = []
-    for run_number, run_group in group_df.groupby('run_number'):
-        correct = 0
-        total = 0
-        for _, row in run_group.iterrows():
-            predicted = row['group_outcome_prediction']
-            actual = row['actual_team_choice']
-            if actual == 'N/A':
-                continue
-            norm_pred = str(predicted).strip().lower().replace(' ', '').replace('-', '')
-            norm_actual = str(actual).strip().lower().replace(' ', '').replace('-', '')
-            if norm_pred == norm_actual:
-                correct += 1
-            total += 1
-        acc = (correct / total * 100) if total > 0 else 0
-        group_acc_rows.append({'run_number': run_number, 'group_level_accuracy': acc, 'correct': correct, 'total': total})
-    
-    if group_acc_rows:
-        avg_group_acc = sum([row['group_level_accuracy'] for row in group_acc_rows]) / len(group_acc_rows)
-        std_group_acc = np.std([row['group_level_accuracy'] for row in group_acc_rows], ddof=1) if len(group_acc_rows) > 1 else 0
-        group_acc_rows.append({'run_number': 'Average', 'group_level_accuracy': avg_group_acc, 'correct': '', 'total': ''})
-        group_acc_rows.append({'run_number': 'StdDev', 'group_level_accuracy': std_group_acc, 'correct': '', 'total': ''})
-        pd.DataFrame(group_acc_rows).to_csv('group_level_accuracy_by_run_minimal.csv', index=False)
+    if group_accs:
+        export_df = pd.DataFrame({
+            'run_number': run_numbers, 'group_level_accuracy': counts['accuracy'].to_numpy(),
+            'correct': counts['correct'].to_numpy(), 'total': counts['total'].to_numpy()
+        })
+        summary_rows = pd.DataFrame([
+            {'run_number': 'Average', 'group_level_accuracy': avg_group_acc, 'correct': '', 'total': ''},
+            {'run_number': 'StdDev', 'group_level_accuracy': std_group_acc, 'correct': '', 'total': ''}
+        ])
+        pd.concat([export_df, summary_rows], ignore_index=True).to_csv('group_level_accuracy_by_run_minimal.csv', index=False)
         print("Exported group-level accuracy by run to 'group_level_accuracy_by_run_minimal.csv'")
     
-    # Group level accuracy for runs 1-50
-    group_df_1_50 = group_df[(group_df['run_number'] >= 1) & (group_df['run_number'] <= 50)]
-    group_accs_1_50 = []
-    for run_number, run_group in group_df_1_50.groupby('run_number'):
-        correct = 0
-        total = 0
-        for _, row in run_group.iterrows():
-            predicted = row['group_outcome_prediction']
-            actual = row['actual_team_choice']
-            if actual == 'N/A':
-                continue
-            norm_pred = str(predicted).strip().lower().replace(' ', '').replace('-', '')
-            norm_actual = str(actual).strip().lower().replace(' ', '').replace('-', '')
-            if norm_pred == norm_actual:
-                correct += 1
-            total += 1
-        acc = (correct / total * 100) if total > 0 else 0
-        group_accs_1_50.append(acc)
-    
-    print('\nGROUP-LEVEL ACCURACY FOR RUNS 1-50:')
-    if group_accs_1_50:
-        avg_group_1_50 = np.mean(group_accs_1_50)
-        std_group_1_50 = np.std(group_accs_1_50, ddof=1) if len(group_accs_1_50) > 1 else 0
-        print(f"Average group-level accuracy: {avg_group_1_50:.2f}%")
-        print(f"Group-level accuracy standard deviation: {std_group_1_50:.2f}%")
-    else:
-        print("No runs 1-50 found.")
-    
-    # Runs 51-100
-    group_df_51_100 = group_df[(group_df['run_number'] >= 51) & (group_df['run_number'] <= 100)]
-    group_accs_51_100 = []
-    for run_number, run_group in group_df_51_100.groupby('run_number'):
-        correct = 0
-        total = 0
-        for _, row in run_group.iterrows():
-            predicted = row['group_outcome_prediction']
-            actual = row['actual_team_choice']
-            if actual == 'N/A':
-                continue
-            norm_pred = str(predicted).strip().lower().replace(' ', '').replace('-', '')
-            norm_actual = str(actual).strip().lower().replace(' ', '').replace('-', '')
-            if norm_pred == norm_actual:
-                correct += 1
-            total += 1
-        acc = (correct / total * 100) if total > 0 else 0
-        group_accs_51_100.append(acc)
-    
-    print('GROUP-LEVEL ACCURACY FOR RUNS 51-100:')
-    if group_accs_51_100:
-        avg_group_51_100 = np.mean(group_accs_51_100)
-        std_group_51_100 = np.std(group_accs_51_100, ddof=1) if len(group_accs_51_100) > 1 else 0
-        print(f"Average group-level accuracy: {avg_group_51_100:.2f}%")
-        print(f"Group-level accuracy standard deviation: {std_group_51_100:.2f}%")
-    else:
-        print("No runs 51-100 found.")
-    
-    # Runs 101 onwards
-    group_df_101_onwards = group_df[group_df['run_number'] >= 101]
-    group_accs_101_onwards = []
-    for run_number, run_group in group_df_101_onwards.groupby('run_number'):
-        correct = 0
-        total = 0
-        for _, row in run_group.iterrows():
-            predicted = row['group_outcome_prediction']
-            actual = row['actual_team_choice']
-            if actual == 'N/A':
-                continue
-            norm_pred = str(predicted).strip().lower().replace(' ', '').replace('-', '')
-            norm_actual = str(actual).strip().lower().replace(' ', '').replace('-', '')
-            if norm_pred == norm_actual:
-                correct += 1
-            total += 1
-        acc = (correct / total * 100) if total > 0 else 0
-        group_accs_101_onwards.append(acc)
-    
-    print('GROUP-LEVEL ACCURACY FOR RUNS 101 ONWARDS:')
-    if group_accs_101_onwards:
-        avg_group_101_onwards = np.mean(group_accs_101_onwards)
-        std_group_101_onwards = np.std(group_accs_101_onwards, ddof=1) if len(group_accs_101_onwards) > 1 else 0
-        print(f"Average group-level accuracy: {avg_group_101_onwards:.2f}%")
-        print(f"Group-level accuracy standard deviation: {std_group_101_onwards:.2f}%")
-    else:
-        print("No runs 101 onwards found.")
+    # Group level accuracy per range of runs
+    print()
+    for label, start, end in RUN_RANGES:
+        accs = counts['accuracy'].to_numpy()[in_range(run_numbers, start, end)]
+        print(f"GROUP-LEVEL ACCURACY FOR RUNS {label.upper()}:")
+        if len(accs):
+            print(f"Average group-level accuracy: {np.mean(accs):.2f}%")
+            print(f"Group-level accuracy standard deviation: {(np.std(accs, ddof=1) if len(accs) > 1 else 0):.2f}%")
+        else:
+            print(f"No runs {label} found.")
     
     # First 1-24 sessions only
     print('\nGROUP-LEVEL ACCURACY (FIRST 1-24 SESSIONS ONLY):')
-    group_accs_first24_by_run = {}
-    for run_number, run_group in group_df.groupby('run_number'):
-        run_group_first24 = run_group.sort_values('session_id').head(24)
-        correct = 0
-        total = 0
-        for _, row in run_group_first24.iterrows():
-            predicted = row['group_outcome_prediction']
-            actual = row['actual_team_choice']
-            if actual == 'N/A':
-                continue
-            norm_pred = str(predicted).strip().lower().replace(' ', '').replace('-', '')
-            norm_actual = str(actual).strip().lower().replace(' ', '').replace('-', '')
-            if norm_pred == norm_actual:
-                correct += 1
-            total += 1
-        acc = (correct / total * 100) if total > 0 else 0
-        group_accs_first24_by_run[run_number] = acc
+    for run_number, acc in zip(run_numbers, counts['accuracy_first']):
         print(f"  Run {run_number}: {acc:.2f}% (first 1-24 sessions)")
     
     # Average group level accuracy (first 1-24 sessions)
-    def avg_group_acc_range(start, end):
-        accs = [v for k, v in group_accs_first24_by_run.items() if isinstance(k, (int, float, np.integer)) and k >= start and k <= end]
-        return np.mean(accs) if accs else None
-    
-    avg_1_50 = avg_group_acc_range(1, 50)
-    avg_51_100 = avg_group_acc_range(51, 100)
-    avg_101_150 = avg_group_acc_range(101, 150)
     print('\nAVERAGE GROUP-LEVEL ACCURACY FOR RUN RANGES (FIRST 1-24 SESSIONS ONLY):')
-    if avg_1_50 is not None:
-        print(f"Runs 1-50: {avg_1_50:.2f}%")
-    else:
-        print("Runs 1-50: No data")
-    if avg_51_100 is not None:
-        print(f"Runs 51-100: {avg_51_100:.2f}%")
-    else:
-        print("Runs 51-100: No data")
-    if avg_101_150 is not None:
-        print(f"Runs 101-150: {avg_101_150:.2f}%")
-    else:
-        print("Runs 101-150: No data")
+    for label, start, end in FIRST_SESSIONS_RUN_RANGES:
+        accs = counts['accuracy_first'].to_numpy()[in_range(run_numbers, start, end)]
+        print(f"Runs {label}: {np.mean(accs):.2f}%" if len(accs) else f"Runs {label}: No data")
     
     print("\nAnalysis complete.")
 
@@ -1,54 +1,93 @@
+import numpy as np
 import pandas as pd
-import glob
-import re
 
-def find_report_files():
-    return sorted(glob.glob('final_full_analytical_report_task2_minimal_run*.csv'))
+from aggregate_store import update_aggregates
+from data_cache import load_reports, report_files, report_run_number
+from response_parser import normalize_vote
+from truth_store import current_hash, load_truth
 
-def extract_run_number(filename):
-    match = re.search(r'_run(\d+)\.csv$', filename)
-    return int(match.group(1)) if match else None
+RESULTS_DATASET = 'prisoners_dilemma'
+TRUTH_DATASET = 'prisoners_dilemma'
+TRUTH_KEYS = ['session_id', 'opponent_player_id']
 
-def summarize_accuracy(report_file):
-    df = pd.read_csv(report_file)
-    
-    # Team-level
-    team_level_df = df.drop_duplicates(subset=['session_id'])
-    total_team_predictions = len(team_level_df)
-    correct_team_predictions = team_level_df['team_prediction_correct'].sum()
-    team_accuracy_majority = (correct_team_predictions / total_team_predictions * 100) if total_team_predictions > 0 else 0
-    
-    correct_team_predictions_ai = (team_level_df['actual_team_outcome'] == team_level_df['predicted_team_outcome']).sum()
-    team_accuracy_ai = (correct_team_predictions_ai / total_team_predictions * 100) if total_team_predictions > 0 else 0
-    
-    # Individual-level
-    total_individual_choices = len(df)
-    correct_individual_choices = df['individual_prediction_correct'].sum()
-    individual_accuracy = (correct_individual_choices / total_individual_choices * 100) if total_individual_choices > 0 else 0
-    
-    return {
-        'file': report_file,
-        'run_number': extract_run_number(report_file),
-        'team_accuracy_majority': team_accuracy_majority,
-        'correct_team_predictions_majority': correct_team_predictions,
-        'team_accuracy_ai': team_accuracy_ai,
-        'correct_team_predictions_ai': correct_team_predictions_ai,
-        'total_team_predictions': total_team_predictions,
-        'individual_accuracy': individual_accuracy,
-        'correct_individual_choices': correct_individual_choices,
-        'total_individual_choices': total_individual_choices
-    }
+def score_with_truth(reports, truth_df):
+    """
+    Rescores the report rows against the stored ground truth: the vote of each opponent player and
+    the team outcome of each session, matched by id. Rows without stored truth keep their scores.
+    """
+    if truth_df is None:
+        return reports
+    truth = truth_df.drop_duplicates(TRUTH_KEYS)
+    truth = pd.DataFrame({
+        **{key: truth[key].astype(str) for key in TRUTH_KEYS},
+        'actual_vote': truth['actual_vote'].map(normalize_vote),
+        'actual_team_outcome': truth['actual_team_outcome']
+    })
+    matched = reports[TRUTH_KEYS].astype(str).merge(truth, how='left', on=TRUTH_KEYS)
+    has_truth = matched['actual_team_outcome'].notna().to_numpy()
+    actual_team_outcome = np.where(has_truth, matched['actual_team_outcome'], reports['actual_team_outcome'])
+    individual_correct = matched['actual_vote'].to_numpy() == reports['predicted_individual_vote'].map(normalize_vote).to_numpy()
+    return reports.assign(
+        actual_team_outcome=actual_team_outcome,
+        individual_prediction_correct=np.where(has_truth, individual_correct.astype(int), reports['individual_prediction_correct']),
+        team_prediction_correct=np.where(has_truth, (actual_team_outcome == reports['predicted_team_outcome']).astype(int), reports['team_prediction_correct'])
+    )
+
+def run_counts(reports):
+    """
+    Correct and total team- and individual-level predictions of every run in reports, from one
+    groupby. The team level counts the first row of each session of a run.
+    """
+    teams = reports.drop_duplicates(subset=['run_number', 'session_id'])
+    team_counts = pd.DataFrame({
+        'run_number': teams['run_number'],
+        'correct_team_predictions_majority': teams['team_prediction_correct'],
+        'correct_team_predictions_ai': teams['actual_team_outcome'] == teams['predicted_team_outcome'],
+        'total_team_predictions': 1
+    }).groupby('run_number').sum()
+    individual_counts = reports.groupby('run_number').agg(
+        correct_individual_choices=('individual_prediction_correct', 'sum'),
+        total_individual_choices=('individual_prediction_correct', 'size')
+    )
+    return team_counts.join(individual_counts).reset_index()
+
+def load_runs(files):
+    """The rows of each report file, from the columnar cache of all reports (see data_cache.load_reports())."""
+    reports, _ = load_reports()
+    runs = dict(tuple(reports.groupby('run_number', sort=False)))
+    return [runs.get(report_run_number(report_file), reports.iloc[:0]) for report_file in files]
+
+def aggregate_reports(reports):
+    return run_counts(score_with_truth(reports, load_truth(TRUTH_DATASET))), reports['session_id'], {}
+
+def summarize_runs(counts, files):
+    """Team- and individual-level accuracy of every run from its counts (see run_counts())."""
+    counts = counts.set_index('run_number')
+
+    def accuracy(correct, total):
+        return (counts[correct] / counts[total] * 100).where(counts[total] > 0, 0)
+
+    return pd.DataFrame({
+        'file': counts.index.map(files),
+        'run_number': counts.index,
+        'team_accuracy_majority': accuracy('correct_team_predictions_majority', 'total_team_predictions'),
+        'correct_team_predictions_majority': counts['correct_team_predictions_majority'],
+        'team_accuracy_ai': accuracy('correct_team_predictions_ai', 'total_team_predictions'),
+        'correct_team_predictions_ai': counts['correct_team_predictions_ai'],
+        'total_team_predictions': counts['total_team_predictions'],
+        'individual_accuracy': accuracy('correct_individual_choices', 'total_individual_choices'),
+        'correct_individual_choices': counts['correct_individual_choices'],
+        'total_individual_choices': counts['total_individual_choices']
+    }).reset_index(drop=True)
 
 def main():
-    report_files = find_report_files()
-    if not report_files:
+    files = report_files()
+    if not files:
         print('No report files found.')
         return
     
-    results = [summarize_accuracy(f) for f in report_files]
-    results.sort(key=lambda x: x['run_number'])
-    
-    summary_df = pd.DataFrame(results)
+    counts, _ = update_aggregates(RESULTS_DATASET, {f"run_{run_number}": report_file for run_number, report_file in files.items()}, aggregate_reports, current_hash(TRUTH_DATASET), load=load_runs)
+    summary_df = summarize_runs(counts, files)
     
     print('\nACCURACY RESULTS')
     print('='*40)
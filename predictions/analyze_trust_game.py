@@ -1,44 +1,67 @@
 import pandas as pd
 import numpy as np
 
+from aggregate_store import cohort_counts, results_sources, update_aggregates
+from truth_store import current_hash, load_truth
+
 # --- Configuration ---
+RESULTS_DATASET = 'trust_game'
+TRUTH_DATASET = 'trust_game'
 CONSOLIDATED_FILE = 'trust_game_consolidated.csv'
 SUMMARY_STATS_FILE = 'trust_game_summary_statistics.csv'
 PER_RUN_ACCURACY_FILE = 'trust_game_per_run_accuracy.csv'
+SPLIT_RANGES = [('1-50', 1, 50), ('51-100', 51, 100), ('101 onwards', 101, None)]
+COUNT_COLUMNS = ['total_predictions', 'correct_predictions']
+
+def correct_predictions(df, truth_df):
+    """
+    Whether each prediction matches the actual action of its session in the stored ground truth.
+    Rows without stored truth keep their prediction_correctness.
+    """
+    correct = (df['prediction_correctness'] == 'Correct').to_numpy()
+    if truth_df is None:
+        return correct
+    truth = truth_df.drop_duplicates('session_id')
+    actual_actions = pd.Series(truth['actual_action'].to_numpy(), index=truth['session_id'].astype(str))
+    actual = df['session_id'].astype(str).map(actual_actions)
+    return np.where(actual.notna(), (df['predicted_action'] == actual).to_numpy(), correct)
+
+def aggregate_results(df):
+    """The total and correct predictions of each run in the results rows, and their session ids."""
+    df['run_number'] = pd.to_numeric(df['run_number'], errors='coerce').astype('Int64')
+    counts = pd.DataFrame({
+        'run_number': df['run_number'],
+        'total_predictions': 1,
+        'correct_predictions': correct_predictions(df, load_truth(TRUTH_DATASET))
+    }).groupby('run_number').sum().reset_index()
+    return counts, df['session_id'], {}
+
+def with_accuracy(counts):
+    total, correct = counts['total_predictions'].to_numpy(), counts['correct_predictions'].to_numpy()
+    return counts.assign(accuracy_percentage=np.divide(correct, total, out=np.zeros(len(counts)), where=total > 0) * 100)
 
 def analyze_consolidated_results():
-    try:
-        df = pd.read_csv(CONSOLIDATED_FILE)
-    except FileNotFoundError:
-        print(f"ERROR: Could not find '{CONSOLIDATED_FILE}'. Run the batch processing script first.")
+    sources = results_sources(RESULTS_DATASET, CONSOLIDATED_FILE)
+    if not sources:
+        print(f"ERROR: No results in the '{RESULTS_DATASET}' store or '{CONSOLIDATED_FILE}'. Run the batch processing script first.")
         return
     
-    df['run_number'] = pd.to_numeric(df['run_number'], errors='coerce').astype('Int64')
+    # The actual actions come from the ground truth, so new ground truth recomputes every run
+    runs, sessions = update_aggregates(RESULTS_DATASET, sources, aggregate_results, current_hash(TRUTH_DATASET))
+    runs = runs.reindex(columns=['run_number'] + COUNT_COLUMNS)
     
-    total_predictions = len(df)
-    correct_predictions = len(df[df['prediction_correctness'] == 'Correct'])
+    total_predictions = runs['total_predictions'].sum()
+    correct_predictions = runs['correct_predictions'].sum()
     overall_accuracy = (correct_predictions / total_predictions) * 100 if total_predictions > 0 else 0
     
     # --- Accuracy by run ---
-    run_accuracy = []
-    for run_num in sorted(df['run_number'].unique()):
-        run_data = df[df['run_number'] == run_num]
-        run_total = len(run_data)
-        run_correct = len(run_data[run_data['prediction_correctness'] == 'Correct'])
-        run_acc = (run_correct / run_total) * 100 if run_total > 0 else 0
-        run_accuracy.append({
-            'run_number': run_num,
-            'total_predictions': run_total,
-            'correct_predictions': run_correct,
-            'accuracy_percentage': run_acc
-        })
+    run_accuracy_df = with_accuracy(runs)
 
     # Export accuracy by run
-    run_accuracy_df = pd.DataFrame(run_accuracy)
     run_accuracy_df.to_csv(PER_RUN_ACCURACY_FILE, index=False)
 
     # --- Consistency ---
-    run_accuracies = [stat['accuracy_percentage'] for stat in run_accuracy]
+    run_accuracies = run_accuracy_df['accuracy_percentage'].tolist()
 
     # --- Summary statistics ---
     summary_stats = {
@@ -55,7 +78,7 @@ def analyze_consolidated_results():
             'predictions_per_session_avg'
         ],
         'value': [
-            df['run_number'].nunique(),
+            len(runs),
             total_predictions,
             overall_accuracy,
             np.mean(run_accuracies) if run_accuracies else 0,
@@ -63,84 +86,28 @@ def analyze_consolidated_results():
             min(run_accuracies) if run_accuracies else 0,
             max(run_accuracies) if run_accuracies else 0,
             np.median(run_accuracies) if run_accuracies else 0,
-            df['session_id'].nunique(),
-            total_predictions / df['session_id'].nunique() if df['session_id'].nunique() > 0 else 0
+            len(sessions),
+            total_predictions / len(sessions) if len(sessions) > 0 else 0
         ]
     }
     summary_df = pd.DataFrame(summary_stats)
     summary_df.to_csv(SUMMARY_STATS_FILE, index=False)
 
-    # --- Runs 1-50 ---
-    print("=== SPLIT ANALYSIS: RUNS 1-50 ===")
-    df_1_50 = df[(df['run_number'] >= 1) & (df['run_number'] <= 50)]
-    total_1_50 = len(df_1_50)
-    correct_1_50 = len(df_1_50[df_1_50['prediction_correctness'] == 'Correct'])
-    acc_1_50 = (correct_1_50 / total_1_50 * 100) if total_1_50 > 0 else 0
-    print(f"Total Predictions: {total_1_50}")
-    print(f"Correct Predictions: {correct_1_50}")
-    print(f"Overall Accuracy: {acc_1_50:.2f}%")
-    
-    run_accuracies_1_50 = []
-    for run_num in sorted(df_1_50['run_number'].unique()):
-        run_data = df_1_50[df_1_50['run_number'] == run_num]
-        run_total = len(run_data)
-        run_correct = len(run_data[run_data['prediction_correctness'] == 'Correct'])
-        run_acc = (run_correct / run_total) * 100 if run_total > 0 else 0
-        run_accuracies_1_50.append(run_acc)
-    
-    if run_accuracies_1_50:
-        mean_1_50 = np.mean(run_accuracies_1_50)
-        std_1_50 = np.std(run_accuracies_1_50)
-        print(f"Mean accuracy: {mean_1_50:.2f}%")
-        print(f"Standard deviation: {std_1_50:.2f}%")
-
-    # --- Runs 51-100 ---
-    print("\n=== SPLIT ANALYSIS: RUNS 51-100 ===")
-    df_51_100 = df[(df['run_number'] >= 51) & (df['run_number'] <= 100)]
-    total_51_100 = len(df_51_100)
-    correct_51_100 = len(df_51_100[df_51_100['prediction_correctness'] == 'Correct'])
-    acc_51_100 = (correct_51_100 / total_51_100 * 100) if total_51_100 > 0 else 0
-    print(f"Total Predictions: {total_51_100}")
-    print(f"Correct Predictions: {correct_51_100}")
-    print(f"Overall Accuracy: {acc_51_100:.2f}%")
-    
-    run_accuracies_51_100 = []
-    for run_num in sorted(df_51_100['run_number'].unique()):
-        run_data = df_51_100[df_51_100['run_number'] == run_num]
-        run_total = len(run_data)
-        run_correct = len(run_data[run_data['prediction_correctness'] == 'Correct'])
-        run_acc = (run_correct / run_total) * 100 if run_total > 0 else 0
-        run_accuracies_51_100.append(run_acc)
-    
-    if run_accuracies_51_100:
-        mean_51_100 = np.mean(run_accuracies_51_100)
-        std_51_100 = np.std(run_accuracies_51_100)
-        print(f"Mean accuracy: {mean_51_100:.2f}%")
-        print(f"Standard deviation: {std_51_100:.2f}%")
-
-    # --- Runs 101 Onwards ---
-    print("\n=== SPLIT ANALYSIS: RUNS 101 ONWARDS ===")
-    df_101_onwards = df[df['run_number'] >= 101]
-    total_101_onwards = len(df_101_onwards)
-    correct_101_onwards = len(df_101_onwards[df_101_onwards['prediction_correctness'] == 'Correct'])
-    acc_101_onwards = (correct_101_onwards / total_101_onwards * 100) if total_101_onwards > 0 else 0
-    print(f"Total Predictions: {total_101_onwards}")
-    print(f"Correct Predictions: {correct_101_onwards}")
-    print(f"Overall Accuracy: {acc_101_onwards:.2f}%")
-    
-    run_accuracies_101_onwards = []
-    for run_num in sorted(df_101_onwards['run_number'].unique()):
-        run_data = df_101_onwards[df_101_onwards['run_number'] == run_num]
-        run_total = len(run_data)
-        run_correct = len(run_data[run_data['prediction_correctness'] == 'Correct'])
-        run_acc = (run_correct / run_total) * 100 if run_total > 0 else 0
-        run_accuracies_101_onwards.append(run_acc)
-    
-    if run_accuracies_101_onwards:
-        mean_101_onwards = np.mean(run_accuracies_101_onwards)
-        std_101_onwards = np.std(run_accuracies_101_onwards)
-        print(f"Mean accuracy: {mean_101_onwards:.2f}%")
-        print(f"Standard deviation: {std_101_onwards:.2f}%")
+    # --- Runs per range ---
+    cohorts = cohort_counts(runs, SPLIT_RANGES, COUNT_COLUMNS)
+    for index, (label, start, end) in enumerate(SPLIT_RANGES):
+        print(("\n" if index else "") + f"=== SPLIT ANALYSIS: RUNS {label.upper()} ===")
+        total, correct = cohorts.loc[label, 'total_predictions'], cohorts.loc[label, 'correct_predictions']
+        print(f"Total Predictions: {total}")
+        print(f"Correct Predictions: {correct}")
+        print(f"Overall Accuracy: {(correct / total * 100) if total > 0 else 0:.2f}%")
+        
+        run_numbers = run_accuracy_df['run_number']
+        in_range = (run_numbers >= start) & ((run_numbers <= end) if end is not None else True)
+        range_accuracies = run_accuracy_df.loc[in_range, 'accuracy_percentage'].tolist()
+        if range_accuracies:
+            print(f"Mean accuracy: {np.mean(range_accuracies):.2f}%")
+            print(f"Standard deviation: {np.std(range_accuracies):.2f}%")
 
     print(f"\n✓ Analysis complete! Files saved:")
     print(f"  - {PER_RUN_ACCURACY_FILE}")
@@ -0,0 +1,53 @@
+# Running prediction calls concurrently
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_pool.agent import MAX_CONCURRENCY
+
+async def gather_calls(calls, max_concurrency=None):
+    """
+    Runs blocking zero-argument callables on a thread pool with at most
+    max_concurrency in flight. Results (or raised exceptions) keep the order of calls.
+    """
+    max_concurrency = max(1, max_concurrency or MAX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        async def run_one(call):
+            async with semaphore:
+                return await loop.run_in_executor(executor, call)
+
+        return await asyncio.gather(*(run_one(call) for call in calls), return_exceptions=True)
+
+def run_calls_concurrently(calls, max_concurrency=None):
+    """Synchronous entry point for gather_calls, used by the prediction scripts."""
+    calls = list(calls)
+    if not calls:
+        return []
+    return asyncio.run(gather_calls(calls, max_concurrency))
+
+def _result_or_exception(future):
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+def stream_calls(calls, max_concurrency=None, max_pending=None):
+    """
+    Runs calls taken lazily from an iterator, at most max_concurrency in flight, and yields
+    their results (or raised exceptions) in order. At most max_pending calls are submitted
+    ahead of the consumer, so memory stays bounded however many calls the iterator produces.
+    """
+    max_concurrency = max(1, max_concurrency or MAX_CONCURRENCY)
+    max_pending = max(max_concurrency, max_pending or 4 * max_concurrency)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for call in calls:
+            if len(pending) >= max_pending:
+                yield _result_or_exception(pending.popleft())
+            pending.append(executor.submit(call))
+        while pending:
+            yield _result_or_exception(pending.popleft())
@@ -0,0 +1,187 @@
+# Batch API mode for large multi-run sweeps
+#
+# Usage: python batch_runner.py <meg|pd|tg> <first_run> [last_run] [--prompts prompts_<game>.jsonl]
+#
+# Writes every (run, session) request of a game to one JSONL batch file, submits it,
+# polls until the batch finishes and saves each run through the game's own output code,
+# writing the consolidated file once.
+#
+# The batch id is saved with a hash of the batch file in batch_<game>_runs<first>-<last>.batch_id.
+# A rerun resumes that batch only if the requests are unchanged and it has not failed, expired or
+# been cancelled; otherwise the batch file is submitted again.
+# Set OPENAI_BASE_URL to point the client at a local stand-in server.
+
+import argparse
+import json
+import os
+import time
+
+from data_cache import file_hash
+from games import GAMES, save_runs
+from llm_backend import response_format, is_usable_response
+from materialize import load_sessions
+from response_cache import make_cache_key, store_response
+
+from agent_pool.agent import get_agent_client, MODEL_NAME, TEMPERATURE
+
+BATCH_FILE = 'batch_{game}_runs{first_run}-{last_run}.jsonl'
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+POLL_INTERVAL_SECONDS = int(os.getenv("BATCH_POLL_INTERVAL", "60"))
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+# Batches that produced no usable output and are submitted again on a rerun
+RESUBMIT_STATUSES = ('failed', 'expired', 'cancelled')
+
+def make_custom_id(run_number, index):
+    return f"run{run_number}-{index}"
+
+def write_batch_file(batch_file, game, system_message, sessions, run_numbers):
+    """Writes one chat completion request per (run, session) pair."""
+    with open(batch_file, 'w', encoding='utf-8') as f:
+        for run_number in run_numbers:
+            for index, session in enumerate(sessions):
+                request = {
+                    'custom_id': make_custom_id(run_number, index),
+                    'method': 'POST',
+                    'url': BATCH_ENDPOINT,
+                    'body': {
+                        'model': MODEL_NAME,
+                        'temperature': TEMPERATURE,
+                        'response_format': response_format(game.upper()),
+                        'messages': [
+                            {'role': 'system', 'content': system_message},
+                            {'role': 'user', 'content': session['user_message']}
+                        ]
+                    }
+                }
+                f.write(json.dumps(request) + '\n')
+    print(f"Wrote {len(run_numbers) * len(sessions)} requests to '{batch_file}'")
+
+def submit_batch(batch_file):
+    """Uploads the batch file and creates the batch. Returns the batch id."""
+    client = get_agent_client()
+    with open(batch_file, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW
+    )
+    print(f"Submitted batch {batch.id}")
+    return batch.id
+
+def _read_batch_id(batch_id_file):
+    """Returns (batch id, input hash) saved for a batch file, or (None, None)."""
+    try:
+        with open(batch_id_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        return saved['batch_id'], saved['input_sha256']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+def _write_batch_id(batch_id_file, batch_id, input_hash):
+    tmp_file = f"{batch_id_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'batch_id': batch_id, 'input_sha256': input_hash}, f)
+    os.replace(tmp_file, batch_id_file)
+
+def submit_or_resume(batch_file, batch_id_file):
+    """
+    Returns the id of the batch for batch_file: the saved one when it was submitted from the same
+    requests and did not fail, expire or get cancelled, otherwise a newly submitted one.
+    """
+    input_hash = file_hash(batch_file)
+    batch_id, saved_hash = _read_batch_id(batch_id_file)
+    if batch_id is not None and saved_hash == input_hash:
+        status = get_agent_client().batches.retrieve(batch_id).status
+        if status not in RESUBMIT_STATUSES:
+            print(f"Resuming batch {batch_id} from '{batch_id_file}'")
+            return batch_id
+        print(f"Batch {batch_id} ended with status '{status}', submitting it again.")
+    elif batch_id is not None:
+        print(f"The requests changed since batch {batch_id} was submitted, submitting them again.")
+    elif os.path.exists(batch_id_file):
+        print(f"'{batch_id_file}' has no input hash, submitting the batch again.")
+    batch_id = submit_batch(batch_file)
+    _write_batch_id(batch_id_file, batch_id, input_hash)
+    return batch_id
+
+def wait_for_batch(batch_id, poll_interval=POLL_INTERVAL_SECONDS):
+    """Polls the batch until it reaches a terminal status and returns it."""
+    client = get_agent_client()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts:
+            print(f"Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} completed, {counts.failed} failed)")
+        else:
+            print(f"Batch {batch_id}: {batch.status}")
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def read_batch_results(batch):
+    """
+    Maps each custom_id to the response body of a successful request,
+    or to an exception describing why the request failed.
+    """
+    client = get_agent_client()
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if response.get('status_code') == 200:
+                results[record['custom_id']] = response['body']
+            else:
+                error = record.get('error') or response.get('body', {}).get('error')
+                results[record['custom_id']] = RuntimeError(f"Batch request failed: {error}")
+    return results
+
+def run_batch(game, run_numbers, prompts_file=None):
+    module, _ = GAMES[game]
+    loaded = load_sessions(game, prompts_file)
+    if loaded is None:
+        return
+    system_message, sessions = loaded
+
+    # Reuse a batch already submitted with the same requests for the same game and runs
+    batch_file = BATCH_FILE.format(game=game, first_run=run_numbers[0], last_run=run_numbers[-1])
+    write_batch_file(batch_file, game, system_message, sessions, run_numbers)
+    batch_id = submit_or_resume(batch_file, batch_file.replace('.jsonl', '.batch_id'))
+
+    batch = wait_for_batch(batch_id)
+    if batch.status != 'completed':
+        print(f"WARNING: Batch ended with status '{batch.status}', saving the results that are available.")
+    results = read_batch_results(batch)
+
+    responses_by_run = {}
+    for run_number in run_numbers:
+        ai_responses = []
+        for index, session in enumerate(sessions):
+            result = results.get(make_custom_id(run_number, index), RuntimeError("No result returned by the batch."))
+            if isinstance(result, Exception):
+                ai_responses.append(result)
+                continue
+            content = result['choices'][0]['message']['content']
+            # Keep usable batch responses in the response cache so later reruns replay them
+            if is_usable_response(game.upper(), content):
+                cache_key = make_cache_key(MODEL_NAME, TEMPERATURE, system_message, session['user_message'], run_number, response_format(game.upper()))
+                store_response(cache_key, MODEL_NAME, content, result.get('usage'))
+            ai_responses.append(content)
+        responses_by_run[run_number] = ai_responses
+    save_runs(module, sessions, responses_by_run)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run prediction runs of one game as a Batch API job.")
+    parser.add_argument('game', choices=sorted(GAMES))
+    parser.add_argument('first_run', type=int)
+    parser.add_argument('last_run', type=int, nargs='?', default=None)
+    parser.add_argument('--prompts', default=None, help="Read sessions from a prompt artifact written by materialize.py")
+    args = parser.parse_args()
+    last_run = args.last_run if args.last_run is not None else args.first_run
+    run_batch(args.game, list(range(args.first_run, last_run + 1)), args.prompts)
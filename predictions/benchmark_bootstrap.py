@@ -0,0 +1,103 @@
+# Benchmark of the bootstrap of accuracy over runs and sessions
+#
+# Usage: python benchmark_bootstrap.py [--runs 50] [--sessions 300] [--players 4]
+#                                      [--replicates 10000] [--check 20]
+#
+# Generates synthetic predictions of three models (runs x sessions x players), builds their
+# correctness matrices and times the vectorized bootstrap. The reference resamples the
+# prediction DataFrame one replicate at a time, by merging it with the drawn runs and sessions;
+# it is timed on the first replicates, extrapolated, and checked to give identical accuracies.
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import bootstrap
+from bootstrap import CorrectnessMatrix, replicate_accuracies, resample_counts
+
+MODELS = {'gpt-4o': 0.55, 'gpt-4o-mini': 0.5, 'gpt-5': 0.6}
+
+def make_predictions(n_runs, n_sessions, n_players, seed=0):
+    """Synthetic prediction rows with a per-session difficulty shared by all models."""
+    rng = np.random.default_rng(seed)
+    difficulty = rng.normal(0, 0.15, n_sessions)
+    frames = []
+    for model, skill in MODELS.items():
+        run = np.repeat(np.arange(1, n_runs + 1), n_sessions * n_players)
+        session = np.tile(np.repeat(np.arange(n_sessions), n_players), n_runs)
+        frames.append(pd.DataFrame({
+            'model': model,
+            'run_number': run,
+            'session_id': session,
+            'correct': rng.random(len(run)) < np.clip(skill + difficulty[session], 0, 1),
+            'counted': rng.random(len(run)) < 0.95
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def build_matrices(df):
+    sessions = np.sort(df['session_id'].unique())
+    matrices = {}
+    for model, rows in df.groupby('model'):
+        counts = rows.assign(correct=rows['correct'] & rows['counted']).pivot_table(
+            index='run_number', columns='session_id', values=['correct', 'counted'], aggfunc='sum', fill_value=0)
+        matrices[model] = CorrectnessMatrix(
+            counts.index.to_numpy(), sessions,
+            counts['correct'].reindex(columns=sessions, fill_value=0).to_numpy(dtype=float),
+            counts['counted'].reindex(columns=sessions, fill_value=0).to_numpy(dtype=float)
+        )
+    return matrices
+
+def reference_accuracy(rows, runs, sessions, run_counts, session_counts):
+    """One replicate the DataFrame way: rows repeated once per draw of their run and session."""
+    drawn_runs = pd.DataFrame({'run_number': np.repeat(runs, run_counts)})
+    drawn_sessions = pd.DataFrame({'session_id': np.repeat(sessions, session_counts)})
+    resampled = rows.merge(drawn_runs, on='run_number').merge(drawn_sessions, on='session_id')
+    counted = resampled[resampled['counted']]
+    return counted['correct'].sum() / len(counted) * 100 if len(counted) else np.nan
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<36} {elapsed:8.3f} s")
+    return result, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized bootstrap against a per-replicate DataFrame loop.")
+    parser.add_argument('--runs', type=int, default=50, help="runs per model (default 50)")
+    parser.add_argument('--sessions', type=int, default=300, help="sessions (default 300)")
+    parser.add_argument('--players', type=int, default=4, help="predictions per session (default 4)")
+    parser.add_argument('--replicates', type=int, default=10000, help="bootstrap replicates (default 10000)")
+    parser.add_argument('--check', type=int, default=20, help="replicates computed by the reference loop (default 20)")
+    args = parser.parse_args()
+
+    df = make_predictions(args.runs, args.sessions, args.players)
+    print(f"{len(MODELS)} models x {args.runs} runs x {args.sessions} sessions, {len(df)} predictions")
+    matrices = build_matrices(df)
+
+    print(f"\nVectorized bootstrap, {args.replicates} replicates:")
+    _, elapsed = timed("bootstrap.summarize", bootstrap.summarize, matrices, args.replicates)
+
+    # The reference loop is slow, so it is timed and compared on the first replicates only
+    rng = np.random.default_rng(1)
+    session_counts = resample_counts(rng, args.sessions, args.check)
+    print(f"\nReference loop on {args.check} replicates:")
+    for model, matrix in matrices.items():
+        run_counts = resample_counts(rng, len(matrix.runs), args.check)
+        rows = df[df['model'] == model]
+        reference, reference_elapsed = timed(
+            f"{model} DataFrame loop",
+            lambda: np.array([reference_accuracy(rows, matrix.runs, matrix.sessions, run_counts[i], session_counts[i])
+                              for i in range(args.check)])
+        )
+        vectorized, _ = timed(f"{model} replicate_accuracies", replicate_accuracies, matrix, run_counts, session_counts)
+        if not np.allclose(reference, vectorized, rtol=0, atol=1e-9, equal_nan=True):
+            raise AssertionError(f"{model}: vectorized accuracies differ from the reference")
+        print(f"  {model}: {args.check} replicates identical to the reference, "
+              f"{args.replicates} would take ~{reference_elapsed / args.check * args.replicates:.0f} s")
+    print(f"\nAll models, all pairs: {elapsed:.2f} s for {args.replicates} replicates")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# Micro-benchmark of response parsing
+#
+# Usage: python benchmark_parser.py [prediction CSVs ...] [--repeat 5] [--synthetic 2000]
+#
+# Parses recorded model outputs (the prediction_text / raw_prediction_text columns of the run
+# files; by default every predictions file in the working directory) with the regex extraction
+# the prediction scripts used before and with response_parser, with and without orjson.
+# Synthetic reasoning-heavy outputs are added so the benchmark also runs without recorded files,
+# and are also timed per shape: clean and fenced JSON are what the backends return, while
+# extract_json() spends extra time on prose-wrapped outputs to recover the object the regex loses.
+# Checks that response_parser decodes every response the regex extraction could decode to the
+# same object, and prints the timings.
+
+import argparse
+import glob
+import json
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+import response_parser
+
+RECORDED_FILES = ['predictions_minimum_effort*.csv', 'minimal_raw_ai_predictions*.csv', 'predictions_trust_game_run*.csv']
+TEXT_COLUMNS = ['prediction_text', 'raw_prediction_text']
+
+def legacy_extract(text):
+    """The inline extraction of the prediction scripts: direct decode or the greedy regex."""
+    try:
+        if text.strip().startswith('{'):
+            return json.loads(text)
+        json_match = re.search(r'\{.*\}', text, re.DOTALL)
+        return json.loads(json_match.group(0)) if json_match else None
+    except (json.JSONDecodeError, Exception):
+        return None
+
+def load_recorded(paths):
+    responses = []
+    for path in paths:
+        df = pd.read_csv(path)
+        for column in TEXT_COLUMNS:
+            if column in df.columns:
+                responses.extend(df[column].dropna().astype(str))
+    return responses
+
+SYNTHETIC_SHAPES = ['clean', 'fenced', 'prose-wrapped', 'truncated', 'unbalanced']
+
+def make_synthetic(n, seed=0):
+    """Responses of each of SYNTHETIC_SHAPES in turn, with long reasoning."""
+    rng = np.random.default_rng(seed)
+    responses = []
+    for i in range(n):
+        reasoning = " ".join(f"step {k}: player {k % 3 + 1} {{said}} they would cooperate." for k in range(rng.integers(20, 200)))
+        body = json.dumps({
+            'player_predictions': [{'player_id': f"Player {p}", 'predicted_choice': int(rng.integers(1, 8)), 'reasoning': reasoning} for p in (1, 2, 3)],
+            'conclusion': {'outcome': int(rng.integers(1, 8))}
+        })
+        kind = i % 5
+        if kind == 0:
+            responses.append(body)
+        elif kind == 1:
+            responses.append(f"```json\n{body}\n```")
+        elif kind == 2:
+            responses.append(f"Here is my analysis. {reasoning}\n{body}\nNote: {{x}} is a placeholder.")
+        elif kind == 3:
+            responses.append(body[:len(body) // 2])
+        else:
+            # Unbalanced braces: the regex retries its match from every '{'
+            responses.append("{" * 200 + reasoning.replace('{said}', 'said') * 3)
+    return responses
+
+def timed(label, func, responses, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [func(text) for text in responses]
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<28} {best:8.3f} s  ({len(responses) / best:,.0f} responses/s)")
+    return results
+
+def try_extract(text):
+    try:
+        return response_parser.extract_json(text)
+    except ValueError:
+        return None
+
+def check_identical(legacy, new):
+    mismatches = [i for i, (old, parsed) in enumerate(zip(legacy, new)) if old is not None and old != parsed]
+    if mismatches:
+        raise AssertionError(f"{len(mismatches)} responses decode differently, e.g. {mismatches[:3]}")
+    recovered = sum(1 for old, parsed in zip(legacy, new) if old is None and parsed is not None)
+    print(f"  identical on all {sum(old is not None for old in legacy)} responses the regex decoded, {recovered} more recovered")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response_parser against the regex extraction.")
+    parser.add_argument('files', nargs='*', help="prediction CSVs (default: the run files in the working directory)")
+    parser.add_argument('--repeat', type=int, default=5, help="timing repetitions, the best is reported (default 5)")
+    parser.add_argument('--synthetic', type=int, default=2000, help="synthetic responses to add (default 2000)")
+    args = parser.parse_args()
+
+    paths = args.files or sorted(path for pattern in RECORDED_FILES for path in glob.glob(pattern))
+    recorded = load_recorded(paths)
+    print(f"{len(recorded)} recorded responses from {len(paths)} files, {args.synthetic} synthetic")
+
+    synthetic = make_synthetic(args.synthetic)
+    datasets = [("Recorded", recorded), ("Synthetic", synthetic)]
+    datasets += [(f"Synthetic, {shape}", synthetic[i::len(SYNTHETIC_SHAPES)]) for i, shape in enumerate(SYNTHETIC_SHAPES)]
+    for label, responses in datasets:
+        if not responses:
+            continue
+        print(f"\n{label}, {sum(map(len, responses)) / len(responses):,.0f} characters on average:")
+        legacy = timed("regex extraction", legacy_extract, responses, args.repeat)
+        orjson = response_parser.orjson
+        response_parser.orjson = None
+        timed("extract_json (json)", try_extract, responses, args.repeat)
+        response_parser.orjson = orjson
+        if orjson is not None:
+            new = timed("extract_json (orjson)", try_extract, responses, args.repeat)
+        else:
+            new = [try_extract(text) for text in responses]
+            print("  orjson is not installed")
+        timed("parse_meg", response_parser.parse_meg, responses, args.repeat)
+        timed("parse_pd", response_parser.parse_pd, responses, args.repeat)
+        timed("parse_tg", response_parser.parse_tg, responses, args.repeat)
+        check_identical(legacy, new)
+
+if __name__ == '__main__':
+    main()
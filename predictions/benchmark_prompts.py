@@ -0,0 +1,130 @@
+# Benchmark of the prompt-building stage
+#
+# Usage: python benchmark_prompts.py [--sessions 20000] [--check 500]
+#
+# Generates a synthetic chat table with the columns of the experiment workbook, renders the
+# MEG and PD prompts with the row-by-row reference loop and with the one-pass prompt table,
+# checks that both produce identical messages and prints the timings.
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import prediction_minimum_effort as meg
+import prediction_prisoners_dilemma as ipd
+
+MEG_TEMPLATE = "{PROPOSALS_DATA}\n{CHAT_LOGS}\nPredict each player's choice."
+PD_TEMPLATE = "Team 1: {TEAM1_PLAYER_IDS}\nTeam 2: {TEAM2_PLAYER_IDS}\n{TEAM1_CHAT_LOGS}\n{INTERGROUP_CHAT_LOGS}"
+MESSAGES_PER_PLAYER = 4
+
+def make_chat_table(n_games, seed=0):
+    """Synthetic rows: n_games games of two 3-player subgroups, with task 1, 3 and 4 chat."""
+    rng = np.random.default_rng(seed)
+    n_players = n_games * 6
+    player = np.repeat(np.arange(n_players), MESSAGES_PER_PLAYER * 3)
+    game = player // 6
+    task = np.tile(np.repeat([1, 3, 4], MESSAGES_PER_PLAYER), n_players)
+    df = pd.DataFrame({
+        'session': game // 100 + 1,
+        'Cluster.x': game % 100 + 1,
+        'Subgroup.x': (player % 6) // 3 + 1,
+        'task': task,
+        'Treatment': 2,
+        'Sender': player + 1,
+        'texttype': [f"message {i}" for i in range(len(player))],
+        'T1_XProposal': rng.integers(1, 8, n_players)[player].astype(float),
+        'T1_XChoice': rng.integers(1, 8, n_players)[player].astype(float),
+        'T3_Vote': np.where(rng.random(n_players) < 0.5, 'M', 'J')[player]
+    })
+    return df
+
+def reference_meg_prompts(df, user_template):
+    """The original per-group iterrows() rendering."""
+    messages = {}
+    for name, group in df.groupby(meg.SESSION_COLS):
+        group = group.sort_index()
+        proposals_for_prompt = "Proposals:\n"
+        for _, row in group[[meg.SENDER_COL, meg.PROPOSAL_COL]].drop_duplicates().iterrows():
+            proposals_for_prompt += f"Player {row[meg.SENDER_COL]} proposes: {row[meg.PROPOSAL_COL]}\n"
+        chat_log_for_prompt = "\nChat Log:\n"
+        for _, row in group.iterrows():
+            chat_log_for_prompt += f"Player {row[meg.SENDER_COL]}: {row[meg.MESSAGE_COL]}\n"
+        messages[str(name)] = user_template.format(PROPOSALS_DATA=proposals_for_prompt, CHAT_LOGS=chat_log_for_prompt)
+    return messages
+
+def reference_pd_prompts(relevant_df, user_template):
+    """The original per-perspective mask and iterrows() rendering."""
+    messages = {}
+    for game_id, game_data in relevant_df.groupby('game_id'):
+        subgroups = sorted(game_data[ipd.SUBGROUP_COL].unique())
+        if len(subgroups) != 2:
+            continue
+        for focal_subgroup, opponent_subgroup in [(subgroups[0], subgroups[1]), (subgroups[1], subgroups[0])]:
+            team1_players = sorted(game_data[game_data[ipd.SUBGROUP_COL] == focal_subgroup][ipd.SENDER_COL].unique())
+            team2_players = sorted(game_data[game_data[ipd.SUBGROUP_COL] == opponent_subgroup][ipd.SENDER_COL].unique())
+            focal_chat_data = game_data[(game_data[ipd.SUBGROUP_COL] == focal_subgroup) & (game_data[ipd.TASK_COL] == 3)]
+            intergroup_chat_data = game_data[game_data[ipd.TASK_COL] == 4]
+            messages[f"{game_id}_{focal_subgroup}"] = user_template.format(
+                TEAM1_PLAYER_IDS=", ".join(map(str, team1_players)),
+                TEAM2_PLAYER_IDS=", ".join(map(str, team2_players)),
+                TEAM1_CHAT_LOGS="\n".join([f"Player {row[ipd.SENDER_COL]}: {row[ipd.MESSAGE_COL]}" for _, row in focal_chat_data.iterrows()]),
+                INTERGROUP_CHAT_LOGS="\n".join([f"Player {row[ipd.SENDER_COL]}: {row[ipd.MESSAGE_COL]}" for _, row in intergroup_chat_data.iterrows()])
+            )
+    return messages
+
+def prepare_pd_frame(df):
+    """The dtype preparation of the PD script's load_inputs()."""
+    relevant_df = df[df[ipd.TREATMENT_COL] == 2].copy()
+    relevant_df['session'] = relevant_df['session'].astype(str)
+    relevant_df['Cluster.x'] = pd.to_numeric(relevant_df['Cluster.x'], errors='coerce').astype('Int64')
+    relevant_df[ipd.SUBGROUP_COL] = pd.to_numeric(relevant_df[ipd.SUBGROUP_COL], errors='coerce').astype('Int64')
+    relevant_df['game_id'] = relevant_df[ipd.GAME_ID_COLS].astype(str).agg('_'.join, axis=1)
+    return relevant_df
+
+def build_pd_prompt_table(relevant_df):
+    return ipd.build_prompt_table(ipd.build_game_index(relevant_df), PD_TEMPLATE)
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print(f"  {label:<28} {time.perf_counter() - start:8.3f} s")
+    return result
+
+def check_identical(game, table, reference):
+    mismatches = [sid for sid, message in zip(table['session_id'], table['user_message']) if reference.get(sid) != message]
+    if mismatches or len(table) != len(reference):
+        raise AssertionError(f"{game}: {len(mismatches)} prompts differ from the reference, e.g. {mismatches[:3]}")
+    print(f"  {game}: {len(reference)} prompts identical to the reference")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one-pass prompt building against the iterrows() loop.")
+    parser.add_argument('--sessions', type=int, default=20000, help="number of synthetic games (default 20000)")
+    parser.add_argument('--check', type=int, default=500, help="games rendered by the reference loop (default 500)")
+    args = parser.parse_args()
+
+    df = make_chat_table(args.sessions)
+    meg_df = df[df['task'] == 1]
+    pd_df = prepare_pd_frame(df)
+    print(f"{args.sessions} games, {len(df)} rows, {meg_df.groupby(meg.SESSION_COLS).ngroups} MEG sessions")
+
+    print("\nOne-pass prompt table:")
+    meg_table = timed("MEG build_prompt_table", meg.build_prompt_table, meg_df, MEG_TEMPLATE)
+    pd_table = timed("PD build_prompt_table", build_pd_prompt_table, pd_df)
+    print(f"  {len(meg_table)} MEG and {len(pd_table)} PD prompts")
+
+    # The reference loop is slow, so it is timed and compared on the first games only
+    check_df = make_chat_table(min(args.check, args.sessions))
+    check_meg = check_df[check_df['task'] == 1]
+    check_pd = prepare_pd_frame(check_df)
+    print(f"\nReference loop on {min(args.check, args.sessions)} games:")
+    meg_reference = timed("MEG iterrows", reference_meg_prompts, check_meg, MEG_TEMPLATE)
+    pd_reference = timed("PD iterrows", reference_pd_prompts, check_pd, PD_TEMPLATE)
+    timed("MEG build_prompt_table", meg.build_prompt_table, check_meg, MEG_TEMPLATE)
+    timed("PD build_prompt_table", build_pd_prompt_table, check_pd)
+    check_identical('MEG', meg.build_prompt_table(check_meg, MEG_TEMPLATE), meg_reference)
+    check_identical('PD', build_pd_prompt_table(check_pd), pd_reference)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Bootstrap confidence intervals of prediction accuracy, resampled over runs and sessions
+#
+# Usage: python bootstrap.py <meg|pd|tg> <level> [--replicates 10000] [--confidence 0.95]
+#                            [--seed 0] [--output bootstrap.csv]
+#
+# Each model's predictions of a game level are reduced to a correctness matrix: correct and
+# counted predictions per (run, session). A replicate draws runs and sessions with replacement
+# as multinomial counts r and c, so its correct total is r @ correct @ c. A chunk of replicates
+# is one matrix product, which makes 10,000 replicates a matter of seconds.
+#
+# All models share the session axis and every replicate draws the sessions once for all of them,
+# while runs are drawn per model. Differences between two models are therefore paired over
+# sessions. The estimate is the pooled accuracy (correct / counted) in percent; intervals are
+# percentile intervals of the replicates.
+
+import argparse
+from collections import namedtuple
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from accuracy_cube import CUBE_GAMES, row_models
+
+REPLICATES = 10000
+CONFIDENCE = 0.95
+# Replicates drawn per matrix product; bounds memory at CHUNK_REPLICATES x sessions values
+CHUNK_REPLICATES = 1000
+
+CorrectnessMatrix = namedtuple('CorrectnessMatrix', ['runs', 'sessions', 'correct', 'total'])
+
+def correctness_matrices(game, level, df=None):
+    """
+    Returns {model: CorrectnessMatrix} for one level of a game ('group', 'individual', ...), with
+    the same sessions, in the same order, for every model. df defaults to the game's results.
+    """
+    load, levels = CUBE_GAMES[game]
+    df = load() if df is None else df
+    if df is None or df.empty:
+        return {}
+    for name, rows, correct, counted in levels(df):
+        if name == level:
+            break
+    else:
+        raise ValueError(f"Unknown level '{level}' for '{game}'")
+
+    models = row_models(game, rows)
+    session_codes, sessions = pd.factorize(rows['session_id'])
+    matrices = {}
+    for model in sorted(set(models)):
+        selected = (models == model) & (session_codes >= 0) & rows['run_number'].notna().to_numpy()
+        run_codes, runs = pd.factorize(rows['run_number'][selected], sort=True)
+        cells = run_codes * len(sessions) + session_codes[selected]
+        shape = (len(runs), len(sessions))
+        matrices[model] = CorrectnessMatrix(
+            np.asarray(runs), np.asarray(sessions),
+            np.bincount(cells, weights=(correct & counted)[selected], minlength=shape[0] * shape[1]).reshape(shape),
+            np.bincount(cells, weights=counted[selected], minlength=shape[0] * shape[1]).reshape(shape)
+        )
+    return matrices
+
+def resample_counts(rng, n, size):
+    """size draws of n items out of n with replacement, as counts per item (size x n)."""
+    return rng.multinomial(n, np.full(n, 1 / n), size=size)
+
+def accuracy_percent(correct, total):
+    return np.divide(correct, total, out=np.full(np.shape(correct), np.nan), where=np.asarray(total) > 0) * 100
+
+def replicate_accuracies(matrix, run_counts, session_counts):
+    """Accuracy of each replicate given its draws of the matrix's runs and sessions, as counts (replicates x n)."""
+    correct = ((run_counts @ matrix.correct) * session_counts).sum(axis=1)
+    total = ((run_counts @ matrix.total) * session_counts).sum(axis=1)
+    return accuracy_percent(correct, total)
+
+def bootstrap_replicates(matrices, replicates=REPLICATES, seed=0):
+    """Returns {model: accuracy of each replicate, in percent}; NaN where a replicate counts nothing."""
+    rng = np.random.default_rng(seed)
+    n_sessions = len(next(iter(matrices.values())).sessions) if matrices else 0
+    results = {model: [] for model in matrices}
+    for start in range(0, replicates, CHUNK_REPLICATES):
+        size = min(CHUNK_REPLICATES, replicates - start)
+        session_counts = resample_counts(rng, n_sessions, size)
+        for model, matrix in matrices.items():
+            run_counts = resample_counts(rng, len(matrix.runs), size)
+            results[model].append(replicate_accuracies(matrix, run_counts, session_counts))
+    return {model: np.concatenate(chunks) if chunks else np.empty(0) for model, chunks in results.items()}
+
+def _interval(values, confidence):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan, np.nan, np.nan
+    low, high = np.percentile(values, [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100])
+    return low, high, np.std(values, ddof=1) if len(values) > 1 else 0.0
+
+def summarize(matrices, replicates=REPLICATES, confidence=CONFIDENCE, seed=0):
+    """
+    One row per model (its accuracy) and per pair of models (the paired difference), with the
+    estimate, the percentile interval, the bootstrap standard error and, for differences, the
+    two-sided share of replicates on the other side of zero.
+    """
+    draws = bootstrap_replicates(matrices, replicates, seed)
+    estimates = {model: float(accuracy_percent(matrix.correct.sum(), matrix.total.sum())) for model, matrix in matrices.items()}
+    rows = []
+    for model in matrices:
+        low, high, std_error = _interval(draws[model], confidence)
+        rows.append({'comparison': model, 'estimate': estimates[model], 'ci_low': low, 'ci_high': high,
+                     'std_error': std_error, 'p_value': np.nan})
+    for first, second in combinations(matrices, 2):
+        difference = draws[first] - draws[second]
+        low, high, std_error = _interval(difference, confidence)
+        difference = difference[~np.isnan(difference)]
+        p_value = min(1.0, 2 * min(np.mean(difference <= 0), np.mean(difference >= 0))) if len(difference) else np.nan
+        rows.append({'comparison': f"{first} - {second}", 'estimate': estimates[first] - estimates[second],
+                     'ci_low': low, 'ci_high': high, 'std_error': std_error, 'p_value': p_value})
+    return pd.DataFrame(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bootstrap CIs of accuracy per model, resampling runs and sessions.")
+    parser.add_argument('game', choices=sorted(CUBE_GAMES))
+    parser.add_argument('level', help="meg: individual|group, pd: individual|team, tg: session")
+    parser.add_argument('--replicates', type=int, default=REPLICATES, help=f"bootstrap replicates (default {REPLICATES})")
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE, help=f"interval coverage (default {CONFIDENCE})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="also write the table to this CSV")
+    args = parser.parse_args()
+
+    matrices = correctness_matrices(args.game, args.level)
+    if not matrices:
+        print(f"No results for '{args.game}'")
+    else:
+        for model, matrix in matrices.items():
+            print(f"{model}: {len(matrix.runs)} runs x {len(matrix.sessions)} sessions, {int(matrix.total.sum())} counted predictions")
+        summary = summarize(matrices, args.replicates, args.confidence, args.seed)
+        print(f"\n{args.game} {args.level} accuracy (%), {args.replicates} replicates, {args.confidence:.0%} percentile intervals:")
+        print(summary.to_string(index=False, float_format='%.2f'))
+        if args.output:
+            summary.to_csv(args.output, index=False)
+            print(f"Saved to '{args.output}'")
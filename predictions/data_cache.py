@@ -0,0 +1,197 @@
+# Columnar cache of the experiment workbook
+#
+# Parsing merged_table_cason_2019.xlsx with openpyxl is the slowest local step of a run.
+# load_workbook() converts the workbook once per view and reads the cached copy afterwards:
+#   raw - the sheet exactly as pd.read_excel returns it (used by MEG)
+#   pd  - with the dtype fixes of the PD script: session as str, Cluster.x and Subgroup.x as Int64
+# Views are stored as Parquet when it round-trips the frame exactly, otherwise as pickle.
+# A cached view is rebuilt when the workbook's size and modification time change and its
+# content hash no longer matches.
+#
+# load_reports() reads the per-run PD report files the same way: the needed columns of every
+# file, read in parallel and tagged with run_number, are cached as one table. Files whose size
+# and modification time are unchanged are taken from the cache; only new or changed ones are read.
+
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+DATA_CACHE_DIR = os.getenv("PREDICTION_DATA_CACHE_DIR", ".data_cache")
+REPORT_PATTERN = 'final_full_analytical_report_task2_minimal_run*.csv'
+# Columns of the PD reports the analyses read; model is missing from reports saved before it existed
+REPORT_COLUMNS = ['session_id', 'opponent_player_id', 'predicted_individual_vote', 'individual_prediction_correct', 'actual_team_outcome', 'predicted_team_outcome', 'team_prediction_correct', 'model']
+REPORT_LOAD_WORKERS = int(os.getenv("REPORT_LOAD_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+def _raw_view(df):
+    return df
+
+def _pd_view(df):
+    df = df.copy()
+    df['session'] = df['session'].astype(str)
+    df['Cluster.x'] = pd.to_numeric(df['Cluster.x'], errors='coerce').astype('Int64')
+    df['Subgroup.x'] = pd.to_numeric(df['Subgroup.x'], errors='coerce').astype('Int64')
+    return df
+
+VIEWS = {
+    'raw': _raw_view,
+    'pd': _pd_view,
+}
+
+def file_hash(path):
+    """Hex SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_paths(source_file, view):
+    stem = os.path.join(DATA_CACHE_DIR, f"{os.path.basename(source_file)}.{view}")
+    return stem + '.json', stem
+
+def _read_meta(meta_file):
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(meta_file, meta):
+    tmp_file = meta_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, meta_file)
+
+def _is_fresh(meta, meta_file, source_file):
+    """True if the cached view was built from the current content of source_file."""
+    stat = os.stat(source_file)
+    if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return True
+    # Touched or copied without changes: keep the cache and remember the new mtime
+    if meta['size'] == stat.st_size and meta['sha256'] == file_hash(source_file):
+        _write_meta(meta_file, {**meta, 'mtime_ns': stat.st_mtime_ns})
+        return True
+    return False
+
+def _read_cached(data_stem, meta):
+    if meta['format'] == 'parquet':
+        return pd.read_parquet(data_stem + '.parquet')
+    return pd.read_pickle(data_stem + '.pkl')
+
+def _write_cached(data_stem, df):
+    """Writes Parquet if it reads back identical (values and dtypes), otherwise pickle."""
+    try:
+        df.to_parquet(data_stem + '.parquet', index=False)
+        round_trip = pd.read_parquet(data_stem + '.parquet')
+        if round_trip.equals(df.reset_index(drop=True)) and round_trip.dtypes.equals(df.dtypes):
+            return 'parquet'
+        os.remove(data_stem + '.parquet')
+    except (ImportError, ValueError, TypeError, OSError) as e:
+        # No Parquet engine installed, or a column it cannot store
+        print(f"Parquet cache not usable ({type(e).__name__}), falling back to pickle.")
+    df.to_pickle(data_stem + '.pkl')
+    return 'pickle'
+
+def load_workbook(source_file, view='raw'):
+    """Returns the given view of source_file, from the columnar cache when it is up to date."""
+    if view not in VIEWS:
+        raise ValueError(f"Unknown view '{view}', expected one of: {', '.join(VIEWS)}")
+    meta_file, data_stem = _cache_paths(source_file, view)
+    meta = _read_meta(meta_file)
+    if meta is not None and _is_fresh(meta, meta_file, source_file):
+        try:
+            return _read_cached(data_stem, meta)
+        except (OSError, ValueError, ImportError) as e:
+            print(f"Could not read cached '{source_file}' ({e}), rebuilding it.")
+
+    # Raises FileNotFoundError like pd.read_excel when the workbook is missing
+    stat = os.stat(source_file)
+    print(f"Building columnar cache of '{source_file}' ({view} view)...")
+    df = VIEWS[view](pd.read_excel(source_file))
+    os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+    data_format = _write_cached(data_stem, df)
+    _write_meta(meta_file, {
+        'source': source_file,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': file_hash(source_file),
+        'format': data_format
+    })
+    return df
+
+# --- PD report files ---
+
+def report_run_number(report_file):
+    match = re.search(r'_run(\d+)\.csv$', report_file)
+    return int(match.group(1)) if match else None
+
+def read_report(report_file):
+    with open(report_file, 'r', encoding='utf-8', newline='') as f:
+        header = next(csv.reader(f), [])
+    columns = [column for column in header if column in REPORT_COLUMNS]
+    try:
+        # The pyarrow parser is about twice as fast and releases the GIL while parsing
+        df = pd.read_csv(report_file, usecols=columns, engine='pyarrow')
+    except ImportError:
+        df = pd.read_csv(report_file, usecols=columns)
+    df.insert(0, 'run_number', report_run_number(report_file))
+    return df
+
+def file_state(path):
+    """[mtime_ns, size] of a file, the state the caches compare to tell whether it changed."""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def report_files(pattern=REPORT_PATTERN):
+    """{run_number: file} of the report files matching pattern, in run order."""
+    files = {}
+    for report_file in sorted(glob.glob(pattern)):
+        run_number = report_run_number(report_file)
+        if run_number is None:
+            print(f"Skipping '{report_file}': no run number in its name")
+            continue
+        files.setdefault(run_number, report_file)
+    return dict(sorted(files.items()))
+
+def load_reports(pattern=REPORT_PATTERN, max_workers=REPORT_LOAD_WORKERS):
+    """
+    Returns (reports, files): the REPORT_COLUMNS of every report file matching pattern as one
+    table with a run_number column, ordered by run, and {run_number: file}. Returns (None, {})
+    if there are no report files.
+    """
+    files = report_files(pattern)
+    if not files:
+        return None, {}
+
+    meta_file, data_stem = _cache_paths(pattern.replace('*', '_all'), 'reports')
+    meta = _read_meta(meta_file)
+    states = {str(run_number): [report_file] + file_state(report_file) for run_number, report_file in files.items()}
+    cached = None
+    if meta is not None and meta.get('columns') == REPORT_COLUMNS:
+        try:
+            cached = _read_cached(data_stem, meta)
+        except (OSError, ValueError, ImportError) as e:
+            print(f"Could not read cached reports ({e}), reading all report files.")
+    fresh = {int(run) for run, state in states.items() if cached is not None and meta['files'].get(run) == state}
+    if fresh == set(files) and len(meta['files']) == len(files):
+        return cached, files
+
+    stale = [report_file for run_number, report_file in sorted(files.items()) if run_number not in fresh]
+    print(f"Reading {len(stale)} of {len(files)} report files...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(read_report, stale))
+    if fresh:
+        frames.append(cached[cached['run_number'].isin(fresh)])
+    reports = pd.concat(frames, ignore_index=True)
+    reports = reports.sort_values('run_number', kind='stable', ignore_index=True)
+
+    os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+    data_format = _write_cached(data_stem, reports)
+    _write_meta(meta_file, {'pattern': pattern, 'columns': REPORT_COLUMNS, 'files': states, 'format': data_format})
+    return reports, files
@@ -0,0 +1,41 @@
+# Registry of the prediction scripts and their API loaders, by game name
+
+import prediction_minimum_effort
+import prediction_prisoners_dilemma
+import prediction_trust_game
+from structured_prompt_loader import get_structured_prediction_from_system_user
+from structured_prompt_loader_task1 import get_structured_prediction_from_system_user_task1
+from structured_prompt_loader_task3 import get_structured_game_prediction_system_user
+
+GAMES = {
+    'meg': (prediction_minimum_effort, get_structured_prediction_from_system_user_task1),
+    'pd': (prediction_prisoners_dilemma, get_structured_prediction_from_system_user),
+    'tg': (prediction_trust_game, get_structured_game_prediction_system_user),
+}
+
+def parse_run_range(text):
+    """Parses run selections such as '1-150' or '1-50,101,120-125' into a sorted list."""
+    run_numbers = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            run_numbers.update(range(int(first), int(last) + 1))
+        else:
+            run_numbers.add(int(part))
+    return sorted(run_numbers)
+
+def save_runs(module, sessions, responses_by_run):
+    """Saves each run's outputs, then writes the consolidated file once for all runs."""
+    consolidates = hasattr(module, 'write_consolidated_runs')
+    run_dfs = []
+    for run_number, ai_responses in responses_by_run.items():
+        print(f"--- Saving run {run_number} ---")
+        if consolidates:
+            run_dfs.append(module.save_run_results(sessions, ai_responses, run_number, consolidate=False))
+        else:
+            module.save_run_results(sessions, ai_responses, run_number)
+    if consolidates:
+        module.write_consolidated_runs(run_dfs)
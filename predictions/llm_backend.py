@@ -0,0 +1,381 @@
+# Interchangeable LLM backends shared by every game
+#
+# All loaders call get_backend().complete(...). The backend is chosen with LLM_BACKEND:
+#   openai - synchronous OpenAI client (default)
+#   async  - AsyncOpenAI client on one background event loop
+#   stream - streamed completions, reporting the decisive fields as soon as they are parsed
+#   mock   - deterministic offline responses, for benchmarking the pipeline without network
+# Unless PREDICTION_CACHE_MODE=off, the openai and async backends are wrapped in CachedBackend.
+# Requests carry the game's strict JSON schema (from the loader's label) as their response format.
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from rate_limiter import estimate_tokens, reserve_capacity, acquire_capacity, record_usage, is_retryable, retry_delay
+from response_parser import SCHEMAS, validate
+from response_cache import make_cache_key, get_cached_response, store_response, replay_only, cache_enabled
+from stream_parser import IncrementalJSONParser, is_decisive, format_path
+from telemetry import record_call
+
+from agent_pool.agent import (
+    get_agent_client, get_async_agent_client, MODEL_NAME, TEMPERATURE, MAX_RETRIES,
+    LLM_BACKEND, MOCK_LATENCY_SECONDS, RESPONSE_FORMAT_MODE
+)
+
+RESPONSE_FORMAT = {"type": "json_object"}
+
+def response_format(label):
+    """The structured-output format for a loader label ('MEG', 'PD', 'TG'), or plain JSON mode."""
+    game = (label or '').lower()
+    if RESPONSE_FORMAT_MODE != 'json_schema' or game not in SCHEMAS:
+        return RESPONSE_FORMAT
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": f"{game}_prediction", "strict": True, "schema": SCHEMAS[game]}
+    }
+
+def is_error_response(response):
+    """True for the error payloads returned after giving up on a call."""
+    return not isinstance(response, str) or response.lstrip().startswith('{"error"')
+
+def is_usable_response(label, response):
+    """True for a response that is not an error payload and satisfies the game's schema, if it has one."""
+    if is_error_response(response):
+        return False
+    game = (label or '').lower()
+    return game not in SCHEMAS or validate(game, response) is None
+
+def _messages(system_message, user_message):
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message}
+    ]
+
+def _usage_dict(usage):
+    return usage.model_dump() if usage is not None else None
+
+class _CallTimer:
+    """Measures one backend call from its start and reports it to telemetry."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+
+    def record(self, label, sample_index, session_id, model, backend, attempts, usage=None, error=None, **extra):
+        latency_ms = (time.perf_counter() - self.start) * 1000
+        record_call(label, sample_index, session_id, model, backend, self.started_at, latency_ms,
+                    attempts, usage, error, **extra)
+
+class LLMBackend(ABC):
+    """
+    Base interface. complete_with_usage returns (content, usage); on failure the content is an
+    error payload '{"error": ...}' rather than an exception, as the prediction scripts expect.
+    """
+    model = MODEL_NAME
+    temperature = TEMPERATURE
+
+    @abstractmethod
+    def complete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        """Returns (content, usage) for one completion."""
+
+    async def acomplete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        return await asyncio.to_thread(self.complete_with_usage, system_message, user_message, sample_index, label, session_id)
+
+    def complete(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        return self.complete_with_usage(system_message, user_message, sample_index, label, session_id)[0]
+
+    async def acomplete(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        return (await self.acomplete_with_usage(system_message, user_message, sample_index, label, session_id))[0]
+
+class OpenAIBackend(LLMBackend):
+    """Blocking chat completions on the shared pooled client, scheduled by the rate limiter."""
+    name = 'openai'
+
+    def _request(self, client, system_message, user_message, label, session_id):
+        """Sends one completion request. Returns (content, usage, timings for telemetry)."""
+        completion = client.chat.completions.create(
+            model=self.model,
+            temperature=self.temperature,
+            response_format=response_format(label),
+            messages=_messages(system_message, user_message)
+        )
+        return completion.choices[0].message.content, completion.usage, {}
+
+    def complete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        print(f"Calling model for {label or 'LLM'} prediction...")
+        client = get_agent_client()
+        estimated_tokens = estimate_tokens(system_message, user_message)
+        call = _CallTimer()
+
+        for attempt in range(MAX_RETRIES):
+            # Wait for request and token budget under the rate limits
+            acquire_capacity(self.model, estimated_tokens)
+            try:
+                content, completion_usage, timings = self._request(client, system_message, user_message, label, session_id)
+                record_usage(self.model, estimated_tokens, completion_usage)
+                usage = _usage_dict(completion_usage)
+                call.record(label, sample_index, session_id, self.model, self.name, attempt + 1, usage, **timings)
+                return content, usage
+            except Exception as e:
+                # If the API call fails, print the error and prepare to retry
+                print(f"API call failed on attempt {attempt + 1}/{MAX_RETRIES}: {e}")
+                if attempt == MAX_RETRIES - 1 or not is_retryable(e):
+                    print(f"Giving up after {attempt + 1} attempts.")
+                    call.record(label, sample_index, session_id, self.model, self.name, attempt + 1, error=repr(e))
+                    return f'{{"error": "API call failed after {attempt + 1} attempts: {str(e)}"}}', None
+                wait_time = retry_delay(self.model, e, attempt)
+                print(f"Waiting {wait_time:.1f} seconds before retrying...")
+                time.sleep(wait_time)
+
+        return '{"error": "Exited retry loop unexpectedly."}', None
+
+class StreamingOpenAIBackend(OpenAIBackend):
+    """
+    Streams each completion and parses it incrementally, so the decisive fields (final
+    prediction, per-player votes, outcomes) are reported as soon as they are complete, before
+    the reasoning text has finished. Records time to first token, time to the first decisive
+    field (decision_ms) and time to the last one (last_decision_ms).
+    on_decision(label, session_id, path, value) is called for each decisive field.
+    """
+    name = 'stream'
+
+    def __init__(self, on_decision=None):
+        self.on_decision = on_decision or _print_decision
+
+    def _request(self, client, system_message, user_message, label, session_id):
+        start = time.perf_counter()
+        timings = {'first_token_ms': None, 'decision_ms': None, 'last_decision_ms': None}
+
+        def on_value(path, value):
+            if is_decisive(path):
+                elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+                if timings['decision_ms'] is None:
+                    timings['decision_ms'] = elapsed_ms
+                timings['last_decision_ms'] = elapsed_ms
+                self.on_decision(label, session_id, path, value)
+
+        parser = IncrementalJSONParser(on_value)
+        chunks = []
+        usage = None
+        stream = client.chat.completions.create(
+            model=self.model,
+            temperature=self.temperature,
+            response_format=response_format(label),
+            messages=_messages(system_message, user_message),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            text = chunk.choices[0].delta.content
+            if timings['first_token_ms'] is None:
+                timings['first_token_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            chunks.append(text)
+            parser.feed(text)
+        return ''.join(chunks), usage, timings
+
+def _print_decision(label, session_id, path, value):
+    print(f"[{label or 'LLM'} {session_id}] {format_path(path)} = {value}")
+
+class AsyncOpenAIBackend(LLMBackend):
+    """
+    Non-blocking chat completions on one AsyncOpenAI client. Synchronous callers (such as the
+    thread pool in async_executor) are served from a background event loop owned by the backend.
+    """
+    name = 'async'
+
+    def __init__(self):
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def _background_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return self._loop
+
+    def complete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete_with_usage(system_message, user_message, sample_index, label, session_id),
+            self._background_loop()
+        )
+        return future.result()
+
+    async def acomplete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        print(f"Calling model for {label or 'LLM'} prediction...")
+        client = get_async_agent_client()
+        estimated_tokens = estimate_tokens(system_message, user_message)
+        call = _CallTimer()
+
+        for attempt in range(MAX_RETRIES):
+            await asyncio.sleep(reserve_capacity(self.model, estimated_tokens))
+            try:
+                completion = await client.chat.completions.create(
+                    model=self.model,
+                    temperature=self.temperature,
+                    response_format=response_format(label),
+                    messages=_messages(system_message, user_message)
+                )
+                record_usage(self.model, estimated_tokens, completion.usage)
+                usage = _usage_dict(completion.usage)
+                call.record(label, sample_index, session_id, self.model, self.name, attempt + 1, usage)
+                return completion.choices[0].message.content, usage
+            except Exception as e:
+                print(f"API call failed on attempt {attempt + 1}/{MAX_RETRIES}: {e}")
+                if attempt == MAX_RETRIES - 1 or not is_retryable(e):
+                    print(f"Giving up after {attempt + 1} attempts.")
+                    call.record(label, sample_index, session_id, self.model, self.name, attempt + 1, error=repr(e))
+                    return f'{{"error": "API call failed after {attempt + 1} attempts: {str(e)}"}}', None
+                wait_time = retry_delay(self.model, e, attempt)
+                print(f"Waiting {wait_time:.1f} seconds before retrying...")
+                await asyncio.sleep(wait_time)
+
+        return '{"error": "Exited retry loop unexpectedly."}', None
+
+class CachedBackend(LLMBackend):
+    """Serves repeated requests from the response cache and stores new responses that pass schema validation."""
+    name = 'cache'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.model = backend.model
+        self.temperature = backend.temperature
+
+    def _lookup(self, system_message, user_message, sample_index, label):
+        cache_key = make_cache_key(self.model, self.temperature, system_message, user_message, sample_index, response_format(label))
+        cached = get_cached_response(cache_key)
+        # Responses cached before schema validation may fail it; request those again
+        if cached is not None and not is_usable_response(label, cached['content']):
+            cached = None
+        return cache_key, cached
+
+    def _store(self, cache_key, content, usage, label):
+        if is_usable_response(label, content):
+            store_response(cache_key, self.model, content, usage)
+
+    def _record_hit(self, call, cached, label, sample_index, session_id):
+        call.record(label, sample_index, session_id, self.model, self.name, 0, cached['usage'], cache_hit=True)
+        return cached['content'], cached['usage']
+
+    def complete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        call = _CallTimer()
+        cache_key, cached = self._lookup(system_message, user_message, sample_index, label)
+        if cached is not None:
+            return self._record_hit(call, cached, label, sample_index, session_id)
+        if replay_only():
+            print("Replay-only mode: no cached response for this request, skipping API call.")
+            return '{"error": "No cached response available in replay-only mode."}', None
+        content, usage = self.backend.complete_with_usage(system_message, user_message, sample_index, label, session_id)
+        self._store(cache_key, content, usage, label)
+        return content, usage
+
+    async def acomplete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        call = _CallTimer()
+        cache_key, cached = self._lookup(system_message, user_message, sample_index, label)
+        if cached is not None:
+            return self._record_hit(call, cached, label, sample_index, session_id)
+        if replay_only():
+            print("Replay-only mode: no cached response for this request, skipping API call.")
+            return '{"error": "No cached response available in replay-only mode."}', None
+        content, usage = await self.backend.acomplete_with_usage(system_message, user_message, sample_index, label, session_id)
+        self._store(cache_key, content, usage, label)
+        return content, usage
+
+class MockBackend(LLMBackend):
+    """
+    Deterministic offline responses, derived from a hash of the request. The JSON carries the
+    fields of every game's schema, with predictions for each player mentioned in the user message.
+    MOCK_LATENCY_SECONDS adds a simulated network delay.
+    """
+    model = 'mock'
+    name = 'mock'
+
+    def __init__(self, latency=MOCK_LATENCY_SECONDS):
+        self.latency = latency
+
+    def _respond(self, system_message, user_message, sample_index):
+        seed = int(hashlib.sha256(f"{sample_index}|{user_message}".encode('utf-8')).hexdigest(), 16)
+        player_ids = list(dict.fromkeys(re.findall(r'Player (\d+)', user_message)))
+        votes = [('M', 'J')[(seed >> i) & 1] for i in range(len(player_ids))]
+        choices = [1 + (seed >> (2 * i)) % 7 for i in range(len(player_ids))]
+        cooperate = votes.count('M') >= 2
+        content = json.dumps({
+            "final_prediction": ('Cooperate', 'Defect')[seed & 1],
+            "prediction_summary": "Mock prediction.",
+            "player_predictions": [
+                {"player_id": p_id, "predicted_choice": choice, "prediction_context": "Mock prediction from chat."}
+                for p_id, choice in zip(player_ids, choices)
+            ],
+            "conclusion": {
+                "outcome": 'Coordinate' if choices and all(choice == 7 for choice in choices) else 'Fail to Coordinate',
+                "explanation": "Mock prediction."
+            },
+            "team2_player_predictions": [
+                {"player_id": p_id, "predicted_vote": vote, "prediction_reasoning": "Mock prediction."}
+                for p_id, vote in zip(player_ids, votes)
+            ],
+            "team2_final_prediction": {
+                "outcome": 'Cooperate' if cooperate else 'Defect',
+                "explanation": "Mock prediction."
+            }
+        })
+        prompt_tokens = (len(system_message) + len(user_message)) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                 "total_tokens": prompt_tokens + len(content) // 4}
+        return content, usage
+
+    def complete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        call = _CallTimer()
+        if self.latency:
+            time.sleep(self.latency)
+        content, usage = self._respond(system_message, user_message, sample_index)
+        call.record(label, sample_index, session_id, self.model, self.name, 1, usage)
+        return content, usage
+
+    async def acomplete_with_usage(self, system_message, user_message, sample_index=None, label=None, session_id=None):
+        call = _CallTimer()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content, usage = self._respond(system_message, user_message, sample_index)
+        call.record(label, sample_index, session_id, self.model, self.name, 1, usage)
+        return content, usage
+
+BACKENDS = {
+    'openai': OpenAIBackend,
+    'async': AsyncOpenAIBackend,
+    'stream': StreamingOpenAIBackend,
+    'mock': MockBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def create_backend(name=LLM_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{name}', expected one of: {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]()
+    if name != 'mock' and cache_enabled():
+        backend = CachedBackend(backend)
+    return backend
+
+def backend_model():
+    """The model the backend selected by LLM_BACKEND calls, without creating the backend."""
+    return BACKENDS.get(LLM_BACKEND, LLMBackend).model
+
+def get_backend():
+    """Returns the process-wide backend selected by LLM_BACKEND, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
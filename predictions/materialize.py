@@ -0,0 +1,102 @@
+# Materialized prompt artifact, decoupled from API execution
+#
+# Usage: python materialize.py <meg|pd|tg> [--output prompts_meg.jsonl]
+#
+# Loads a game's data once, renders every session's user message and writes one JSON record
+# per session: game, session_id, system prompt hash, user message and ground truth (plus the
+# game's own session fields). run_sweep.py and batch_runner.py accept --prompts to read the
+# artifact instead of loading and rendering the data again, so it is built once per dataset.
+
+import argparse
+import json
+import os
+
+from games import GAMES
+from response_cache import system_prompt_hash
+
+PROMPTS_FILE = 'prompts_{game}.jsonl'
+
+def load_system_prompt(module):
+    """Reads a game's system prompt without loading its data. Returns None if it is missing."""
+    try:
+        with open(module.SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError as e:
+        print(f"ERROR: Make sure '{e.filename}' exists.")
+        return None
+
+def _to_builtin(value):
+    # numpy scalars from the data frames
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def write_prompts(prompts_file, game, system_message, sessions):
+    """Writes one record per session, replacing prompts_file atomically."""
+    prompt_hash = system_prompt_hash(system_message)
+    tmp_file = prompts_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for session in sessions:
+            record = {
+                'game': game,
+                'session_id': session['session_id'],
+                'system_prompt_hash': prompt_hash,
+                'user_message': session['user_message'],
+                'ground_truth': session['ground_truth'],
+                **session
+            }
+            f.write(json.dumps(record, default=_to_builtin) + '\n')
+    os.replace(tmp_file, prompts_file)
+    print(f"Wrote {len(sessions)} {game} prompts to '{prompts_file}'")
+
+def load_prompts(prompts_file, game, system_message):
+    """
+    Reads the sessions of a prompt artifact. Returns None if the artifact belongs to another game
+    or was rendered for a different system prompt.
+    """
+    prompt_hash = system_prompt_hash(system_message)
+    sessions = []
+    with open(prompts_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.pop('game') != game:
+                print(f"ERROR: '{prompts_file}' does not hold {game} prompts.")
+                return None
+            if record.pop('system_prompt_hash') != prompt_hash:
+                print(f"ERROR: '{prompts_file}' was built for a different system prompt. Rebuild it with materialize.py.")
+                return None
+            sessions.append(record)
+    print(f"Loaded {len(sessions)} {game} prompts from '{prompts_file}'")
+    return sessions
+
+def load_sessions(game, prompts_file=None):
+    """
+    Returns (system_message, sessions) for a game, read from a prompt artifact if one is given,
+    otherwise loaded and rendered from the game's data. Returns None on a missing or stale input.
+    """
+    module, _ = GAMES[game]
+    if prompts_file:
+        system_message = load_system_prompt(module)
+        if system_message is None:
+            return None
+        sessions = load_prompts(prompts_file, game, system_message)
+        return None if sessions is None else (system_message, sessions)
+    inputs = module.load_inputs()
+    if inputs is None:
+        return None
+    system_message, user_template, df = inputs
+    return system_message, module.build_sessions(df, user_template)
+
+def materialize(game, prompts_file=None):
+    loaded = load_sessions(game)
+    if loaded is None:
+        return
+    system_message, sessions = loaded
+    write_prompts(prompts_file or PROMPTS_FILE.format(game=game), game, system_message, sessions)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render every session's prompt once and write it to a JSONL artifact.")
+    parser.add_argument('game', choices=sorted(GAMES))
+    parser.add_argument('--output', default=None, help="Artifact file (default: prompts_<game>.jsonl)")
+    args = parser.parse_args()
+    materialize(args.game, args.output)
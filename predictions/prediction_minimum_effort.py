@@ -1,24 +1,33 @@
 # Prediction of Minimum Effort Games
 
+import numpy as np
 import pandas as pd
-import os
 import sys
-import json
-import re
-
+from functools import partial
+
+from agent_pool.agent import MAX_CONCURRENCY
+from async_executor import run_calls_concurrently
+from data_cache import load_workbook
+from llm_backend import backend_model
+from prompt_builder import row_scalars, row_values, group_arrays, join_lines
+from response_parser import parse_meg
+from results_store import finish_comparison, publish_runs, save_run
+from run_journal import journaled_calls
+from truth_store import truth_table
 from structured_prompt_loader_task1 import get_structured_prediction_from_system_user_task1
 
 # --- Configuration ---
-RUN_NUMBER = int(sys.argv[1]) if len(sys.argv) > 1 else 1
-
 EXCEL_FILE = 'merged_table_cason_2019.xlsx'
 SYSTEM_PROMPT_FILE = 'instructions/minimum_effort_game_structured_system_minimal.txt'
 USER_PROMPT_TEMPLATE_FILE = 'instructions/user_message_template_minimum_effort_minimal.txt'
 
 # --- Output ---
-GROUND_TRUTH_FILE = f'ground_truth_answers_task1{RUN_NUMBER}.csv'
-PREDICTIONS_FILE = f'predictions_minimum_effort{RUN_NUMBER}.csv'
+PREDICTIONS_FILE = 'predictions_minimum_effort{run_number}.csv'
+RESULTS_DATASET = 'minimum_effort'
 CONSOLIDATED_OUTPUT_FILE = 'minimum_effort_consolidated.csv'
+COMPARISON_COLUMNS = ['run_number', 'session_id', 'player_id', 'predicted_choice', 'actual_choice', 'prediction_correctness', 'group_outcome_prediction', 'model']
+JOURNAL_FILE = 'journal_minimum_effort.jsonl'
+TRUTH_DATASET = 'minimum_effort'
 
 # --- Column Names from Excel ---
 SESSION_COLS = ['session', 'Cluster.x', 'Subgroup.x', 'task']
@@ -28,9 +37,10 @@ PROPOSAL_COL = 'T1_XProposal'
 ANSWER_COL = 'T1_XChoice'
 # ---------------------------------------------------------
 
-def process_and_predict():
+def load_inputs():
     """
-    Reads data, sends it to the API using separate system/user prompts, and saves the results.
+    Reads the system prompt, the user message template and the task 1 rows of the Excel data.
+    Returns None if a required file is missing.
     """
     print("--- 1. Loading data and prompt files ---")
     try:
@@ -38,144 +48,197 @@ def process_and_predict():
             system_message = f.read()
         with open(USER_PROMPT_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
             user_template = f.read()
-        df = pd.read_excel(EXCEL_FILE)
+        df = load_workbook(EXCEL_FILE)
         df = df[df['task'] == 1]
         print(f"Files loaded. Filtered data to task 1, found {len(df)} rows.")
     except FileNotFoundError as e:
         print(f"ERROR: A required file was not found: {e}")
-        return
+        return None
+    return system_message, user_template, df
 
-    # Group by unique game sessions
+def build_prompt_table(df, user_template):
+    """
+    Renders the user message of every unique game in one pass, along with its ground truth
+    (one {'player', 'true_choice'} record per distinct player/choice pair).
+    Returns a DataFrame of session_id, user_message and ground_truth, in groupby order.
+    """
+    df = df.sort_index()
     grouped_games = df.groupby(SESSION_COLS)
-    print(f"Found and processing {len(grouped_games)} unique games.")
-
-    ground_truth_data = []
+    group_ids = grouped_games.ngroup().rename('group_id')
+    # Session ids are str() of the groupby key tuple, as produced when iterating the groups
+    keys = grouped_games.size().index
+    session_ids = [
+        str(tuple(level[codes[i]] for level, codes in zip(keys.levels, keys.codes)))
+        for i in range(len(keys))
+    ]
+    df, group_ids = df[group_ids >= 0], group_ids[group_ids >= 0]
+
+    # Format proposals (first occurrence of each sender/proposal pair) and chat logs
+    pairs = df[[SENDER_COL, PROPOSAL_COL]]
+    first_pairs = ~pd.concat([group_ids, pairs], axis=1).duplicated()
+    proposal_lines = "Player " + row_values(pairs, SENDER_COL) + " proposes: " + row_values(pairs, PROPOSAL_COL) + "\n"
+    proposals = "Proposals:\n" + join_lines(proposal_lines[first_pairs], group_ids[first_pairs]).sort_index()
+    chat_lines = "Player " + row_values(df, SENDER_COL) + ": " + row_values(df, MESSAGE_COL) + "\n"
+    chat_logs = "\nChat Log:\n" + join_lines(chat_lines, group_ids).sort_index()
+
+    # Create user messages from the template
+    user_messages = [
+        user_template.format(PROPOSALS_DATA=proposals_for_prompt, CHAT_LOGS=chat_log_for_prompt)
+        for proposals_for_prompt, chat_log_for_prompt in zip(proposals, chat_logs)
+    ]
+
+    # Extract truth
+    answers = df[[SENDER_COL, ANSWER_COL]]
+    first_answers = ~pd.concat([group_ids, answers], axis=1).duplicated()
+    truth_records = pd.Series([
+        {'player': player, 'true_choice': true_choice}
+        for player, true_choice in zip(row_scalars(answers, SENDER_COL).tolist(), row_scalars(answers, ANSWER_COL).tolist())
+    ], index=answers.index, dtype=object)
+    ground_truth = group_arrays(truth_records[first_answers], group_ids[first_answers]).sort_index().map(list)
+    return pd.DataFrame({'session_id': session_ids, 'user_message': user_messages, 'ground_truth': ground_truth.to_numpy()})
+
+def build_sessions(df, user_template):
+    """Builds the user message and ground truth for each unique game, in groupby order."""
+    prompt_table = build_prompt_table(df, user_template)
+    print(f"Found and processing {len(prompt_table)} unique games.")
+    return prompt_table.to_dict('records')
+
+def build_truth_table(sessions):
+    """One row per session and player: session_id, player and true_choice."""
+    return pd.DataFrame(
+        [{'session_id': session['session_id'], 'player': truth['player'], 'true_choice': truth['true_choice']}
+         for session in sessions for truth in session['ground_truth']],
+        columns=['session_id', 'player', 'true_choice']
+    )
+
+def collect_run_rows(sessions, ai_predictions):
+    """Returns the prediction rows for responses in session order."""
     predictions_data = []
 
-    # Loop through each unique game
-    for name, group in grouped_games:
-        session_id = str(name)
-        print(f"--- Processing Game: {session_id} ---")
-        group = group.sort_index()
-
-        # Format proposals and chat logs
-        proposals_for_prompt = "Proposals:\n"
-        for _, row in group[[SENDER_COL, PROPOSAL_COL]].drop_duplicates().iterrows():
-            proposals_for_prompt += f"Player {row[SENDER_COL]} proposes: {row[PROPOSAL_COL]}\n"
-
-        chat_log_for_prompt = "\nChat Log:\n"
-        for _, row in group.iterrows():
-            chat_log_for_prompt += f"Player {row[SENDER_COL]}: {row[MESSAGE_COL]}\n"
-        
-        try:
-            # Create user message from the template
-            user_message = user_template.format(
-                PROPOSALS_DATA=proposals_for_prompt,
-                CHAT_LOGS=chat_log_for_prompt
-            )
-            
-            # Call API
-            ai_prediction = get_structured_prediction_from_system_user_task1(
-                system_message,
-                user_message
-            )
+    for session, ai_prediction in zip(sessions, ai_predictions):
+        session_id = session['session_id']
+        if isinstance(ai_prediction, Exception):
+            print(f"Error getting prediction for {session_id}: {ai_prediction}")
+            ai_prediction = f'{{"error": "API call failed: {ai_prediction}"}}'
+        else:
             print(f"AI Prediction Received for {session_id}")
-        except Exception as e:
-            print(f"Error getting prediction for {session_id}: {e}")
-            ai_prediction = f'{{"error": "API call failed: {e}"}}'
-        
+
         # Store raw prediction text
         predictions_data.append({
             'session_id': session_id,
             'prediction_text': ai_prediction
         })
+    return predictions_data
 
-        # Extract truth
-        for _, row in group[[SENDER_COL, ANSWER_COL]].drop_duplicates().iterrows():
-            ground_truth_data.append({
-                'session_id': session_id,
-                'player': row[SENDER_COL],
-                'true_choice': row[ANSWER_COL]
-            })
-
-    # Save the results
+def save_run_results(sessions, ai_predictions, run_number, consolidate=True):
+    """
+    Saves the predictions of one run (one response text or exception per session, in session
+    order) and compares them with the stored ground truth; see results_store.save_run().
+    """
+    predictions_data = collect_run_rows(sessions, ai_predictions)
     if not predictions_data:
         print(f"\nWarning: No game sessions were found or processed from the Excel file.")
-    else:
-        truth_df = pd.DataFrame(ground_truth_data)
-        truth_df.to_csv(GROUND_TRUTH_FILE, index=False)
-        print(f"\nSuccessfully saved ground truth answers for all sessions to '{GROUND_TRUTH_FILE}'")
-
-        predictions_df = pd.DataFrame(predictions_data)
-        predictions_df.to_csv(PREDICTIONS_FILE, index=False)
-        print(f"Successfully saved all AI predictions to '{PREDICTIONS_FILE}'")
-        
-        create_consolidated_comparison(predictions_df, truth_df, RUN_NUMBER)
+        return None
+    return save_run(
+        RESULTS_DATASET, run_number, predictions_data, PREDICTIONS_FILE.format(run_number=run_number),
+        lambda predictions_df: build_run_comparison(predictions_df, truth_table(TRUTH_DATASET, sessions, build_truth_table, EXCEL_FILE), run_number),
+        consolidate, 'player predictions'
+    )
+
+def process_and_predict(run_number=1, resume=False):
+    """
+    Reads data, sends it to the API using separate system/user prompts, and saves the results.
+    """
+    inputs = load_inputs()
+    if inputs is None:
+        return
+    system_message, user_template, df = inputs
+    sessions = build_sessions(df, user_template)
+
+    # Call API concurrently, results come back in session order
+    print(f"Requesting predictions for {len(sessions)} games (up to {MAX_CONCURRENCY} concurrent calls)...")
+    ai_predictions = run_calls_concurrently(journaled_calls(
+        JOURNAL_FILE,
+        system_message,
+        ((run_number, session['session_id'], partial(get_structured_prediction_from_system_user_task1, system_message, session['user_message'], run_number, session['session_id']))
+         for session in sessions),
+        resume
+    ))
+    save_run_results(sessions, ai_predictions, run_number)
+
+def parse_predictions(predictions_df):
+    """
+    Parses every response once. Returns (responses, player_predictions): one row per response
+    with its predicted group outcome, and one row per predicted player keyed by the response's
+    position and the digits of the model's player_id (first prediction of a player wins).
+    """
+    parsed = [parse_meg(prediction_text) for prediction_text in predictions_df['prediction_text']]
+    for session_id, prediction in zip(predictions_df['session_id'], parsed):
+        if prediction.error:
+            print(f"Warning: Could not parse JSON for session {session_id}: {prediction.error}")
+    responses = pd.DataFrame({
+        'response': range(len(parsed)),
+        'session_id': predictions_df['session_id'].to_numpy(),
+        'group_outcome_prediction': pd.Series([prediction.group_outcome for prediction in parsed], dtype=object),
+        'player_predictions': pd.Series([prediction.player_predictions for prediction in parsed], dtype=object)
+    })
+
+    exploded = responses[['response', 'player_predictions']].explode('player_predictions').dropna(subset=['player_predictions'])
+    predictions = exploded['player_predictions']
+    player_predictions = pd.DataFrame({
+        'response': exploded['response'].to_numpy(),
+        'player_id': predictions.map(lambda pred: str(pred.player_id)).str.extract(r'(\d+)', expand=False).to_numpy(),
+        'predicted_choice': pd.Series([pred.predicted_choice for pred in predictions], dtype=object)
+    })
+    player_predictions = player_predictions.dropna(subset=['player_id']).drop_duplicates(['response', 'player_id'])
+    return responses.drop(columns='player_predictions'), player_predictions
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
 
-def create_consolidated_comparison(predictions_df, truth_df, run_number):
+def build_run_comparison(predictions_df, truth_df, run_number):
+    """Compares one run's predictions with the ground truth and returns the comparison rows."""
     print(f"Creating consolidated comparison for run {run_number}...")
-    all_player_rows = []
-    for _, pred_row in predictions_df.iterrows():
-        session_id = pred_row['session_id']
-        prediction_text = pred_row['prediction_text']
-        try:
-            if prediction_text.strip().startswith('{'):
-                parsed_json = json.loads(prediction_text)
-            else:
-                json_match = re.search(r'\{.*\}', prediction_text, re.DOTALL)
-                if json_match:
-                    parsed_json = json.loads(json_match.group(0))
-                else:
-                    parsed_json = {}
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Warning: Could not parse JSON for session {session_id}: {e}")
-            parsed_json = {}
-        session_truth = truth_df[truth_df['session_id'] == session_id]
-        if session_truth.empty:
-            print(f"Warning: No ground truth found for session {session_id}")
-            continue
-        player_predictions = parsed_json.get('player_predictions', [])
-        group_outcome = parsed_json.get('conclusion', {}).get('outcome', 'N/A')
-        for _, truth_row in session_truth.iterrows():
-            player_id = str(truth_row['player'])
-            actual_choice = truth_row['true_choice']
-            predicted_choice = 'N/A'
-            for pred in player_predictions:
-                pred_player_id = str(pred.get('player_id', ''))
-                id_match = re.search(r'\d+', pred_player_id)
-                if id_match and id_match.group(0) == player_id:
-                    predicted_choice = pred.get('predicted_choice', 'N/A')
-                    break
-            prediction_correctness = "N/A"
-            if predicted_choice != 'N/A' and pd.notna(actual_choice):
-                try:
-                    prediction_correctness = "Correct" if int(predicted_choice) == int(actual_choice) else "Incorrect"
-                except (ValueError, TypeError):
-                    prediction_correctness = "Type Mismatch"
-            player_row = {
-                'run_number': run_number,
-                'session_id': session_id,
-                'player_id': player_id,
-                'predicted_choice': predicted_choice,
-                'actual_choice': actual_choice,
-                'prediction_correctness': prediction_correctness,
-                'group_outcome_prediction': group_outcome
-            }
-            all_player_rows.append(player_row)
-    if not all_player_rows:
+    responses, player_predictions = parse_predictions(predictions_df)
+    has_truth = responses['session_id'].isin(truth_df['session_id'])
+    for session_id in responses.loc[~has_truth, 'session_id']:
+        print(f"Warning: No ground truth found for session {session_id}")
+    if not has_truth.any():
         print(f"No data created for run {run_number}")
-        return
-    run_df = pd.DataFrame(all_player_rows)
-    if os.path.exists(CONSOLIDATED_OUTPUT_FILE):
-        existing_df = pd.read_csv(CONSOLIDATED_OUTPUT_FILE)
-        existing_df = existing_df[existing_df['run_number'] != run_number]
-        consolidated_df = pd.concat([existing_df, run_df], ignore_index=True)
-    else:
-        consolidated_df = run_df
-    consolidated_df.to_csv(CONSOLIDATED_OUTPUT_FILE, index=False)
-    print(f"Updated consolidated comparison file '{CONSOLIDATED_OUTPUT_FILE}' with run {run_number} data")
-    print(f"   - Added {len(run_df)} player predictions")
-    print(f"   - Total runs in consolidated file: {consolidated_df['run_number'].nunique()}")
+        return None
+
+    # One row per (response, true player), in response order and truth order within a response
+    truth = pd.DataFrame({
+        'truth_row': range(len(truth_df)),
+        'session_id': truth_df['session_id'].to_numpy(),
+        'player_id': row_values(truth_df, 'player').to_numpy(),
+        'actual_choice': row_scalars(truth_df, 'true_choice')
+    })
+    comparison = responses[has_truth].merge(truth, on='session_id', how='inner').sort_values(['response', 'truth_row'])
+    comparison = comparison.merge(player_predictions, on=['response', 'player_id'], how='left', indicator=True)
+
+    predicted = comparison['predicted_choice'].where(comparison['_merge'] == 'both', 'N/A')
+    actual = comparison['actual_choice']
+    predicted_int, actual_int = predicted.map(_as_int), actual.map(_as_int)
+    comparison['predicted_choice'] = predicted
+    comparison['prediction_correctness'] = np.select(
+        [predicted.eq('N/A') | actual.isna(), predicted_int.isna() | actual_int.isna(), predicted_int == actual_int],
+        ["N/A", "Type Mismatch", "Correct"],
+        "Incorrect"
+    )
+    return finish_comparison(comparison, run_number, backend_model(), COMPARISON_COLUMNS)
+
+def write_consolidated_runs(run_dfs):
+    publish_runs(RESULTS_DATASET, run_dfs, 'player predictions')
+
+def create_consolidated_comparison(predictions_df, truth_df, run_number):
+    write_consolidated_runs([build_run_comparison(predictions_df, truth_df, run_number)])
 
 if __name__ == "__main__":
-    process_and_predict()
+    # Usage: python prediction_minimum_effort.py [run_number] [--resume]
+    args = [arg for arg in sys.argv[1:] if arg != '--resume']
+    run_number = int(args[0]) if args else 1
+    process_and_predict(run_number, resume='--resume' in sys.argv)
@@ -1,11 +1,18 @@
 # Prediction of Prisoner's Dilemma Games
 
 import pandas as pd
-import json
-import re
 import os
 import sys
+from functools import partial
 
+from agent_pool.agent import MAX_CONCURRENCY
+from async_executor import run_calls_concurrently
+from data_cache import load_workbook
+from llm_backend import backend_model
+from prompt_builder import row_values, group_arrays, join_lines
+from response_parser import normalize_vote, parse_pd
+from run_journal import journaled_calls
+from truth_store import truth_table
 from structured_prompt_loader import get_structured_prediction_from_system_user
 
 # --- File Names ---
@@ -14,6 +21,10 @@ SYSTEM_PROMPT_FILE = 'instructions/ipd_system_message_prompt_minimal.txt'
 USER_PROMPT_TEMPLATE_FILE = 'instructions/ipd_user_message_template_minimal.txt'
 RAW_PREDICTIONS_FILE = None
 FINAL_ANALYTICAL_REPORT_FILE = None
+RUN_RAW_PREDICTIONS_FILE = 'minimal_raw_ai_predictions_run{run_number}.csv'
+JOURNAL_FILE = 'journal_prisoners_dilemma.jsonl'
+# Ground truth is stored once per data version in ground_truth/prisoners_dilemma/ (see truth_store.py)
+TRUTH_DATASET = 'prisoners_dilemma'
 
 # --- Column Names from CSV ---
 GAME_ID_COLS = ['session', 'Cluster.x']
@@ -24,46 +35,14 @@ SENDER_COL = 'Sender'
 MESSAGE_COL = 'texttype'
 VOTE_COL = 'T3_Vote'
 
-def intelligent_parse(raw_json_text):
-    """Robustly finds and decodes a JSON object from the AI's raw output."""
-    if not isinstance(raw_json_text, str):
-        return None
-    match = re.search(r'\{.*\}', raw_json_text, re.DOTALL)
-    if not match:
-        print("      ERROR: No JSON object found in the AI response.")
-        return None
-    try:
-        return json.loads(match.group(0))
-    except json.JSONDecodeError:
-        print("      ERROR: Failed to decode the JSON object from the AI response.")
-        return None
-
-def normalize_vote(vote):
-    """Converts various vote formats to 'Cooperate' or 'Defect'."""
-    if not isinstance(vote, str):
-        return 'N/A'
-    vote_lower = vote.strip().lower()
-    if vote_lower in ['m', 'cooperate', 'coop']:
-        return 'Cooperate'
-    if vote_lower in ['j', 'defect']:
-        return 'Defect'
-    return 'N/A'
-
-def run_analysis(run_number=None):
+def load_inputs():
     """
-    Load data, run predictions, and generate the final report.
+    Reads the prompt files and the Excel data, and prepares the treatment 2 rows.
+    Returns None if a required file is missing.
     """
-    global RAW_PREDICTIONS_FILE, FINAL_ANALYTICAL_REPORT_FILE
-    if run_number is not None:
-        RAW_PREDICTIONS_FILE = f'minimal_raw_ai_predictions_run{run_number}.csv'
-        FINAL_ANALYTICAL_REPORT_FILE = f'final_full_analytical_report_task2_minimal_run{run_number}.csv'
-    else:
-        RAW_PREDICTIONS_FILE = 'minimal_raw_ai_predictions.csv'
-        FINAL_ANALYTICAL_REPORT_FILE = 'final_full_analytical_report_task2_minimal.csv'
-    
     print("--- 1. Loading data and prompt files ---")
     try:
-        df = pd.read_excel(EXCEL_FILE)
+        df = load_workbook(EXCEL_FILE, view='pd')
         with open(SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
             system_message = f.read()
         with open(USER_PROMPT_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
@@ -71,121 +50,220 @@ def run_analysis(run_number=None):
         print("Files loaded successfully.")
     except FileNotFoundError as e:
         print(f"ERROR: Make sure '{e.filename}' exists. You must create the prompt files.")
-        return
+        return None
 
     print("--- 2. Preparing and filtering master data ---")
+    # session, Cluster.x and Subgroup.x already carry their dtype fixes in the 'pd' view
     relevant_df = df[df[TREATMENT_COL] == 2].copy()
-    relevant_df['session'] = relevant_df['session'].astype(str)
-    relevant_df['Cluster.x'] = pd.to_numeric(relevant_df['Cluster.x'], errors='coerce').astype('Int64')
     relevant_df['game_id'] = relevant_df[GAME_ID_COLS].astype(str).agg('_'.join, axis=1)
-    relevant_df[SUBGROUP_COL] = pd.to_numeric(relevant_df[SUBGROUP_COL], errors='coerce').astype('Int64')
     print(f"Data prepared. Found {relevant_df['game_id'].nunique()} unique games (sessions).")
+    return system_message, user_template, relevant_df
 
-    print("--- 3. Generating predictions for each game ---")
-    all_results = []
-    all_raw_predictions = []
+def build_game_index(relevant_df):
+    """
+    Indexes the prepared rows once, so perspectives and ground truth are dictionary lookups:
+    {game_id: {'subgroups': sorted subgroups, 'players': {subgroup: sorted player ids},
+               'team_chat': {subgroup: task 3 chat log}, 'intergroup_chat': task 4 chat log,
+               'votes': {player id: first non-null vote}}}
+    """
+    teams = relevant_df[['game_id', SUBGROUP_COL]].drop_duplicates()
+    subgroups_by_game = group_arrays(teams[SUBGROUP_COL], teams['game_id']).sort_index()
+    team_players = relevant_df[['game_id', SUBGROUP_COL, SENDER_COL]].drop_duplicates()
+    players_by_team = group_arrays(team_players[SENDER_COL], [team_players['game_id'], team_players[SUBGROUP_COL]])
 
-    grouped_games = relevant_df.groupby('game_id')
-    
-    for game_id, game_data in grouped_games:
+    # Chat lines for all rows at once, joined per team (task 3) and per game (task 4)
+    chat_lines = "Player " + row_values(relevant_df, SENDER_COL) + ": " + row_values(relevant_df, MESSAGE_COL)
+    team_chat = relevant_df[TASK_COL] == 3
+    intergroup_chat = relevant_df[TASK_COL] == 4
+    team_chat_logs = join_lines(chat_lines[team_chat], [relevant_df.loc[team_chat, 'game_id'], relevant_df.loc[team_chat, SUBGROUP_COL]], "\n")
+    intergroup_chat_logs = join_lines(chat_lines[intergroup_chat], relevant_df.loc[intergroup_chat, 'game_id'], "\n")
+
+    # Each player's vote is the first non-null vote in row order
+    votes = relevant_df[['game_id', SENDER_COL, VOTE_COL]].dropna(subset=[VOTE_COL]).drop_duplicates(['game_id', SENDER_COL])
+
+    game_index = {
+        game_id: {'subgroups': sorted(subgroups), 'players': {}, 'team_chat': {}, 'intergroup_chat': "", 'votes': {}}
+        for game_id, subgroups in subgroups_by_game.items()
+    }
+    for (game_id, subgroup), players in players_by_team.items():
+        game_index[game_id]['players'][subgroup] = sorted(players)
+    for (game_id, subgroup), chat_log in team_chat_logs.items():
+        game_index[game_id]['team_chat'][subgroup] = chat_log
+    for game_id, chat_log in intergroup_chat_logs.items():
+        game_index[game_id]['intergroup_chat'] = chat_log
+    for game_id, p_id, vote in zip(votes['game_id'], votes[SENDER_COL], votes[VOTE_COL]):
+        game_index[game_id]['votes'][p_id] = vote
+    return game_index
+
+def build_prompt_table(game_index, user_template):
+    """
+    Renders the user message for both perspectives of every game with two subgroups.
+    Returns a DataFrame with one row per perspective, in game order.
+    """
+    rows = []
+    for game_id, game in game_index.items():
         print(f"Processing Game: {game_id}")
-        subgroups = sorted(game_data[SUBGROUP_COL].unique())
+        subgroups = game['subgroups']
         if len(subgroups) != 2:
             print(f"Skipping {game_id} - found {len(subgroups)} subgroups instead of 2")
             continue
-        
+
         team_a_subgroup, team_b_subgroup = subgroups[0], subgroups[1]
 
         for focal_subgroup, opponent_subgroup in [(team_a_subgroup, team_b_subgroup), (team_b_subgroup, team_a_subgroup)]:
-            session_id = f"{game_id}_{focal_subgroup}"
-            print(f"Processing Perspective: {session_id}")
-
-            # Format inputs
-            team1_players = sorted(game_data[game_data[SUBGROUP_COL] == focal_subgroup][SENDER_COL].unique())
-            team2_players = sorted(game_data[game_data[SUBGROUP_COL] == opponent_subgroup][SENDER_COL].unique())
-            focal_chat_data = game_data[(game_data[SUBGROUP_COL] == focal_subgroup) & (game_data[TASK_COL] == 3)]
-            intergroup_chat_data = game_data[game_data[TASK_COL] == 4]
-            team1_chat_logs = "\n".join([f"Player {row[SENDER_COL]}: {row[MESSAGE_COL]}" for _, row in focal_chat_data.iterrows()])
-            intergroup_chat_logs = "\n".join([f"Player {row[SENDER_COL]}: {row[MESSAGE_COL]}" for _, row in intergroup_chat_data.iterrows()])
-            
+            team1_players = game['players'].get(focal_subgroup, [])
+            team2_players = game['players'].get(opponent_subgroup, [])
+
             # Format the user message with the template
             user_message = user_template.format(
                 TEAM1_PLAYER_IDS=", ".join(map(str, team1_players)),
                 TEAM2_PLAYER_IDS=", ".join(map(str, team2_players)),
-                TEAM1_CHAT_LOGS=team1_chat_logs,
-                INTERGROUP_CHAT_LOGS=intergroup_chat_logs
+                TEAM1_CHAT_LOGS=game['team_chat'].get(focal_subgroup, ""),
+                INTERGROUP_CHAT_LOGS=game['intergroup_chat']
             )
-            
-            # Get prediction
-            ai_response_text = get_structured_prediction_from_system_user(system_message, user_message)
-
-            # Store the raw prediction before parsing
-            all_raw_predictions.append({'session_id': session_id, 'raw_prediction_text': ai_response_text})
-            
-            parsed_info = intelligent_parse(ai_response_text)
-            
-            if not parsed_info:
-                print(f"SKIPPING session {session_id} due to parsing failure.")
-                continue
-            
-            # Get ground truth for the opponent team
-            opponent_actual_votes = {}
-            
-            for p_id in team2_players:
-                vote_series = game_data[game_data[SENDER_COL] == p_id][VOTE_COL].dropna()
-                if not vote_series.empty:
-                    vote_value = vote_series.iloc[0]
-                    opponent_actual_votes[str(p_id)] = vote_value
-                    print(f"Debug: Player {p_id} vote: {vote_value} -> normalized: {normalize_vote(vote_value)}")
-                else:
-                    print(f"WARNING: No vote found for player {p_id} in any task")
-                    opponent_actual_votes[str(p_id)] = 'N/A'
-
-            # Calculate team outcome using raw votes
-            raw_coop_votes = sum(1 for vote in opponent_actual_votes.values() 
-                               if isinstance(vote, str) and vote.strip().lower() in ['m', 'cooperate', 'coop'])
-            actual_team_outcome = 'Cooperate' if raw_coop_votes >= 2 else 'Defect'
-            print(f"Debug: Raw votes for team outcome: {raw_coop_votes} cooperate votes -> {actual_team_outcome}")
-
-            # Parse predictions and match to ground truth
-            ai_preds = parsed_info.get('team2_player_predictions', [])
-            ai_final_pred = parsed_info.get('team2_final_prediction', {})
-
-            # Compute predicted team outcome from individual predictions
-            pred_coop_votes = sum(1 for ai_p in ai_preds if normalize_vote(ai_p.get('predicted_vote')) == 'Cooperate')
-            pred_defect_votes = sum(1 for ai_p in ai_preds if normalize_vote(ai_p.get('predicted_vote')) == 'Defect')
-            if pred_coop_votes + pred_defect_votes > 0:
-                predicted_team_outcome = 'Cooperate' if pred_coop_votes >= 2 else 'Defect'
+            rows.append({
+                'session_id': f"{game_id}_{focal_subgroup}",
+                'game_id': game_id,
+                'focal_subgroup': focal_subgroup,
+                'team2_players': team2_players,
+                'user_message': user_message
+            })
+    return pd.DataFrame(rows, columns=['session_id', 'game_id', 'focal_subgroup', 'team2_players', 'user_message'])
+
+def build_sessions(relevant_df, user_template):
+    """Builds the user message for both perspectives of every game with two subgroups."""
+    print("--- 3. Generating predictions for each game ---")
+    game_index = build_game_index(relevant_df)
+    prompt_table = build_prompt_table(game_index, user_template)
+
+    # Ground truth of each perspective: the opponent players' votes, by player id
+    perspectives = []
+    for perspective in prompt_table.to_dict('records'):
+        votes = game_index[perspective['game_id']]['votes']
+        perspective['ground_truth'] = {str(p_id): votes[p_id] for p_id in perspective['team2_players'] if p_id in votes}
+        perspectives.append(perspective)
+    return perspectives
+
+def build_truth_table(perspectives):
+    """
+    One row per perspective and opponent player: the player's raw vote ('N/A' if none was found)
+    and the opponent team's actual outcome, computed from the raw votes.
+    """
+    rows = []
+    for perspective in perspectives:
+        ground_truth = perspective['ground_truth']
+        opponent_actual_votes = {}
+        for p_id in perspective['team2_players']:
+            if str(p_id) in ground_truth:
+                vote_value = ground_truth[str(p_id)]
+                opponent_actual_votes[str(p_id)] = vote_value
+                print(f"Debug: Player {p_id} vote: {vote_value} -> normalized: {normalize_vote(vote_value)}")
             else:
-                predicted_team_outcome = 'N/A'
-
-            for p_id_actual in team2_players:
-                p_id_str = str(p_id_actual)
-                actual_vote = opponent_actual_votes.get(p_id_str, 'N/A')
-                predicted_vote, reasoning = 'N/A', 'Player not found in prediction'
-                for ai_p in ai_preds:
-                    if str(ai_p.get('player_id')) == p_id_str:
-                        predicted_vote = ai_p.get('predicted_vote', 'N/A')
-                        reasoning = ai_p.get('prediction_reasoning', 'N/A')
-                        break
-
-                # Store all data
-                result_row = {
-                    'session_id': session_id,
-                    'game_id': game_id,
-                    'focal_team_id': focal_subgroup,
-                    'opponent_player_id': p_id_actual,
-                    'actual_individual_vote': normalize_vote(actual_vote),
-                    'predicted_individual_vote': normalize_vote(predicted_vote),
-                    'individual_prediction_correct': 1 if normalize_vote(actual_vote) == normalize_vote(predicted_vote) else 0,
-                    'actual_team_outcome': actual_team_outcome,
-                    'predicted_team_outcome': predicted_team_outcome,
-                    'team_prediction_correct': 1 if actual_team_outcome == predicted_team_outcome else 0,
-                    'ai_reasoning_for_player': reasoning,
-                    'ai_team_prediction_explanation': ai_final_pred.get('explanation', 'N/A')
-                }
-                all_results.append(result_row)
-    
+                print(f"WARNING: No vote found for player {p_id} in any task")
+                opponent_actual_votes[str(p_id)] = 'N/A'
+
+        # Calculate team outcome using raw votes
+        raw_coop_votes = sum(1 for vote in opponent_actual_votes.values()
+                           if isinstance(vote, str) and vote.strip().lower() in ['m', 'cooperate', 'coop'])
+        actual_team_outcome = 'Cooperate' if raw_coop_votes >= 2 else 'Defect'
+        print(f"Debug: Raw votes for team outcome: {raw_coop_votes} cooperate votes -> {actual_team_outcome}")
+        for p_id, vote_value in opponent_actual_votes.items():
+            rows.append({
+                'session_id': perspective['session_id'],
+                'opponent_player_id': p_id,
+                'actual_vote': vote_value,
+                'actual_team_outcome': actual_team_outcome
+            })
+    return pd.DataFrame(rows, columns=['session_id', 'opponent_player_id', 'actual_vote', 'actual_team_outcome'])
+
+def truth_by_session(truth_df):
+    """Returns {session_id: ({opponent player id: raw vote}, actual team outcome)}."""
+    truth = {}
+    for session_id, p_id, vote_value, outcome in zip(truth_df['session_id'], truth_df['opponent_player_id'], truth_df['actual_vote'], truth_df['actual_team_outcome']):
+        votes, _ = truth.setdefault(session_id, ({}, outcome))
+        votes[p_id] = vote_value
+    return truth
+
+def save_run_results(perspectives, ai_responses, run_number=None):
+    """
+    Scores the responses of one run against the opponents' votes and saves the raw predictions
+    and the final analytical report. ai_responses holds one response per perspective, in order.
+    """
+    global RAW_PREDICTIONS_FILE, FINAL_ANALYTICAL_REPORT_FILE
+    if run_number is not None:
+        RAW_PREDICTIONS_FILE = RUN_RAW_PREDICTIONS_FILE.format(run_number=run_number)
+        FINAL_ANALYTICAL_REPORT_FILE = f'final_full_analytical_report_task2_minimal_run{run_number}.csv'
+    else:
+        RAW_PREDICTIONS_FILE = 'minimal_raw_ai_predictions.csv'
+        FINAL_ANALYTICAL_REPORT_FILE = 'final_full_analytical_report_task2_minimal.csv'
+
+    all_results = []
+    all_raw_predictions = []
+    model = backend_model()
+    truth = truth_by_session(truth_table(TRUTH_DATASET, perspectives, build_truth_table, EXCEL_FILE))
+
+    for perspective, ai_response_text in zip(perspectives, ai_responses):
+        session_id = perspective['session_id']
+        game_id = perspective['game_id']
+        focal_subgroup = perspective['focal_subgroup']
+        team2_players = perspective['team2_players']
+        print(f"Processing Perspective: {session_id}")
+        if isinstance(ai_response_text, Exception):
+            print(f"API call failed for {session_id}: {ai_response_text}")
+            ai_response_text = f'{{"error": "API call failed: {ai_response_text}"}}'
+
+        # Store the raw prediction before parsing
+        all_raw_predictions.append({'session_id': session_id, 'raw_prediction_text': ai_response_text})
+        
+        prediction = parse_pd(ai_response_text)
+        
+        if prediction.error:
+            print(f"      ERROR: {prediction.error}")
+            print(f"SKIPPING session {session_id} due to parsing failure.")
+            continue
+        
+        # Ground truth for the opponent team, computed once for all runs
+        # (a perspective without opponent players has no truth rows and no result rows)
+        opponent_actual_votes, actual_team_outcome = truth.get(session_id, ({}, 'Defect'))
+
+        # Parse predictions and match to ground truth
+        ai_preds = prediction.player_predictions
+
+        # Compute predicted team outcome from individual predictions
+        pred_coop_votes = sum(1 for ai_p in ai_preds if normalize_vote(ai_p.predicted_vote) == 'Cooperate')
+        pred_defect_votes = sum(1 for ai_p in ai_preds if normalize_vote(ai_p.predicted_vote) == 'Defect')
+        if pred_coop_votes + pred_defect_votes > 0:
+            predicted_team_outcome = 'Cooperate' if pred_coop_votes >= 2 else 'Defect'
+        else:
+            predicted_team_outcome = 'N/A'
+
+        for p_id_actual in team2_players:
+            p_id_str = str(p_id_actual)
+            actual_vote = opponent_actual_votes.get(p_id_str, 'N/A')
+            predicted_vote, reasoning = 'N/A', 'Player not found in prediction'
+            for ai_p in ai_preds:
+                if ai_p.player_id == p_id_str:
+                    predicted_vote, reasoning = ai_p.predicted_vote, ai_p.reasoning
+                    break
+
+            # Store all data
+            result_row = {
+                'session_id': session_id,
+                'game_id': game_id,
+                'focal_team_id': focal_subgroup,
+                'opponent_player_id': p_id_actual,
+                'actual_individual_vote': normalize_vote(actual_vote),
+                'predicted_individual_vote': normalize_vote(predicted_vote),
+                'individual_prediction_correct': 1 if normalize_vote(actual_vote) == normalize_vote(predicted_vote) else 0,
+                'actual_team_outcome': actual_team_outcome,
+                'predicted_team_outcome': predicted_team_outcome,
+                'team_prediction_correct': 1 if actual_team_outcome == predicted_team_outcome else 0,
+                'ai_reasoning_for_player': reasoning,
+                'ai_team_prediction_explanation': prediction.team_explanation,
+                'model': model
+            }
+            all_results.append(result_row)
+
     print(f"--- 4. Creating and saving report files ---")
     
     # Save raw predictions
@@ -203,12 +281,35 @@ def run_analysis(run_number=None):
     final_df.to_csv(FINAL_ANALYTICAL_REPORT_FILE, index=False)
     print(f"Final analytical report saved to '{FINAL_ANALYTICAL_REPORT_FILE}'")
 
+def run_analysis(run_number=None, resume=False):
+    """
+    Load data, run predictions, and generate the final report.
+    """
+    inputs = load_inputs()
+    if inputs is None:
+        return
+    system_message, user_template, relevant_df = inputs
+    perspectives = build_sessions(relevant_df, user_template)
+
+    # Get predictions concurrently, results come back in perspective order
+    print(f"Requesting predictions for {len(perspectives)} perspectives (up to {MAX_CONCURRENCY} concurrent calls)...")
+    ai_responses = run_calls_concurrently(journaled_calls(
+        JOURNAL_FILE,
+        system_message,
+        ((run_number, perspective['session_id'], partial(get_structured_prediction_from_system_user, system_message, perspective['user_message'], run_number, perspective['session_id']))
+         for perspective in perspectives),
+        resume
+    ))
+    save_run_results(perspectives, ai_responses, run_number)
+
 if __name__ == "__main__":
+    # Usage: python prediction_prisoners_dilemma.py [run_number] [--resume]
+    args = [arg for arg in sys.argv[1:] if arg != '--resume']
     run_number = None
-    if len(sys.argv) > 1:
+    if args:
         try:
-            run_number = int(sys.argv[1])
+            run_number = int(args[0])
             print(f"Run number: {run_number}")
         except ValueError:
             print("Warning: Argument should be a run number (integer)")
-    run_analysis(run_number)
+    run_analysis(run_number, resume='--resume' in sys.argv)
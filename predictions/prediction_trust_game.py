@@ -1,20 +1,32 @@
+import numpy as np
 import pandas as pd
 import os
 import sys
-import json
+from collections import deque
+from functools import partial
 
+from agent_pool.agent import MAX_CONCURRENCY
+from async_executor import run_calls_concurrently, stream_calls
+from llm_backend import backend_model
+from prompt_builder import row_scalars
+from response_parser import parse_tg
+from results_store import finish_comparison, publish_runs, save_run, append_run_rows, commit_run, discard_pending_run
+from run_journal import journaled_calls, iter_journaled_calls
+from truth_store import truth_table, stored_truth_hash, append_truth_rows, publish_truth
 from structured_prompt_loader_task3 import get_structured_game_prediction_system_user
 
-# --- Configuration ---
-RUN_NUMBER = int(sys.argv[1]) if len(sys.argv) > 1 else 1
-
 # --- File Names ---
 EXCEL_FILE = 'CD_trust_game_outcomes.csv'
 SYSTEM_PROMPT_FILE = 'instructions/trust_game_system_minimal.txt'
 USER_PROMPT_TEMPLATE_FILE = 'instructions/trust_game_user_minimal.txt'
-GROUND_TRUTH_FILE = f'ground_truth_trust_game_run{RUN_NUMBER}.csv'
-PREDICTIONS_FILE = f'predictions_trust_game_run{RUN_NUMBER}.csv'
+PREDICTIONS_FILE = 'predictions_trust_game_run{run_number}.csv'
+RESULTS_DATASET = 'trust_game'
 CONSOLIDATED_OUTPUT_FILE = 'trust_game_consolidated.csv'
+COMPARISON_COLUMNS = ['run_number', 'session_id', 'predicted_action', 'actual_action', 'prediction_correctness', 'reasoning', 'model']
+JOURNAL_FILE = 'journal_trust_game.jsonl'
+TRUTH_DATASET = 'trust_game'
+# Rows read, and results written, per batch in streaming mode
+STREAM_CHUNK_ROWS = int(os.getenv("TRUST_GAME_CHUNK_ROWS", "10000"))
 
 # --- Column Names from CSV ---
 SESSION_COL = 'Session'
@@ -22,113 +34,222 @@ MESSAGE_COL = 'Message'
 ACTION_COL = 'Action' # 0 = Defect, 1 = Cooperate
 # ---------------------------------------------------------
 
-def process_and_predict_trust_game():
+def load_prompts():
+    """Reads the system prompt and the user message template. Returns None if a file is missing."""
     if not os.path.exists(SYSTEM_PROMPT_FILE) or not os.path.exists(USER_PROMPT_TEMPLATE_FILE):
         print(f"ERROR: System or user prompt file not found.")
-        return
+        return None
+    with open(SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
+        system_message = f.read()
+    with open(USER_PROMPT_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
+        user_template = f.read()
+    return system_message, user_template
+
+def load_inputs():
+    """Reads the prompt files and the sessions with messages. Returns None if a file is missing."""
+    prompts = load_prompts()
+    if prompts is None:
+        return None
     try:
         df = pd.read_csv(EXCEL_FILE)
         df.dropna(subset=[MESSAGE_COL], inplace=True)
         print(f"Loaded '{EXCEL_FILE}'. Found {len(df)} sessions with messages to process.")
     except FileNotFoundError:
         print(f"ERROR: CSV file not found at '{EXCEL_FILE}'")
-        return
+        return None
+    system_message, user_template = prompts
+    return system_message, user_template, df
 
-    with open(SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
-        system_message = f.read()
-    with open(USER_PROMPT_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
-        user_template = f.read()
+def build_sessions(df, user_template):
+    """Builds the user message for each session, in file order."""
+    sessions = []
+    for index, row in df.iterrows():
+        sessions.append({
+            'session_id': row[SESSION_COL],
+            'user_message': user_template.format(PLAYER_B_MESSAGE=row[MESSAGE_COL]),
+            'ground_truth': {'actual_action': row[ACTION_COL]}
+        })
+    return sessions
+
+def build_truth_table(sessions):
+    """One row per session: session_id and the actual action as 'Cooperate' or 'Defect'."""
+    return pd.DataFrame(
+        [{'session_id': session['session_id'],
+          'actual_action': 'Cooperate' if session['ground_truth']['actual_action'] == 1 else 'Defect'}
+         for session in sessions],
+        columns=['session_id', 'actual_action']
+    )
 
-    ground_truth_data = []
+def collect_run_rows(sessions, ai_predictions):
+    """Returns the prediction rows for responses in session order."""
     predictions_data = []
 
-    for index, row in df.iterrows():
-        session_id = row[SESSION_COL]
-        message_text = row[MESSAGE_COL]
-        actual_action = row[ACTION_COL]
-        print(f"\n--- Processing Session: {session_id} ---")
-        try:
-            user_message = user_template.format(PLAYER_B_MESSAGE=message_text)
-            ai_prediction_json = get_structured_game_prediction_system_user(
-                system_message,
-                user_message
-            )
+    for session, ai_prediction_json in zip(sessions, ai_predictions):
+        session_id = session['session_id']
+        if isinstance(ai_prediction_json, Exception):
+            print(f"  Error getting prediction for Session {session_id}: {ai_prediction_json}")
+            ai_prediction_json = f"Error: {ai_prediction_json}"
+        else:
             print(f"AI Prediction Received for Session {session_id}")
-        except Exception as e:
-            print(f"  Error getting prediction for Session {session_id}: {e}")
-            ai_prediction_json = f"Error: {e}"
         predictions_data.append({
             'session_id': session_id,
             'prediction_text': ai_prediction_json
         })
-        action_label = 'Cooperate' if actual_action == 1 else 'Defect'
-        ground_truth_data.append({
-            'session_id': session_id,
-            'actual_action': action_label
-        })
+    return predictions_data
+
+def save_run_results(sessions, ai_predictions, run_number, consolidate=True):
+    """
+    Saves the predictions of one run (one response text or exception per session, in session
+    order) and compares them with the stored ground truth; see results_store.save_run().
+    """
+    predictions_data = collect_run_rows(sessions, ai_predictions)
     if not predictions_data:
         print(f"WARNING: No game sessions were processed from the CSV file.")
-    else:
-        truth_df = pd.DataFrame(ground_truth_data)
-        truth_df.to_csv(GROUND_TRUTH_FILE, index=False)
-        print(f"Successfully saved ground truth answers to '{GROUND_TRUTH_FILE}'")
-        predictions_df = pd.DataFrame(predictions_data)
-        predictions_df.to_csv(PREDICTIONS_FILE, index=False)
-        print(f"Successfully saved all AI predictions to '{PREDICTIONS_FILE}'")
-        create_consolidated_comparison(predictions_df, truth_df, RUN_NUMBER)
+        return None
+    return save_run(
+        RESULTS_DATASET, run_number, predictions_data, PREDICTIONS_FILE.format(run_number=run_number),
+        lambda predictions_df: build_run_comparison(predictions_df, truth_table(TRUTH_DATASET, sessions, build_truth_table, EXCEL_FILE), run_number),
+        consolidate, 'session predictions'
+    )
 
-def create_consolidated_comparison(predictions_df, truth_df, run_number):
+def process_and_predict_trust_game(run_number=1, resume=False):
+    inputs = load_inputs()
+    if inputs is None:
+        return
+    system_message, user_template, df = inputs
+    sessions = build_sessions(df, user_template)
+
+    # Call API concurrently, results come back in session order
+    print(f"Requesting predictions for {len(sessions)} sessions (up to {MAX_CONCURRENCY} concurrent calls)...")
+    ai_predictions = run_calls_concurrently(journaled_calls(
+        JOURNAL_FILE,
+        system_message,
+        ((run_number, session['session_id'], partial(get_structured_game_prediction_system_user, system_message, session['user_message'], run_number, session['session_id']))
+         for session in sessions),
+        resume
+    ))
+    save_run_results(sessions, ai_predictions, run_number)
+
+# --- Streaming mode ---
+# For message corpora too large to hold in memory: the CSV is read in chunks, prompts reach the
+# executor through a bounded queue and results are appended to the output files in batches.
+
+def iter_sessions(user_template, chunk_rows=STREAM_CHUNK_ROWS):
+    """Yields the sessions of the CSV in file order, reading chunk_rows rows at a time."""
+    for chunk in pd.read_csv(EXCEL_FILE, chunksize=chunk_rows):
+        chunk = chunk.dropna(subset=[MESSAGE_COL])
+        yield from build_sessions(chunk, user_template)
+
+def _append_batch(batch, run_number, first_batch, store_truth=True):
+    """
+    Appends one batch of (session, response) pairs to the run's output files and, unless the
+    data version's truth is already stored, to the ground truth being built.
+    """
+    sessions, ai_predictions = zip(*batch)
+    predictions_data = collect_run_rows(sessions, ai_predictions)
+    truth_df = build_truth_table(sessions)
+    if store_truth:
+        append_truth_rows(TRUTH_DATASET, truth_df, first_batch)
+    predictions_df = pd.DataFrame(predictions_data)
+    predictions_df.to_csv(PREDICTIONS_FILE.format(run_number=run_number), mode='w' if first_batch else 'a', header=first_batch, index=False)
+    run_df = build_run_comparison(predictions_df, truth_df, run_number)
+    if run_df is not None:
+        append_run_rows(RESULTS_DATASET, run_number, run_df)
+
+def process_trust_game_streaming(run_number=1, resume=False, chunk_rows=STREAM_CHUNK_ROWS, max_concurrency=None):
+    """
+    Same outputs as process_and_predict_trust_game, in memory bounded by chunk_rows and the
+    executor queue rather than by the size of the CSV.
+    """
+    prompts = load_prompts()
+    if prompts is None:
+        return
+    if not os.path.exists(EXCEL_FILE):
+        print(f"ERROR: CSV file not found at '{EXCEL_FILE}'")
+        return
+    system_message, user_template = prompts
+
+    # Sessions wait here between submission and their (in-order) result
+    in_flight = deque()
+
+    def planned_calls():
+        for session in iter_sessions(user_template, chunk_rows):
+            in_flight.append(session)
+            yield (run_number, session['session_id'], partial(get_structured_game_prediction_system_user, system_message, session['user_message'], run_number, session['session_id']))
+
+    print(f"Streaming predictions from '{EXCEL_FILE}' in chunks of {chunk_rows} rows...")
+    # Rows left over from an interrupted run are rebuilt below
+    discard_pending_run(RESULTS_DATASET, run_number)
+    store_truth = stored_truth_hash(TRUTH_DATASET, EXCEL_FILE) is None
+    batch = []
+    written = 0
+    for ai_prediction in stream_calls(iter_journaled_calls(JOURNAL_FILE, system_message, planned_calls(), resume), max_concurrency):
+        batch.append((in_flight.popleft(), ai_prediction))
+        if len(batch) >= chunk_rows:
+            _append_batch(batch, run_number, first_batch=written == 0, store_truth=store_truth)
+            written += len(batch)
+            batch = []
+    if batch:
+        _append_batch(batch, run_number, first_batch=written == 0, store_truth=store_truth)
+        written += len(batch)
+
+    if not written:
+        print(f"WARNING: No game sessions were processed from the CSV file.")
+        return
+    print(f"Successfully saved {written} predictions for run {run_number}")
+    if store_truth:
+        publish_truth(TRUTH_DATASET, EXCEL_FILE)
+    if commit_run(RESULTS_DATASET, run_number):
+        print(f"Updated results store '{RESULTS_DATASET}' with run {run_number} data")
+
+def parse_predictions(predictions_df):
+    """Parses every response once into its session_id, predicted_action and reasoning."""
+    parsed = [parse_tg(prediction_text) for prediction_text in predictions_df['prediction_text']]
+    for session_id, prediction in zip(predictions_df['session_id'], parsed):
+        if prediction.error:
+            print(f"Warning: Could not parse JSON for session {session_id}: {prediction.error}")
+    return pd.DataFrame({
+        'session_id': predictions_df['session_id'].to_numpy(),
+        'predicted_action': pd.Series([prediction.final_prediction for prediction in parsed], dtype=object),
+        'reasoning': pd.Series([prediction.prediction_summary for prediction in parsed], dtype=object)
+    })
+
+def build_run_comparison(predictions_df, truth_df, run_number):
+    """Compares one run's predictions with the ground truth and returns the comparison rows."""
     print(f"Creating consolidated comparison for run {run_number}...")
-    all_session_rows = []
-    for _, pred_row in predictions_df.iterrows():
-        session_id = pred_row['session_id']
-        prediction_text = pred_row['prediction_text']
-        try:
-            if prediction_text.strip().startswith('{'):
-                parsed_json = json.loads(prediction_text)
-            else:
-                import re
-                json_match = re.search(r'\{.*\}', prediction_text, re.DOTALL)
-                if json_match:
-                    parsed_json = json.loads(json_match.group(0))
-                else:
-                    parsed_json = {}
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Warning: Could not parse JSON for session {session_id}: {e}")
-            parsed_json = {}
-        session_truth = truth_df[truth_df['session_id'] == session_id]
-        if session_truth.empty:
-            print(f"Warning: No ground truth found for session {session_id}")
-            continue
-        predicted_action = parsed_json.get('final_prediction', 'N/A')
-        actual_action = session_truth.iloc[0]['actual_action'] if len(session_truth) > 0 else 'N/A'
-        reasoning = parsed_json.get('prediction_summary', 'N/A')
-        prediction_correctness = "N/A"
-        if predicted_action != 'N/A' and actual_action != 'N/A':
-            prediction_correctness = "Correct" if predicted_action == actual_action else "Incorrect"
-        session_row = {
-            'run_number': run_number,
-            'session_id': session_id,
-            'predicted_action': predicted_action,
-            'actual_action': actual_action,
-            'prediction_correctness': prediction_correctness,
-            'reasoning': reasoning
-        }
-        all_session_rows.append(session_row)
-    if not all_session_rows:
+    responses = parse_predictions(predictions_df)
+    has_truth = responses['session_id'].isin(truth_df['session_id'])
+    for session_id in responses.loc[~has_truth, 'session_id']:
+        print(f"Warning: No ground truth found for session {session_id}")
+
+    # Hash join on session_id; the first truth row of a session is its answer
+    actual_actions = pd.Series(row_scalars(truth_df, 'actual_action'), index=truth_df['session_id'].to_numpy())
+    actual_actions = actual_actions[~actual_actions.index.duplicated()]
+    comparison = responses[has_truth].copy()
+    comparison['actual_action'] = comparison['session_id'].map(actual_actions)
+    if comparison.empty:
         print(f"No comparison data created for run {run_number}")
-        return
-    run_df = pd.DataFrame(all_session_rows)
-    if os.path.exists(CONSOLIDATED_OUTPUT_FILE):
-        existing_df = pd.read_csv(CONSOLIDATED_OUTPUT_FILE)
-        existing_df = existing_df[existing_df['run_number'] != run_number]
-        consolidated_df = pd.concat([existing_df, run_df], ignore_index=True)
-    else:
-        consolidated_df = run_df
-    consolidated_df.to_csv(CONSOLIDATED_OUTPUT_FILE, index=False)
-    print(f"Updated consolidated comparison file '{CONSOLIDATED_OUTPUT_FILE}' with run {run_number} data")
-    print(f"   - Added {len(run_df)} session predictions")
-    print(f"   - Total runs in consolidated file: {consolidated_df['run_number'].nunique()}")
+        return None
+
+    predicted, actual = comparison['predicted_action'], comparison['actual_action']
+    comparison['prediction_correctness'] = np.select(
+        [predicted.eq('N/A') | actual.eq('N/A'), predicted == actual],
+        ["N/A", "Correct"],
+        "Incorrect"
+    )
+    return finish_comparison(comparison, run_number, backend_model(), COMPARISON_COLUMNS)
+
+def write_consolidated_runs(run_dfs):
+    publish_runs(RESULTS_DATASET, run_dfs, 'session predictions')
+
+def create_consolidated_comparison(predictions_df, truth_df, run_number):
+    write_consolidated_runs([build_run_comparison(predictions_df, truth_df, run_number)])
 
 if __name__ == "__main__":
-    process_and_predict_trust_game()
+    # Usage: python prediction_trust_game.py [run_number] [--resume] [--stream]
+    args = [arg for arg in sys.argv[1:] if arg not in ('--resume', '--stream')]
+    run_number = int(args[0]) if args else 1
+    if '--stream' in sys.argv:
+        process_trust_game_streaming(run_number, resume='--resume' in sys.argv)
+    else:
+        process_and_predict_trust_game(run_number, resume='--resume' in sys.argv)
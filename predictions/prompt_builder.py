@@ -0,0 +1,40 @@
+# Helpers for building every session's prompt in one vectorized pass
+#
+# The prediction scripts used to render each prompt line inside DataFrame.iterrows(). These
+# helpers produce the same text column-wise, so a whole frame is rendered at once and the
+# lines are joined per session with a single groupby.
+
+import numpy as np
+import pandas as pd
+
+def row_scalars(df, column):
+    """
+    Returns df[column] as iterrows() over df would yield it, as an array. iterrows() casts each
+    row to the common dtype of all of df's columns, so for example an integer Sender becomes
+    1.0 next to float columns but stays 1 next to text columns.
+    """
+    common_dtype = df.iloc[:0].to_numpy().dtype
+    return df[column].to_numpy(dtype=common_dtype)
+
+def row_values(df, column):
+    """Like row_scalars, as strings formatted the way an f-string formats them."""
+    return pd.Series(row_scalars(df, column), index=df.index, dtype=object).astype(str)
+
+def group_arrays(values, keys):
+    """
+    Splits a Series into one array per group of keys, keeping row order within each group.
+    One sort and one split instead of a Python-level call per group.
+    """
+    grouped = values.groupby(keys, sort=False)
+    group_index = grouped.size().index
+    codes = grouped.ngroup().to_numpy()
+    kept = codes >= 0
+    codes, kept_values = codes[kept], values.to_numpy()[kept]
+    order = np.argsort(codes, kind='stable')
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    chunks = np.split(kept_values[order], boundaries) if len(order) else []
+    return pd.Series(chunks, index=group_index, dtype=object)
+
+def join_lines(lines, keys, separator=''):
+    """Joins lines per group of keys, keeping row order within each group."""
+    return group_arrays(lines, keys).map(separator.join)
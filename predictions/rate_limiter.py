@@ -0,0 +1,141 @@
+# Shared request scheduling under the provider's rate limits
+#
+# Every loader call reserves one request and an estimate of its tokens from per-model
+# token buckets (requests per minute and tokens per minute) before it is sent. When the
+# server answers 429 with Retry-After, every worker for that model pauses for that long, plus
+# a small random jitter so the workers do not all retry in the same instant.
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from agent_pool.agent import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
+
+# Backoff for failures without a Retry-After header
+BASE_RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 60.0
+# Upper bound of the random seconds added to a Retry-After pause
+RETRY_AFTER_JITTER = 1.0
+# Rough completion size used until the real usage of a call is known
+ESTIMATED_COMPLETION_TOKENS = 1500
+
+class TokenBucket:
+    """Refills continuously up to capacity. Reservations may overdraw it and wait off the debt."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.per_second = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Takes amount from the bucket and returns the seconds to wait before using it."""
+        with self.lock:
+            self._refill()
+            self.available -= min(amount, self.capacity)
+            if self.available >= 0:
+                return 0.0
+            return -self.available / self.per_second
+
+    def adjust(self, amount):
+        """Charges (or refunds, if negative) the difference between estimated and actual use."""
+        with self.lock:
+            self._refill()
+            self.available = min(self.capacity, self.available - amount)
+
+_lock = threading.Lock()
+_buckets = {}
+_paused_until = {}
+
+def _get_buckets(model):
+    with _lock:
+        if model not in _buckets:
+            _buckets[model] = (
+                TokenBucket(REQUESTS_PER_MINUTE) if REQUESTS_PER_MINUTE > 0 else None,
+                TokenBucket(TOKENS_PER_MINUTE) if TOKENS_PER_MINUTE > 0 else None
+            )
+        return _buckets[model]
+
+def estimate_tokens(*messages):
+    """Approximates prompt tokens at 4 characters per token, plus the expected completion."""
+    return sum(len(message) for message in messages) // 4 + ESTIMATED_COMPLETION_TOKENS
+
+def reserve_capacity(model, estimated_tokens):
+    """Reserves one request and estimated_tokens for model. Returns the seconds to wait."""
+    request_bucket, token_bucket = _get_buckets(model)
+    wait = 0.0
+    if request_bucket:
+        wait = max(wait, request_bucket.reserve(1))
+    if token_bucket:
+        wait = max(wait, token_bucket.reserve(estimated_tokens))
+    with _lock:
+        pause = _paused_until.get(model, 0.0) - time.monotonic()
+    if pause > 0:
+        pause += random.uniform(0, RETRY_AFTER_JITTER)
+    return max(wait, pause)
+
+def acquire_capacity(model, estimated_tokens):
+    """Blocks until model has budget for one more request of about estimated_tokens."""
+    wait = reserve_capacity(model, estimated_tokens)
+    if wait > 0:
+        time.sleep(wait)
+
+def record_usage(model, estimated_tokens, usage):
+    """Corrects the token bucket with the usage reported by the completion."""
+    _, token_bucket = _get_buckets(model)
+    total_tokens = getattr(usage, 'total_tokens', None)
+    if token_bucket and total_tokens is not None:
+        token_bucket.adjust(total_tokens - estimated_tokens)
+
+def retry_after_seconds(error):
+    """Reads retry-after-ms or Retry-After (seconds or HTTP date) from an API error, if present."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error):
+    """
+    Connection problems, timeouts, rate limits and server errors are retried. Request errors and
+    anything raised outside the API client (a bug in the caller) fail on the first attempt.
+    """
+    if isinstance(error, openai.APIConnectionError):
+        # Includes openai.APITimeoutError
+        return True
+    if not isinstance(error, openai.APIStatusError) or getattr(error, 'code', None) == 'insufficient_quota':
+        return False
+    return error.status_code in (408, 409, 429) or error.status_code >= 500
+
+def retry_delay(model, error, attempt):
+    """
+    Returns how long to wait before retrying a failed call. A server-provided Retry-After plus up
+    to RETRY_AFTER_JITTER seconds pauses all workers for model; otherwise full-jitter exponential
+    backoff.
+    """
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, RETRY_AFTER_JITTER)
+        with _lock:
+            _paused_until[model] = max(_paused_until.get(model, 0.0), time.monotonic() + delay)
+        return delay
+    return random.uniform(0, min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * (2 ** attempt)))
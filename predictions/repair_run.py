@@ -0,0 +1,117 @@
+# Repair pass for finished runs: re-query only the sessions whose response failed
+#
+# Usage: python repair_run.py <meg|pd|tg> --runs 1-150 [--dry-run] [--prompts prompts_<game>.jsonl]
+#
+# Reads each run's saved raw responses and finds the sessions with an error payload, no JSON
+# object, or a response that does not satisfy the game's schema (see response_parser.SCHEMAS).
+# Only those sessions are requested again, on the shared concurrent executor, and journaled.
+# A new response replaces the old one only if it validates. Repaired runs are then saved again
+# through the game's own output code, so their per-run files and the consolidated results are
+# rebuilt from the merged responses.
+
+import argparse
+import os
+from functools import partial
+
+import pandas as pd
+
+from agent_pool.agent import MAX_CONCURRENCY
+from async_executor import run_calls_concurrently
+from games import GAMES, parse_run_range, save_runs
+from llm_backend import is_error_response
+from materialize import load_sessions
+from response_parser import validate
+from run_journal import journaled_calls
+
+# Where each game saves a run's raw responses: (module attribute with the file name, text column)
+RUN_RESPONSES = {
+    'meg': ('PREDICTIONS_FILE', 'prediction_text'),
+    'pd': ('RUN_RAW_PREDICTIONS_FILE', 'raw_prediction_text'),
+    'tg': ('PREDICTIONS_FILE', 'prediction_text'),
+}
+
+def load_run_responses(game, run_number):
+    """Returns {session_id: response text} saved for a run, or None if the run has no file."""
+    module, _ = GAMES[game]
+    file_attr, text_col = RUN_RESPONSES[game]
+    responses_file = getattr(module, file_attr).format(run_number=run_number)
+    if not os.path.exists(responses_file):
+        return None
+    df = pd.read_csv(responses_file, dtype=str, keep_default_na=False)
+    return dict(zip(df['session_id'], df[text_col]))
+
+def failure_reason(game, response):
+    """Why a saved response needs to be requested again, or None if it is usable."""
+    if isinstance(response, Exception):
+        return str(response)
+    if is_error_response(response):
+        return "API call failed"
+    return validate(game, response)
+
+def find_failures(game, sessions, run_numbers):
+    """
+    Returns ({run_number: responses in session order}, [(run_number, session index, reason)])
+    for the runs that have saved responses.
+    """
+    responses_by_run = {}
+    failures = []
+    for run_number in run_numbers:
+        saved = load_run_responses(game, run_number)
+        if saved is None:
+            print(f"Run {run_number}: no saved responses, skipping")
+            continue
+        responses = [saved.get(str(session['session_id']), RuntimeError("No response saved")) for session in sessions]
+        responses_by_run[run_number] = responses
+        for index, response in enumerate(responses):
+            reason = failure_reason(game, response)
+            if reason:
+                failures.append((run_number, index, reason))
+    return responses_by_run, failures
+
+def repair_runs(game, run_numbers, max_concurrency=None, dry_run=False, prompts_file=None):
+    module, predict = GAMES[game]
+    loaded = load_sessions(game, prompts_file)
+    if loaded is None:
+        return
+    system_message, sessions = loaded
+
+    responses_by_run, failures = find_failures(game, sessions, run_numbers)
+    total = sum(len(responses) for responses in responses_by_run.values())
+    print(f"{len(failures)} of {total} responses in {len(responses_by_run)} runs need repair")
+    for run_number, index, reason in failures:
+        print(f"  run {run_number}, session {sessions[index]['session_id']}: {reason}")
+    if dry_run or not failures:
+        return
+
+    print(f"Requesting {len(failures)} predictions again (up to {max_concurrency or MAX_CONCURRENCY} concurrent calls)...")
+    new_responses = run_calls_concurrently(
+        journaled_calls(
+            module.JOURNAL_FILE,
+            system_message,
+            ((run_number, sessions[index]['session_id'], partial(predict, system_message, sessions[index]['user_message'], run_number, sessions[index]['session_id']))
+             for run_number, index, _ in failures)
+        ),
+        max_concurrency
+    )
+
+    repaired_runs = {}
+    repaired = 0
+    for (run_number, index, _), response in zip(failures, new_responses):
+        if failure_reason(game, response):
+            continue
+        responses_by_run[run_number][index] = response
+        repaired_runs[run_number] = responses_by_run[run_number]
+        repaired += 1
+    print(f"Repaired {repaired} of {len(failures)} responses in {len(repaired_runs)} runs")
+    if repaired_runs:
+        save_runs(module, sessions, repaired_runs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-query only the failed sessions of finished runs and save the runs again.")
+    parser.add_argument('game', choices=sorted(GAMES))
+    parser.add_argument('--runs', required=True, help="Run numbers, e.g. '1-150' or '1-50,101-150'")
+    parser.add_argument('--concurrency', type=int, default=None, help="Maximum calls in flight (default: MAX_CONCURRENCY)")
+    parser.add_argument('--dry-run', action='store_true', help="Only list the responses that need repair")
+    parser.add_argument('--prompts', default=None, help="Read sessions from a prompt artifact written by materialize.py")
+    args = parser.parse_args()
+    repair_runs(args.game, parse_run_range(args.runs), args.concurrency, args.dry_run, args.prompts)
@@ -0,0 +1,94 @@
+# On-disk cache of model responses, keyed by everything that determines the request
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+from agent_pool.agent import CACHE_FILE, CACHE_MODE, CACHE_MAX_AGE_DAYS, CACHE_MAX_ENTRIES
+
+_connection = None
+_lock = threading.Lock()
+
+def _get_connection():
+    """Opens the cache database once per process and applies eviction on open."""
+    global _connection
+    if _connection is None:
+        connection = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "cache_key TEXT PRIMARY KEY, model TEXT, content TEXT, usage TEXT, created_at REAL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses (created_at)")
+        connection.commit()
+        _connection = connection
+        _evict(connection, CACHE_MAX_AGE_DAYS, CACHE_MAX_ENTRIES)
+    return _connection
+
+def _evict(connection, max_age_days, max_entries):
+    if max_age_days:
+        cutoff = time.time() - max_age_days * 86400
+        connection.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+    if max_entries:
+        connection.execute(
+            "DELETE FROM responses WHERE cache_key NOT IN "
+            "(SELECT cache_key FROM responses ORDER BY created_at DESC LIMIT ?)",
+            (max_entries,)
+        )
+    connection.commit()
+
+def cache_enabled():
+    return CACHE_MODE != 'off'
+
+def replay_only():
+    """True when the API must never be called and only cached responses may be used."""
+    return CACHE_MODE == 'replay'
+
+def make_cache_key(model, temperature, system_message, user_message, sample_index=None, response_format=None):
+    """
+    Hashes the model settings, both prompts, the run/sample index and the response format into a
+    cache key, so a response cached in JSON mode is never served to a strict-schema request.
+    """
+    payload = json.dumps([model, temperature, system_message, user_message, sample_index, response_format], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def system_prompt_hash(system_message):
+    return hashlib.sha256(system_message.encode('utf-8')).hexdigest()
+
+def get_cached_response(cache_key):
+    """Returns {'content': ..., 'usage': ...} for a cached response, or None."""
+    if not cache_enabled():
+        return None
+    with _lock:
+        row = _get_connection().execute(
+            "SELECT content, usage FROM responses WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+    if row is None:
+        return None
+    return {'content': row[0], 'usage': json.loads(row[1]) if row[1] else None}
+
+def store_response(cache_key, model, content, usage=None):
+    if not cache_enabled():
+        return
+    with _lock:
+        connection = _get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (cache_key, model, content, usage, created_at) VALUES (?, ?, ?, ?, ?)",
+            (cache_key, model, content, json.dumps(usage) if usage else None, time.time())
+        )
+        connection.commit()
+
+def evict_cache(max_age_days=CACHE_MAX_AGE_DAYS, max_entries=CACHE_MAX_ENTRIES):
+    with _lock:
+        _evict(_get_connection(), max_age_days, max_entries)
+
+if __name__ == "__main__":
+    # Usage: python response_cache.py [max_age_days] [max_entries]
+    max_age_days = float(sys.argv[1]) if len(sys.argv) > 1 else CACHE_MAX_AGE_DAYS
+    max_entries = int(sys.argv[2]) if len(sys.argv) > 2 else CACHE_MAX_ENTRIES
+    evict_cache(max_age_days, max_entries)
+    count = _get_connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    print(f"Cache '{CACHE_FILE}' holds {count} responses after eviction.")
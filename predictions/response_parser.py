@@ -0,0 +1,194 @@
+# Shared parsing of model responses into typed prediction records
+#
+# extract_json() decodes the span from the first '{' to the last '}' of a response, which is
+# what the greedy regex r'\{.*\}' used to match (and the whole response for clean JSON), found
+# with two string scans. If other braced text follows the object, the object is still decoded;
+# if braced prose precedes it, at most MAX_FALLBACK_STARTS later object openings are tried.
+# The span is decoded once, with orjson when it is installed; its errors carry a message and a
+# position like the json module's, which the recovery above starts from.
+#
+# parse_meg(), parse_pd() and parse_tg() check the fields each game reads and return a record
+# with the game's defaults for missing or malformed fields. record.error is None on success.
+# normalize_vote() maps the PD vote labels of responses and data alike.
+#
+# SCHEMAS holds each game's output structure as a strict JSON schema. The backends send it as
+# the structured-output format, and validate() checks a response against it (extra fields are
+# tolerated) so the response cache and repair_run.py can tell usable responses from failures.
+
+import json
+import re
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_FALLBACK_STARTS = 8
+
+NO_JSON_ERROR = "No JSON object found in the AI response."
+DECODE_ERROR = "Failed to decode the JSON object from the AI response."
+EMPTY_ERROR = "The JSON object in the AI response is empty."
+
+def _object(**properties):
+    return {'type': 'object', 'properties': properties, 'required': list(properties), 'additionalProperties': False}
+
+def _array(items):
+    return {'type': 'array', 'items': items}
+
+def _string(*allowed):
+    return {'type': 'string', 'enum': list(allowed)} if allowed else {'type': 'string'}
+
+SCHEMAS = {
+    'meg': _object(
+        player_predictions=_array(_object(
+            player_id=_string(),
+            predicted_choice={'type': 'integer', 'enum': list(range(1, 8))},
+            prediction_context=_string()
+        )),
+        conclusion=_object(outcome=_string('Coordinate', 'Fail to Coordinate'), explanation=_string())
+    ),
+    'pd': _object(
+        team2_player_predictions=_array(_object(
+            player_id=_string(),
+            predicted_vote=_string('M', 'J'),
+            prediction_reasoning=_string()
+        )),
+        team2_final_prediction=_object(outcome=_string('Cooperate', 'Defect'), explanation=_string())
+    ),
+    'tg': _object(
+        final_prediction=_string('Cooperate', 'Defect'),
+        prediction_summary=_string()
+    ),
+}
+
+MEGPlayerPrediction = namedtuple('MEGPlayerPrediction', ['player_id', 'predicted_choice'])
+MEGPrediction = namedtuple('MEGPrediction', ['player_predictions', 'group_outcome', 'error'])
+PDPlayerPrediction = namedtuple('PDPlayerPrediction', ['player_id', 'predicted_vote', 'reasoning'])
+PDPrediction = namedtuple('PDPrediction', ['player_predictions', 'team_outcome', 'team_explanation', 'error'])
+TGPrediction = namedtuple('TGPrediction', ['final_prediction', 'prediction_summary', 'error'])
+
+# The 'Extra data' error of the json module and its orjson counterpart
+_EXTRA_DATA_ERRORS = ('Extra data', 'unexpected content after document')
+# Constants the json module accepts and orjson rejects
+_NON_FINITE = ('NaN', 'Infinity', '-Infinity')
+
+def _loads(text):
+    """Decodes text; raises json.JSONDecodeError (orjson's is a subclass) on failure."""
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError as e:
+            if not text.startswith(_NON_FINITE, e.pos):
+                raise
+    return json.loads(text)
+
+_decoder = json.JSONDecoder()
+# '{' that can start a non-empty or empty object, unlike the braces of {placeholder} prose
+_OBJECT_START = re.compile(r'\{\s*["}]')
+
+def extract_json(text):
+    """Returns the JSON object in a response. Raises ValueError if there is none."""
+    if not isinstance(text, str):
+        raise ValueError(NO_JSON_ERROR)
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError(NO_JSON_ERROR)
+    # The whole response when it is clean JSON
+    span = text[start:end + 1]
+    try:
+        return _loads(span)
+    except json.JSONDecodeError as e:
+        error = e
+    if error.msg in _EXTRA_DATA_ERRORS:
+        return _loads(span[:error.pos])
+
+    # Braced text before the object: retry from later object openings. An attempt resumes after
+    # the position where decoding failed, so an object nested in a truncated one is never returned.
+    opening = _OBJECT_START.search(text, start + max(error.pos, 1), end + 1)
+    for _ in range(MAX_FALLBACK_STARTS):
+        if opening is None:
+            break
+        try:
+            return _decoder.raw_decode(text, opening.start())[0]
+        except json.JSONDecodeError as e:
+            opening = _OBJECT_START.search(text, max(opening.start() + 1, e.pos), end + 1)
+    raise ValueError(DECODE_ERROR)
+
+def _parse_object(text):
+    """Returns (object, error); object is {} when error is set."""
+    try:
+        parsed = extract_json(text)
+    except ValueError as e:
+        return {}, str(e)
+    if not parsed:
+        return {}, EMPTY_ERROR
+    return parsed, None
+
+def _field(obj, key, expected_type, default):
+    value = obj.get(key, default)
+    return value if isinstance(value, expected_type) else default
+
+def parse_meg(text):
+    parsed, error = _parse_object(text)
+    player_predictions = [
+        MEGPlayerPrediction(pred.get('player_id', ''), pred.get('predicted_choice', 'N/A'))
+        for pred in _field(parsed, 'player_predictions', list, []) if isinstance(pred, dict)
+    ]
+    group_outcome = _field(parsed, 'conclusion', dict, {}).get('outcome', 'N/A')
+    return MEGPrediction(player_predictions, group_outcome, error)
+
+def parse_pd(text):
+    parsed, error = _parse_object(text)
+    player_predictions = [
+        PDPlayerPrediction(str(pred.get('player_id')), pred.get('predicted_vote', 'N/A'), pred.get('prediction_reasoning', 'N/A'))
+        for pred in _field(parsed, 'team2_player_predictions', list, []) if isinstance(pred, dict)
+    ]
+    team_prediction = _field(parsed, 'team2_final_prediction', dict, {})
+    return PDPrediction(player_predictions, team_prediction.get('outcome', 'N/A'), team_prediction.get('explanation', 'N/A'), error)
+
+def normalize_vote(vote):
+    """Converts various vote formats to 'Cooperate' or 'Defect'."""
+    if not isinstance(vote, str):
+        return 'N/A'
+    vote_lower = vote.strip().lower()
+    if vote_lower in ['m', 'cooperate', 'coop']:
+        return 'Cooperate'
+    if vote_lower in ['j', 'defect']:
+        return 'Defect'
+    return 'N/A'
+
+def parse_tg(text):
+    parsed, error = _parse_object(text)
+    return TGPrediction(parsed.get('final_prediction', 'N/A'), parsed.get('prediction_summary', 'N/A'), error)
+
+_TYPES = {'object': dict, 'array': list, 'string': str, 'integer': int}
+
+def _schema_problem(value, schema, path):
+    """Returns the first place where value does not match schema, or None."""
+    expected_type = _TYPES[schema['type']]
+    if not isinstance(value, expected_type) or (expected_type is int and isinstance(value, bool)):
+        return f"{path or 'response'} is not of type {schema['type']}"
+    if 'enum' in schema and value not in schema['enum']:
+        return f"{path} is {value!r}, expected one of {schema['enum']}"
+    if expected_type is dict:
+        for key in schema['required']:
+            if key not in value:
+                return f"{path + '.' if path else ''}{key} is missing"
+            problem = _schema_problem(value[key], schema['properties'][key], f"{path + '.' if path else ''}{key}")
+            if problem:
+                return problem
+    elif expected_type is list:
+        for i, item in enumerate(value):
+            problem = _schema_problem(item, schema['items'], f"{path}[{i}]")
+            if problem:
+                return problem
+    return None
+
+def validate(game, text):
+    """Returns why a response does not satisfy the game's schema, or None if it does."""
+    try:
+        parsed = extract_json(text)
+    except ValueError as e:
+        return str(e)
+    return _schema_problem(parsed, SCHEMAS[game], '')
@@ -0,0 +1,157 @@
+# Partitioned, append-only store of per-run comparison results
+#
+# Each run of a dataset is one partition file, results/<dataset>/run_<n>.csv. Saving a run
+# writes only its own partition and replaces it atomically, so a sweep does O(runs) I/O and
+# concurrent runs never touch the same file. read_runs() presents the union as one DataFrame.
+#
+#     python results_store.py list <dataset>
+#     python results_store.py export <dataset> <output.csv>
+#     python results_store.py import <dataset> <consolidated.csv>
+
+import glob
+import os
+import re
+import sys
+
+import pandas as pd
+
+RESULTS_DIR = os.getenv("PREDICTION_RESULTS_DIR", "results")
+PARTITION_FILE = 'run_{run_number}.csv'
+
+def _dataset_dir(dataset):
+    return os.path.join(RESULTS_DIR, dataset)
+
+def partition_path(dataset, run_number):
+    return os.path.join(_dataset_dir(dataset), PARTITION_FILE.format(run_number=run_number))
+
+def list_runs(dataset):
+    """Run numbers with a partition, in ascending order."""
+    runs = []
+    for path in glob.glob(os.path.join(_dataset_dir(dataset), 'run_*.csv')):
+        match = re.fullmatch(r'run_(\d+)\.csv', os.path.basename(path))
+        if match:
+            runs.append(int(match.group(1)))
+    return sorted(runs)
+
+def write_run(dataset, run_number, run_df):
+    """Replaces the partition of run_number with run_df atomically."""
+    os.makedirs(_dataset_dir(dataset), exist_ok=True)
+    path = partition_path(dataset, run_number)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    run_df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, path)
+
+def write_runs(dataset, run_dfs):
+    """Writes each run found in run_dfs to its own partition. Returns the run numbers written."""
+    run_dfs = [run_df for run_df in run_dfs if run_df is not None]
+    if not run_dfs:
+        return []
+    new_df = pd.concat(run_dfs, ignore_index=True)
+    run_numbers = list(new_df['run_number'].unique())
+    for run_number, run_df in new_df.groupby('run_number', sort=False):
+        write_run(dataset, run_number, run_df)
+    return run_numbers
+
+def publish_runs(dataset, run_dfs, unit='predictions'):
+    """Writes each run to its own partition, replacing earlier results of that run, and reports the update."""
+    run_numbers = write_runs(dataset, run_dfs)
+    if not run_numbers:
+        return run_numbers
+    runs_label = ", ".join(map(str, run_numbers))
+    print(f"Updated results store '{dataset}' with run {runs_label} data")
+    print(f"   - Added {sum(len(run_df) for run_df in run_dfs if run_df is not None)} {unit}")
+    print(f"   - Total runs in results store: {len(list_runs(dataset))}")
+    return run_numbers
+
+def finish_comparison(comparison, run_number, model, columns):
+    """
+    Adds the run_number and the model that produced the predictions to a run's comparison rows,
+    so analyses can slice by model rather than by run range, and keeps columns. infer_objects
+    gives each column the dtype the row-by-row construction inferred.
+    """
+    comparison.insert(0, 'run_number', run_number)
+    comparison['model'] = model
+    return comparison[columns].reset_index(drop=True).infer_objects()
+
+def save_run(dataset, run_number, predictions_data, predictions_file, compare, consolidate=True, unit='predictions'):
+    """
+    Saves a run's raw predictions to predictions_file and builds its comparison rows with
+    compare(predictions_df). Unless consolidate is False, the rows replace the run's partition.
+    Returns the comparison rows (None if nothing could be compared).
+    """
+    predictions_df = pd.DataFrame(predictions_data)
+    predictions_df.to_csv(predictions_file, index=False)
+    print(f"Successfully saved all AI predictions to '{predictions_file}'")
+    run_df = compare(predictions_df)
+    if consolidate:
+        publish_runs(dataset, [run_df], unit)
+    return run_df
+
+def append_run_rows(dataset, run_number, rows_df):
+    """
+    Appends rows to a run that is still being written. The rows stay invisible to readers
+    until commit_run() publishes them as the run's partition.
+    """
+    os.makedirs(_dataset_dir(dataset), exist_ok=True)
+    pending_file = partition_path(dataset, run_number) + '.pending'
+    write_header = not os.path.exists(pending_file)
+    rows_df.to_csv(pending_file, mode='a', header=write_header, index=False)
+
+def discard_pending_run(dataset, run_number):
+    pending_file = partition_path(dataset, run_number) + '.pending'
+    if os.path.exists(pending_file):
+        os.remove(pending_file)
+
+def commit_run(dataset, run_number):
+    """Publishes the rows appended for run_number, replacing its partition. False if there are none."""
+    pending_file = partition_path(dataset, run_number) + '.pending'
+    if not os.path.exists(pending_file):
+        return False
+    os.replace(pending_file, partition_path(dataset, run_number))
+    return True
+
+def read_runs(dataset, run_numbers=None):
+    """Returns the union of the partitions (all, or only run_numbers) as one DataFrame."""
+    runs = list_runs(dataset)
+    if run_numbers is not None:
+        selected = set(run_numbers)
+        runs = [run_number for run_number in runs if run_number in selected]
+    frames = [pd.read_csv(partition_path(dataset, run_number)) for run_number in runs]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def read_results(dataset, legacy_file):
+    """
+    Reads a dataset from the store, or from its old consolidated CSV if the store has no runs.
+    Returns None if neither exists.
+    """
+    if list_runs(dataset):
+        return read_runs(dataset)
+    if os.path.exists(legacy_file):
+        return pd.read_csv(legacy_file)
+    return None
+
+def export_runs(dataset, output_file):
+    df = read_runs(dataset)
+    df.to_csv(output_file, index=False)
+    print(f"Exported {len(df)} rows from {len(list_runs(dataset))} runs of '{dataset}' to '{output_file}'")
+
+def import_consolidated(dataset, consolidated_file):
+    """Splits an existing consolidated CSV into one partition per run."""
+    run_numbers = write_runs(dataset, [pd.read_csv(consolidated_file)])
+    print(f"Imported {len(run_numbers)} runs of '{dataset}' from '{consolidated_file}'")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('list', 'export', 'import') or (sys.argv[1] != 'list' and len(sys.argv) < 4):
+        print("Usage: python results_store.py list <dataset> | export <dataset> <output.csv> | import <dataset> <consolidated.csv>")
+        sys.exit(1)
+    command, dataset = sys.argv[1], sys.argv[2]
+    if command == 'list':
+        runs = list_runs(dataset)
+        print(f"{dataset}: {len(runs)} runs" + (f" ({runs[0]}-{runs[-1]})" if runs else ""))
+    elif command == 'export':
+        export_runs(dataset, sys.argv[3])
+    else:
+        import_consolidated(dataset, sys.argv[3])
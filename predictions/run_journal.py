@@ -0,0 +1,93 @@
+# Append-only journal of completed predictions, so interrupted runs can resume
+#
+# Each response is written (and flushed to disk) as soon as it arrives, one JSON line per
+# (run, session) with the model and system prompt hash it was requested with. With resume,
+# journaled predictions of the same model and system prompt are replayed instead of requested
+# again; the others are requested again.
+
+import json
+import os
+import threading
+from functools import partial
+
+from llm_backend import backend_model, is_error_response
+from response_cache import system_prompt_hash
+
+_lock = threading.Lock()
+
+def journal_config(system_message):
+    """{'model': ..., 'prompt_hash': ...} the predictions of a run are journaled and replayed under."""
+    return {'model': backend_model(), 'prompt_hash': system_prompt_hash(system_message)}
+
+def append_journal(journal_file, run_number, session_id, response, config):
+    record = {'run_number': run_number, 'session_id': str(session_id), **config, 'response': response}
+    with _lock:
+        with open(journal_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+def load_journal(journal_file, config):
+    """
+    Returns {(run_number, session_id): response} for every successful journaled prediction made
+    with config (see journal_config). Predictions of another model or system prompt are skipped.
+    """
+    completed = {}
+    stale = 0
+    if not os.path.exists(journal_file):
+        return completed
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash
+                continue
+            if any(record.get(key) != value for key, value in config.items()):
+                stale += 1
+            elif not is_error_response(record['response']):
+                completed[(record['run_number'], record['session_id'])] = record['response']
+    if stale:
+        print(f"Skipping {stale} journaled predictions of another model or system prompt in '{journal_file}'.")
+    return completed
+
+def _replay(response):
+    return response
+
+def _call_and_journal(journal_file, config, run_number, session_id, call):
+    response = call()
+    append_journal(journal_file, run_number, session_id, response, config)
+    return response
+
+def _journaled(journal_file, config, completed, run_number, session_id, call):
+    key = (run_number, str(session_id))
+    if key in completed:
+        return partial(_replay, completed[key]), True
+    return partial(_call_and_journal, journal_file, config, run_number, session_id, call), False
+
+def journaled_calls(journal_file, system_message, planned_calls, resume=False):
+    """
+    Wraps (run_number, session_id, call) triples so each response is journaled when it arrives.
+    With resume, calls already in the journal for the same model and system_message return the
+    journaled response without an API call.
+    """
+    config = journal_config(system_message)
+    completed = load_journal(journal_file, config) if resume else {}
+    calls = []
+    replayed = 0
+    for run_number, session_id, call in planned_calls:
+        wrapped, was_replayed = _journaled(journal_file, config, completed, run_number, session_id, call)
+        calls.append(wrapped)
+        replayed += was_replayed
+    if resume:
+        print(f"Resuming from '{journal_file}': {replayed} predictions already done, {len(calls) - replayed} to request.")
+    return calls
+
+def iter_journaled_calls(journal_file, system_message, planned_calls, resume=False):
+    """Lazy form of journaled_calls for streaming pipelines: wraps each triple as it is requested."""
+    config = journal_config(system_message)
+    completed = load_journal(journal_file, config) if resume else {}
+    if resume:
+        print(f"Resuming from '{journal_file}': {len(completed)} journaled predictions will be replayed.")
+    for run_number, session_id, call in planned_calls:
+        yield _journaled(journal_file, config, completed, run_number, session_id, call)[0]
@@ -0,0 +1,53 @@
+# Running many prediction runs of one game in a single process
+#
+# Usage: python run_sweep.py <meg|pd|tg> --runs 1-150 [--resume] [--prompts prompts_<game>.jsonl]
+#
+# The data and prompt files are loaded and grouped once, every user message is built once,
+# and all (run, session) calls share one concurrent executor. Each run still gets its own
+# output files; the consolidated file is written once at the end.
+
+import argparse
+from functools import partial
+
+from agent_pool.agent import MAX_CONCURRENCY
+from async_executor import run_calls_concurrently
+from games import GAMES, parse_run_range, save_runs
+from materialize import load_sessions
+from run_journal import journaled_calls
+
+def run_sweep(game, run_numbers, max_concurrency=None, resume=False, prompts_file=None):
+    module, predict = GAMES[game]
+    loaded = load_sessions(game, prompts_file)
+    if loaded is None:
+        return
+    system_message, sessions = loaded
+
+    print(f"Requesting {len(run_numbers) * len(sessions)} predictions for {len(run_numbers)} runs "
+          f"(up to {max_concurrency or MAX_CONCURRENCY} concurrent calls)...")
+    ai_responses = run_calls_concurrently(
+        journaled_calls(
+            module.JOURNAL_FILE,
+            system_message,
+            ((run_number, session['session_id'], partial(predict, system_message, session['user_message'], run_number, session['session_id']))
+             for run_number in run_numbers for session in sessions),
+            resume
+        ),
+        max_concurrency
+    )
+
+    # Results come back in (run, session) order
+    responses_by_run = {
+        run_number: ai_responses[i * len(sessions):(i + 1) * len(sessions)]
+        for i, run_number in enumerate(run_numbers)
+    }
+    save_runs(module, sessions, responses_by_run)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many prediction runs of one game in one process.")
+    parser.add_argument('game', choices=sorted(GAMES))
+    parser.add_argument('--runs', required=True, help="Run numbers, e.g. '1-150' or '1-50,101-150'")
+    parser.add_argument('--concurrency', type=int, default=None, help="Maximum calls in flight (default: MAX_CONCURRENCY)")
+    parser.add_argument('--resume', action='store_true', help="Skip predictions already in the game's journal")
+    parser.add_argument('--prompts', default=None, help="Read sessions from a prompt artifact written by materialize.py")
+    args = parser.parse_args()
+    run_sweep(args.game, parse_run_range(args.runs), args.concurrency, args.resume, args.prompts)
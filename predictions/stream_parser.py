@@ -0,0 +1,109 @@
+# Incremental JSON extraction for streamed completions
+#
+# The parser is fed the completion text chunk by chunk and reports every scalar value
+# (string, number, true/false/null) as soon as it is complete, together with its path,
+# e.g. ('team2_player_predictions', 0, 'predicted_vote'). This lets the decisive fields
+# of a prediction be used before the long reasoning fields have finished streaming.
+
+import json
+
+# Paths of the fields that carry the prediction itself; '*' matches any list index
+DECISIVE_FIELDS = (
+    ('final_prediction',),
+    ('conclusion', 'outcome'),
+    ('team2_player_predictions', '*', 'predicted_vote'),
+    ('team2_final_prediction', 'outcome'),
+)
+
+def is_decisive(path):
+    return any(
+        len(pattern) == len(path) and all(p == '*' or p == k for p, k in zip(pattern, path))
+        for pattern in DECISIVE_FIELDS
+    )
+
+def format_path(path):
+    return ''.join(f"[{key}]" if isinstance(key, int) else f".{key}" for key in path).lstrip('.')
+
+class IncrementalJSONParser:
+    """
+    Scans a JSON document fed in arbitrary chunks and calls on_value(path, value) for each
+    completed scalar. Text before the first '{' or '[' (such as a code fence) is ignored.
+    """
+
+    def __init__(self, on_value):
+        self.on_value = on_value
+        # One entry per open container: ['obj', current key, expecting key] or ['arr', index]
+        self.stack = []
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.string_chars = []
+        self.token_chars = []
+
+    def _path(self):
+        return tuple(entry[1] for entry in self.stack)
+
+    def _emit(self, value):
+        if self.stack and self.stack[-1][0] == 'obj' and self.stack[-1][2]:
+            self.stack[-1][1] = value
+            return
+        self.on_value(self._path(), value)
+
+    def _end_string(self):
+        raw = ''.join(self.string_chars)
+        try:
+            value = json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            value = raw
+        self._emit(value)
+
+    def _end_token(self):
+        if not self.token_chars:
+            return
+        raw = ''.join(self.token_chars)
+        self.token_chars = []
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw
+        self._emit(value)
+
+    def feed(self, text):
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                    self._end_string()
+                    continue
+                self.string_chars.append(ch)
+            elif not self.started:
+                if ch in '{[':
+                    self.started = True
+                    self.stack.append(['obj', None, True] if ch == '{' else ['arr', 0])
+            elif ch == '"':
+                self.in_string = True
+                self.string_chars = []
+            elif ch in '{[':
+                self.stack.append(['obj', None, True] if ch == '{' else ['arr', 0])
+            elif ch in '}]':
+                self._end_token()
+                if self.stack:
+                    self.stack.pop()
+            elif ch == ':':
+                if self.stack and self.stack[-1][0] == 'obj':
+                    self.stack[-1][2] = False
+            elif ch == ',':
+                self._end_token()
+                if self.stack and self.stack[-1][0] == 'obj':
+                    self.stack[-1][1] = None
+                    self.stack[-1][2] = True
+                elif self.stack:
+                    self.stack[-1][1] += 1
+            elif ch.isspace():
+                self._end_token()
+            else:
+                self.token_chars.append(ch)
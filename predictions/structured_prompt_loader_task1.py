@@ -1,44 +1,6 @@
 # Making API calls for Minimum Effort Game
 
-import time
-import json
+from llm_backend import get_backend
 
-def get_structured_prediction_from_system_user_task1(system_message: str, user_message: str):
-    
-    from agent_pool.agent import get_agent_client, MODEL_NAME, TEMPERATURE
-
-    # --- Configuration for retries ---
-    max_retries = 3
-    initial_wait_time = 2
-
-    print("Calling AI model for MEG prediction...")
-    client = get_agent_client()
-
-    for attempt in range(max_retries):
-        try:
-            completion = client.chat.completions.create(
-                model=MODEL_NAME,
-                temperature=TEMPERATURE,
-                response_format={"type": "json_object"},
-                timeout=60.0,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ]
-            )
-            return completion.choices[0].message.content
-        
-        except Exception as e:
-            # If the API call fails, print the error and retry
-            print(f"API call failed on attempt {attempt + 1}/{max_retries}: {e}")
-            
-            if attempt == max_retries - 1:
-                print(f"All {max_retries} retries failed. Giving up.")
-                return f'{{"error": "API call failed after {max_retries} attempts: {str(e)}"}}'
-            
-            # --- Wait before retrying ---
-            wait_time = initial_wait_time * (2 ** attempt)
-            print(f"Waiting {wait_time} seconds before retrying...")
-            time.sleep(wait_time)
-
-    return f'{{"error": "Exited retry loop unexpectedly."}}'
+def get_structured_prediction_from_system_user_task1(system_message: str, user_message: str, sample_index=None, session_id=None):
+    return get_backend().complete(system_message, user_message, sample_index, label="MEG", session_id=session_id)
@@ -0,0 +1,114 @@
+# Per-call latency, token and retry telemetry
+#
+# Every backend call appends one JSON line to metrics_<game>_run<run>.jsonl with the game, run,
+# session, model, latency, attempts, token counts and failure reason. Set PREDICTION_METRICS=off
+# to disable. Summarize one or more sidecars with:
+#
+#     python telemetry.py metrics_meg_run*.jsonl
+
+import glob
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+
+METRICS_FILE = 'metrics_{game}_run{run_number}.jsonl'
+METRICS_ENABLED = os.getenv("PREDICTION_METRICS", "on") != 'off'
+SUMMARY_FILE = 'metrics_summary.csv'
+
+_lock = threading.Lock()
+
+def _token_counts(usage):
+    usage = usage or {}
+    prompt_details = usage.get('prompt_tokens_details') or {}
+    completion_details = usage.get('completion_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'completion_tokens': usage.get('completion_tokens'),
+        'cached_tokens': prompt_details.get('cached_tokens'),
+        'reasoning_tokens': completion_details.get('reasoning_tokens'),
+        'total_tokens': usage.get('total_tokens')
+    }
+
+def record_call(game, run_number, session_id, model, backend, started_at, latency_ms,
+                attempts, usage=None, error=None, cache_hit=False, **extra):
+    """Appends one metrics record for a finished call to the sidecar of its game and run."""
+    if not METRICS_ENABLED:
+        return
+    game = (game or 'llm').lower()
+    record = {
+        'game': game,
+        'run': run_number,
+        'session_id': None if session_id is None else str(session_id),
+        'model': model,
+        'backend': backend,
+        'started_at': started_at,
+        'latency_ms': round(latency_ms, 1),
+        'attempts': attempts,
+        'cache_hit': cache_hit,
+        'status': 'error' if error else 'ok',
+        'error': error,
+        **_token_counts(usage),
+        **extra
+    }
+    metrics_file = METRICS_FILE.format(game=game, run_number=run_number)
+    with _lock:
+        with open(metrics_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+def load_metrics(paths):
+    frames = [pd.read_json(path, lines=True, convert_dates=False, dtype={'session_id': str}) for path in paths if os.path.getsize(path) > 0]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def summarize_metrics(df):
+    """Latency percentiles, throughput, retries, failures and tokens per game, run and model."""
+    rows = []
+    for (game, run_number, model), group in df.groupby(['game', 'run', 'model'], dropna=False):
+        api_calls = group[~group['cache_hit']]
+        wall_seconds = (group['started_at'] + group['latency_ms'] / 1000).max() - group['started_at'].min()
+        rows.append({
+            'game': game,
+            'run': run_number,
+            'model': model,
+            'calls': len(group),
+            'cache_hits': int(group['cache_hit'].sum()),
+            'failures': int((group['status'] == 'error').sum()),
+            'retries': int((api_calls['attempts'] - 1).clip(lower=0).sum()),
+            'latency_p50_ms': api_calls['latency_ms'].quantile(0.50),
+            'latency_p95_ms': api_calls['latency_ms'].quantile(0.95),
+            'latency_p99_ms': api_calls['latency_ms'].quantile(0.99),
+            'throughput_calls_per_s': len(group) / wall_seconds if wall_seconds > 0 else None,
+            'prompt_tokens': group['prompt_tokens'].sum(),
+            'completion_tokens': group['completion_tokens'].sum(),
+            'cached_tokens': group['cached_tokens'].sum(),
+            # Only streamed calls report these
+            'first_token_p50_ms': group['first_token_ms'].quantile(0.50) if 'first_token_ms' in group else None,
+            'decision_p50_ms': group['decision_ms'].quantile(0.50) if 'decision_ms' in group else None
+        })
+    return pd.DataFrame(rows)
+
+def main(patterns):
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if not paths:
+        print('No metrics files found.')
+        return
+    df = load_metrics(paths)
+    if df.empty:
+        print('No metrics records found.')
+        return
+    summary_df = summarize_metrics(df)
+    print(f"\nCALL METRICS ({len(df)} calls from {len(paths)} files)")
+    print('=' * 40)
+    print(summary_df.to_string(index=False, float_format='%.1f'))
+
+    print('\nSLOWEST SESSIONS')
+    slowest = df.sort_values('latency_ms', ascending=False).head(10)
+    print(slowest[['game', 'run', 'session_id', 'latency_ms', 'attempts', 'status', 'error']].to_string(index=False))
+
+    summary_df.to_csv(SUMMARY_FILE, index=False)
+    print(f"\nSaved summary to {SUMMARY_FILE}")
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['metrics_*_run*.jsonl'])
@@ -0,0 +1,132 @@
+# Ground truth tables, computed once and stored under their content hash
+#
+# The ground truth of a game only changes with its data, so it is not extracted once per run.
+# A table is stored as ground_truth/<dataset>/<hash>.csv, where <hash> is a prefix of the
+# SHA-256 of the table's CSV, so an identical table is never written twice. truth_table() also
+# records which table the content of the game's data file produced (in sources/<file hash>) and
+# keeps a typed copy (<hash>.pkl) for the prediction scripts: once a data version is stored,
+# every later run reads it back without extracting the truth again. ground_truth/<dataset>/CURRENT
+# names the table of the most recent data, which load_truth() returns to the analysis scripts.
+
+import os
+
+import pandas as pd
+
+from data_cache import file_hash
+
+TRUTH_DIR = os.getenv("PREDICTION_TRUTH_DIR", "ground_truth")
+CURRENT_FILE = 'CURRENT'
+HASH_LENGTH = 16
+SOURCES_DIR = 'sources'
+
+def _dataset_dir(dataset):
+    return os.path.join(TRUTH_DIR, dataset)
+
+def truth_path(dataset, truth_hash):
+    return os.path.join(_dataset_dir(dataset), f"{truth_hash}.csv")
+
+def _typed_path(dataset, truth_hash):
+    return os.path.join(_dataset_dir(dataset), f"{truth_hash}.pkl")
+
+def _source_path(dataset, source_file):
+    return os.path.join(_dataset_dir(dataset), SOURCES_DIR, file_hash(source_file)[:HASH_LENGTH])
+
+def _write_atomic(path, text):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+def current_hash(dataset):
+    try:
+        with open(os.path.join(_dataset_dir(dataset), CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _set_current(dataset, truth_hash):
+    if current_hash(dataset) == truth_hash:
+        return
+    _write_atomic(os.path.join(_dataset_dir(dataset), CURRENT_FILE), truth_hash)
+
+def _publish(dataset, tmp_file):
+    """Stores a written table under its hash unless an identical one exists. Returns the hash."""
+    truth_hash = file_hash(tmp_file)[:HASH_LENGTH]
+    path = truth_path(dataset, truth_hash)
+    if os.path.exists(path):
+        os.remove(tmp_file)
+    else:
+        os.replace(tmp_file, path)
+        print(f"Stored ground truth of '{dataset}' as '{path}'")
+    _set_current(dataset, truth_hash)
+    return truth_hash
+
+def _record_source(dataset, source_file, truth_hash):
+    path = _source_path(dataset, source_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, truth_hash)
+
+def stored_truth_hash(dataset, source_file):
+    """
+    The hash of the table stored for the current content of source_file, which is made the
+    current table, or None if that data version has no stored table yet.
+    """
+    try:
+        with open(_source_path(dataset, source_file), 'r', encoding='utf-8') as f:
+            truth_hash = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if not os.path.exists(truth_path(dataset, truth_hash)):
+        return None
+    _set_current(dataset, truth_hash)
+    return truth_hash
+
+def store_truth(dataset, truth_df):
+    """Stores truth_df under its content hash and makes it the current table. Returns the hash."""
+    os.makedirs(_dataset_dir(dataset), exist_ok=True)
+    tmp_file = os.path.join(_dataset_dir(dataset), f".{os.getpid()}.tmp")
+    truth_df.to_csv(tmp_file, index=False)
+    truth_hash = _publish(dataset, tmp_file)
+    # The CSV does not keep dtypes (tuple and numeric-looking ids), the copy the runs read back does
+    typed_file = _typed_path(dataset, truth_hash)
+    if not os.path.exists(typed_file):
+        truth_df.to_pickle(f"{typed_file}.{os.getpid()}.tmp")
+        os.replace(f"{typed_file}.{os.getpid()}.tmp", typed_file)
+    return truth_hash
+
+def truth_table(dataset, sessions, build, source_file):
+    """
+    Returns the truth table of a game's sessions, which were read from source_file. The table is
+    built with build(sessions) and stored only the first time the file's content is seen.
+    """
+    truth_hash = stored_truth_hash(dataset, source_file)
+    if truth_hash is not None and os.path.exists(_typed_path(dataset, truth_hash)):
+        return pd.read_pickle(_typed_path(dataset, truth_hash))
+    truth_df = build(sessions)
+    _record_source(dataset, source_file, store_truth(dataset, truth_df))
+    return truth_df
+
+def append_truth_rows(dataset, rows_df, first_batch):
+    """Appends rows to a table that is still being built (restarting it on the first batch); publish_truth() stores it."""
+    os.makedirs(_dataset_dir(dataset), exist_ok=True)
+    pending_file = os.path.join(_dataset_dir(dataset), f".{os.getpid()}.pending")
+    rows_df.to_csv(pending_file, mode='w' if first_batch else 'a', header=first_batch, index=False)
+
+def publish_truth(dataset, source_file):
+    """
+    Stores the rows appended by this process as the table of source_file's content. Returns its
+    hash, or None if there are none.
+    """
+    pending_file = os.path.join(_dataset_dir(dataset), f".{os.getpid()}.pending")
+    if not os.path.exists(pending_file):
+        return None
+    truth_hash = _publish(dataset, pending_file)
+    _record_source(dataset, source_file, truth_hash)
+    return truth_hash
+
+def load_truth(dataset, truth_hash=None):
+    """Reads a stored table (the current one by default). Returns None if there is none."""
+    truth_hash = truth_hash or current_hash(dataset)
+    if truth_hash is None or not os.path.exists(truth_path(dataset, truth_hash)):
+        return None
+    return pd.read_csv(truth_path(dataset, truth_hash))
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The prediction scripts import each other by bare module name
+for path in (ROOT, os.path.join(ROOT, 'predictions')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,153 @@
+# batch_runner against a local stand-in for the Files and Batches endpoints
+
+import email.parser
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import batch_runner
+from agent_pool import agent
+
+SYSTEM_MESSAGE = "Predict the outcome."
+SESSIONS = [{'session_id': 's1', 'user_message': "Session one."}, {'session_id': 's2', 'user_message': "Session two."}]
+
+class StandInServer(ThreadingHTTPServer):
+    """Keeps uploaded files and batches in memory; a batch completes after polls_to_complete retrievals."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.polls_to_complete = 2
+        self.final_status = 'completed'
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self.ids)}"
+
+    def output_lines(self, input_file_id):
+        lines = []
+        for line in self.files[input_file_id].decode('utf-8').splitlines():
+            request = json.loads(line)
+            content = json.dumps({'final_prediction': 'Cooperate', 'prediction_summary': request['body']['messages'][1]['content']})
+            lines.append(json.dumps({'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': {
+                'choices': [{'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+            }}}))
+        return '\n'.join(lines).encode('utf-8')
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers['Content-Length']))
+
+    def do_POST(self):
+        server = self.server
+        if self.path == '/v1/files':
+            message = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self._body())
+            content = next(part.get_payload(decode=True) for part in message.get_payload() if part.get_param('name', header='content-disposition') == 'file')
+            file_id = server.new_id('file')
+            server.files[file_id] = content
+            self._send({'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': 0,
+                        'filename': 'batch.jsonl', 'purpose': 'batch', 'status': 'processed'})
+        elif self.path == '/v1/batches':
+            request = json.loads(self._body())
+            batch_id = server.new_id('batch')
+            server.batches[batch_id] = {'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'],
+                                        'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+                                        'created_at': 0, 'status': 'validating', 'polls': 0}
+            self._send(server.batches[batch_id])
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        server = self.server
+        parts = self.path.strip('/').split('/')
+        if parts[:2] == ['v1', 'batches'] and parts[2] in server.batches:
+            batch = server.batches[parts[2]]
+            batch['polls'] += 1
+            if batch['status'] not in batch_runner.TERMINAL_STATUSES:
+                batch['status'] = 'in_progress' if batch['polls'] < server.polls_to_complete else server.final_status
+                if batch['status'] == 'completed':
+                    output_id = server.new_id('file')
+                    server.files[output_id] = server.output_lines(batch['input_file_id'])
+                    batch['output_file_id'] = output_id
+            self._send({key: value for key, value in batch.items() if key != 'polls'})
+        elif parts[:2] == ['v1', 'files'] and parts[-1] == 'content' and parts[2] in server.files:
+            self._send(server.files[parts[2]], 'application/octet-stream')
+        else:
+            self.send_error(404)
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('OPENAI_BASE_URL', f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setattr(agent, '_client', None)
+    monkeypatch.setattr(batch_runner, 'POLL_INTERVAL_SECONDS', 0)
+    monkeypatch.chdir(tmp_path)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def run(sessions=SESSIONS, run_numbers=(1, 2)):
+    batch_file = 'batch_tg_runs1-2.jsonl'
+    batch_runner.write_batch_file(batch_file, 'tg', SYSTEM_MESSAGE, sessions, list(run_numbers))
+    batch_id = batch_runner.submit_or_resume(batch_file, 'batch_tg_runs1-2.batch_id')
+    batch = batch_runner.wait_for_batch(batch_id, poll_interval=0)
+    return batch_id, batch, batch_runner.read_batch_results(batch)
+
+def test_submit_poll_and_download(server):
+    batch_id, batch, results = run()
+    assert batch.status == 'completed'
+    assert len(server.batches) == 1 and server.batches[batch_id]['polls'] >= server.polls_to_complete
+    assert sorted(results) == sorted(batch_runner.make_custom_id(run, index) for run in (1, 2) for index in range(2))
+    content = json.loads(results[batch_runner.make_custom_id(2, 1)]['choices'][0]['message']['content'])
+    assert content['prediction_summary'] == "Session two."
+
+def test_unchanged_batch_is_resumed(server):
+    first_id, _, _ = run()
+    second_id, batch, _ = run()
+    assert second_id == first_id and batch.status == 'completed'
+    assert len(server.batches) == 1
+
+def test_changed_requests_are_resubmitted(server):
+    first_id, _, _ = run()
+    changed = [{**session, 'user_message': session['user_message'] + " Edited."} for session in SESSIONS]
+    second_id, _, results = run(changed)
+    assert second_id != first_id and len(server.batches) == 2
+    content = json.loads(results[batch_runner.make_custom_id(1, 0)]['choices'][0]['message']['content'])
+    assert content['prediction_summary'] == "Session one. Edited."
+
+@pytest.mark.parametrize('status', batch_runner.RESUBMIT_STATUSES)
+def test_unsuccessful_batch_is_resubmitted(server, status):
+    server.final_status = status
+    first_id, batch, results = run()
+    assert batch.status == status and results == {}
+    server.final_status = 'completed'
+    second_id, batch, results = run()
+    assert second_id != first_id and batch.status == 'completed'
+    assert len(results) == 4
+
+def test_batch_id_file_without_hash_is_resubmitted(server):
+    with open('batch_tg_runs1-2.batch_id', 'w', encoding='utf-8') as f:
+        f.write('batch_legacy')
+    batch_id, batch, _ = run()
+    assert batch_id != 'batch_legacy' and batch.status == 'completed'
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import llm_backend
+from llm_backend import LLMBackend, OpenAIBackend, StreamingOpenAIBackend
+
+REQUEST = httpx.Request('POST', 'http://127.0.0.1/v1/chat/completions')
+
+class ScriptedBackend(OpenAIBackend):
+    """Raises the scripted errors in order, then answers."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def _request(self, client, system_message, user_message, label, session_id):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return '{"final_prediction": "Cooperate"}', None, {}
+
+class ChunkedClient:
+    """A chat client whose stream yields the scripted chunks, advancing the clock by one second per chunk."""
+
+    def __init__(self, chunks, clock):
+        self.chunks = chunks
+        self.clock = clock
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        for text in self.chunks:
+            self.clock.now += 1
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+@pytest.fixture(autouse=True)
+def offline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_backend, 'get_agent_client', lambda: None)
+    monkeypatch.setattr(llm_backend, 'retry_delay', lambda model, error, attempt: 0)
+
+def test_base_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LLMBackend()
+
+def test_single_attempt_still_calls_the_api(monkeypatch):
+    monkeypatch.setattr(llm_backend, 'MAX_RETRIES', 1)
+    backend = ScriptedBackend([])
+    assert backend.complete("system", "user") == '{"final_prediction": "Cooperate"}'
+    assert backend.attempts == 1
+
+def test_connection_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(llm_backend, 'MAX_RETRIES', 3)
+    backend = ScriptedBackend([openai.APIConnectionError(request=REQUEST)])
+    assert backend.complete("system", "user") == '{"final_prediction": "Cooperate"}'
+    assert backend.attempts == 2
+
+def test_programming_errors_fail_fast(monkeypatch):
+    monkeypatch.setattr(llm_backend, 'MAX_RETRIES', 3)
+    backend = ScriptedBackend([TypeError("bad argument")])
+    assert backend.complete("system", "user").startswith('{"error": "API call failed after 1 attempts')
+    assert backend.attempts == 1
+
+def test_stream_records_first_and_last_decision(monkeypatch):
+    clock = SimpleNamespace(now=0)
+    monkeypatch.setattr(llm_backend.time, 'perf_counter', lambda: clock.now)
+    chunks = ['{"reasoning": "', 'thinking", "team2_player_predictions": [{"predicted_vote": "M"}',
+              ', {"predicted_vote": "J"}', '], "team2_final_prediction": {"outcome": "M"}}']
+    decisions = []
+    backend = StreamingOpenAIBackend(lambda label, session_id, path, value: decisions.append((path, value)))
+    content, _, timings = backend._request(ChunkedClient(chunks, clock), "system", "user", 'MEG', 1)
+    assert content == ''.join(chunks)
+    assert [value for _, value in decisions] == ['M', 'J', 'M']
+    # The first decisive value completes in the second chunk and the last one in the fourth
+    assert timings == {'first_token_ms': 1000, 'decision_ms': 2000, 'last_decision_ms': 4000}
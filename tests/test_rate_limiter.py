@@ -0,0 +1,36 @@
+import httpx
+import openai
+import pytest
+
+import rate_limiter
+from rate_limiter import RETRY_AFTER_JITTER, is_retryable, reserve_capacity, retry_delay
+
+REQUEST = httpx.Request('POST', 'http://127.0.0.1/v1/chat/completions')
+
+def status_error(status_code, body=None, headers=None):
+    return openai.APIStatusError("error", response=httpx.Response(status_code, request=REQUEST, headers=headers), body=body)
+
+@pytest.mark.parametrize('error', [
+    openai.APIConnectionError(request=REQUEST),
+    openai.APITimeoutError(REQUEST),
+    status_error(408), status_error(409), status_error(429), status_error(500), status_error(503),
+])
+def test_transient_errors_are_retried(error):
+    assert is_retryable(error)
+
+@pytest.mark.parametrize('error', [
+    TypeError("bad argument"), KeyError('choices'), ValueError("bad response_format"),
+    status_error(400), status_error(401), status_error(404),
+    status_error(429, {'code': 'insufficient_quota'}),
+])
+def test_request_and_programming_errors_fail_fast(error):
+    assert not is_retryable(error)
+
+def test_retry_after_pause_is_jittered(monkeypatch):
+    monkeypatch.setattr(rate_limiter, '_paused_until', {})
+    error = status_error(429, headers={'retry-after': '5'})
+    delays = [retry_delay('model', error, 0) for _ in range(20)]
+    assert all(5 <= delay <= 5 + RETRY_AFTER_JITTER for delay in delays)
+    assert len(set(delays)) > 1
+    # Other workers of the model wait out the pause, with jitter of their own
+    assert 4 < reserve_capacity('model', 0) <= 5 + 2 * RETRY_AFTER_JITTER
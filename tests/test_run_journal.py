@@ -0,0 +1,37 @@
+import pytest
+
+import run_journal
+from run_journal import journaled_calls
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(run_journal, 'backend_model', lambda: 'model-a')
+
+def run(system_message, resume):
+    """Runs two sessions of run 1 through the journal and returns the sessions that were requested."""
+    requested = []
+
+    def call(session_id):
+        requested.append(session_id)
+        return f'{{"final_prediction": "{session_id}"}}'
+
+    calls = journaled_calls('journal.jsonl', system_message, ((1, session_id, lambda s=session_id: call(s)) for session_id in ('a', 'b')), resume)
+    assert [wrapped() for wrapped in calls] == ['{"final_prediction": "a"}', '{"final_prediction": "b"}']
+    return requested
+
+def test_resume_replays_predictions_of_the_same_configuration():
+    assert run("system", resume=False) == ['a', 'b']
+    assert run("system", resume=True) == []
+
+def test_resume_requests_predictions_of_another_system_prompt_again():
+    run("system", resume=False)
+    assert run("changed system", resume=True) == ['a', 'b']
+    # Both configurations are journaled now
+    assert run("system", resume=True) == []
+    assert run("changed system", resume=True) == []
+
+def test_resume_requests_predictions_of_another_model_again(monkeypatch):
+    run("system", resume=False)
+    monkeypatch.setattr(run_journal, 'backend_model', lambda: 'model-b')
+    assert run("system", resume=True) == ['a', 'b']
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from truth_store import current_hash, load_truth, truth_table
+
+SESSIONS = [{'session_id': (1, 2), 'votes': {'40': 'M', '41': 'J'}}]
+
+def build(sessions):
+    build.calls += 1
+    return pd.DataFrame(
+        [{'session_id': session['session_id'], 'player_id': p_id, 'vote': vote}
+         for session in sessions for p_id, vote in session['votes'].items()],
+        columns=['session_id', 'player_id', 'vote']
+    )
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    build.calls = 0
+    (tmp_path / 'data.csv').write_text("session,vote\n1,M\n")
+
+def test_stored_truth_is_reused_across_runs():
+    first = truth_table('game', SESSIONS, build, 'data.csv')
+    # A later run, e.g. a new process, of the same data version
+    second = truth_table('game', list(SESSIONS), build, 'data.csv')
+    assert build.calls == 1
+    pd.testing.assert_frame_equal(second, first)
+    # The ids keep their types, unlike in the CSV
+    assert second['session_id'][0] == (1, 2) and second['player_id'][0] == '40'
+    assert len(load_truth('game')) == 2
+
+def test_new_data_version_is_rebuilt(tmp_path):
+    truth_table('game', SESSIONS, build, 'data.csv')
+    first_hash = current_hash('game')
+    (tmp_path / 'data.csv').write_text("session,vote\n1,J\n")
+    truth_table('game', [{'session_id': (1, 2), 'votes': {'40': 'J'}}], build, 'data.csv')
+    assert build.calls == 2
+    assert current_hash('game') != first_hash
+    assert load_truth('game')['vote'].tolist() == ['J']